@@ -0,0 +1,178 @@
+"""
+A memo of what we learned about each image URL while hunting for logos:
+its status, content type and dimensions.
+
+District sites built on the same hosted CMS share favicons and theme
+images, so a whole `find_logo.py all` run shares one AssetCache and each
+asset is measured once. Recently used entries are kept in memory; with a
+path, entries are also kept in SQLite across runs.
+
+Failures (404s, things that aren't images, unreachable hosts) are
+remembered too, but only for a short while, since sites get fixed.
+"""
+
+import sqlite3
+import time
+import typing as t
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+DEFAULT_TTL_DAYS = 30
+DEFAULT_NEGATIVE_TTL_HOURS = 1
+DEFAULT_MEMORY_ENTRIES = 10_000
+
+# Commit to disk every this many writes so a crash loses little work.
+COMMIT_EVERY = 100
+
+
+@dataclass(frozen=True)
+class AssetInfo:
+    # The HTTP status, or 0 if there was no response at all.
+    status: int
+    content_type: str
+    width: int | None
+    height: int | None
+    error: str
+    checked: float
+
+    @property
+    def size(self) -> tuple[int, int] | None:
+        if self.width is None or self.height is None:
+            return None
+        return self.width, self.height
+
+
+class AssetCache:
+    """
+    LRU map from image URL to AssetInfo, optionally backed by SQLite.
+
+    Keeps hit/miss counts for the lifetime of the object so callers can
+    report a hit rate.
+    """
+
+    def __init__(
+        self,
+        path: str | Path | None = None,
+        ttl_days: float = DEFAULT_TTL_DAYS,
+        negative_ttl_hours: float = DEFAULT_NEGATIVE_TTL_HOURS,
+        memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+    ):
+        self.ttl = ttl_days * 24 * 60 * 60
+        self.negative_ttl = negative_ttl_hours * 60 * 60
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, AssetInfo] = OrderedDict()
+        self._uncommitted = 0
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path)
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS assets (
+                    url TEXT PRIMARY KEY,
+                    status INTEGER NOT NULL,
+                    content_type TEXT NOT NULL,
+                    width INTEGER,
+                    height INTEGER,
+                    error TEXT NOT NULL,
+                    checked REAL NOT NULL
+                )
+                """
+            )
+
+    def __enter__(self) -> t.Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def is_fresh(self, info: AssetInfo) -> bool:
+        ttl = self.ttl if info.size is not None else self.negative_ttl
+        return time.time() - info.checked < ttl
+
+    def get(self, url: str) -> AssetInfo | None:
+        """
+        Look up an image URL. Expired entries count as misses.
+        """
+        info = self._memory.get(url)
+        if info is None and self._db is not None:
+            row = self._db.execute(
+                """
+                SELECT status, content_type, width, height, error, checked
+                FROM assets WHERE url = ?
+                """,
+                (url,),
+            ).fetchone()
+            if row is not None:
+                info = AssetInfo(*row)
+                self._remember(url, info)
+        if info is None or not self.is_fresh(info):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._memory.move_to_end(url)
+        return info
+
+    def put(self, url: str, info: AssetInfo) -> None:
+        self._remember(url, info)
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                url,
+                info.status,
+                info.content_type,
+                info.width,
+                info.height,
+                info.error,
+                info.checked,
+            ),
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def _remember(self, url: str, info: AssetInfo) -> None:
+        self._memory[url] = info
+        self._memory.move_to_end(url)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def evict(self) -> int:
+        """
+        Drop expired entries from the backing store. Returns the number of
+        entries removed.
+        """
+        if self._db is None:
+            return 0
+        now = time.time()
+        return self._db.execute(
+            """
+            DELETE FROM assets
+            WHERE checked < ?
+               OR ((width IS NULL OR height IS NULL) AND checked < ?)
+            """,
+            (now - self.ttl, now - self.negative_ttl),
+        ).rowcount
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"Asset cache: {self.hits} hits, {self.misses} misses "
+            f"({self.hit_rate:.1%} hit rate)"
+        )
+
+    def close(self) -> None:
+        if self._db is None:
+            return
+        self.evict()
+        self._db.commit()
+        self._db.close()
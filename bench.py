@@ -0,0 +1,712 @@
+"""
+Benchmark each stage of the NCES pipeline end to end.
+
+Every stage runs as its own script, exactly as you'd run it by hand, on the
+committed data/prelim files and on a synthetic national-size input built by
+scaling them up. For each run we record wall time, rows per second and the
+child's peak RSS.
+
+Stages that normally talk to Google or NCES run against a mock server
+started here on localhost instead. It answers geocoding requests with
+made-up coordinates and serves district detail pages laid out like the real
+ones, built from the districts CSVs, so nothing leaves the machine and
+results don't depend on anyone's network. They're limited by per-request
+work rather than file size, so by default they skip the synthetic input.
+
+Usage:
+    # Run everything and save the results:
+    python bench.py run -o bench-results.json
+
+    # Just the converters, on a smaller synthetic input:
+    python bench.py run --stage html2csv --stage csv2schools --scale 20000
+
+    # Fail if anything got more than 20% slower (or fatter) than a saved run:
+    python bench.py run --baseline bench-baseline.json
+    python bench.py compare bench-results.json bench-baseline.json
+
+    # How long `nces` and its subcommands take to start:
+    python bench.py startup --max-ms 100
+"""
+
+import contextlib
+import csv
+import hashlib
+import html
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import typing as t
+from dataclasses import asdict, dataclass
+from datetime import UTC, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import click
+
+from nceshtml2csv import HTML_ENCODING, HTML_EXTENSIONS, iter_dict_rows
+
+HERE = Path(__file__).resolve().parent
+DATA_DIR = HERE / "data" / "prelim"
+
+# There are just under 100,000 public schools in the US, and about a fifth
+# as many districts.
+DEFAULT_SCALE = 100_000
+DISTRICTS_PER_SCHOOL = 0.2
+
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.2
+
+# Generous limits so the stages run as fast as the mock server allows.
+NETWORK_OPTIONS = {
+    "geocode": ["--api_key", "bench", "--qps", "100000", "--concurrency", "32"],
+    "enhance": ["--min-delay", "0", "--workers", "32", "--max-per-host", "32"],
+}
+
+DETAIL_PATH = "/ccd/districtsearch/district_detail.asp"
+
+
+@dataclass(frozen=True)
+class Result:
+    stage: str
+    input: str
+    rows: int
+    seconds: float
+    rows_per_second: float
+    peak_rss_mb: float
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return self.stage, self.input
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    # Which files the stage reads, by kind: schools, geocoded, districts or
+    # html.
+    kind: str
+    network: bool = False
+
+    def command(self, path: Path, mock_url: str) -> list[str]:
+        python = sys.executable
+        if self.name == "html2csv":
+            return [python, str(HERE / "nceshtml2csv.py"), str(path)]
+        if self.name == "csv2schools":
+            return [python, str(HERE / "csv2schools.py"), str(path)]
+        if self.name == "csv2district":
+            return [python, str(HERE / "csv2district.py"), str(path)]
+        if self.name == "geocode":
+            return [
+                python,
+                str(HERE / "geocode.py"),
+                str(path),
+                "--api-url",
+                f"{mock_url}/geocode",
+                *NETWORK_OPTIONS["geocode"],
+            ]
+        if self.name == "enhance":
+            detail_url = f"{mock_url}{DETAIL_PATH}?ID2={{district_id}}"
+            return [
+                python,
+                str(HERE / "enhance_districts.py"),
+                "web",
+                str(path),
+                "--detail-url",
+                detail_url,
+                *NETWORK_OPTIONS["enhance"],
+            ]
+        raise AssertionError(f"Unknown stage {self.name}")
+
+
+STAGES = (
+    Stage("html2csv", "html"),
+    Stage("csv2schools", "geocoded"),
+    Stage("csv2district", "districts"),
+    Stage("geocode", "schools", network=True),
+    Stage("enhance", "districts", network=True),
+)
+
+
+# Commands timed by `startup`, and whether each should start quickly: the
+# CSV-only ones shouldn't be loading the network and HTML libraries.
+STARTUP_COMMANDS = (
+    ("python -c pass", ["-c", "pass"], False),
+    ("nces --help", ["nces.py", "--help"], True),
+    ("nces csv2district --help", ["nces.py", "csv2district", "--help"], True),
+    ("nces csv2schools --help", ["nces.py", "csv2schools", "--help"], True),
+    (
+        "nces enhance-districts fix-slashes --help",
+        ["nces.py", "enhance-districts", "fix-slashes", "--help"],
+        True,
+    ),
+    ("nces html2csv --help", ["nces.py", "html2csv", "--help"], True),
+    ("nces merge-districts --help", ["nces.py", "merge-districts", "--help"], True),
+    ("nces store --help", ["nces.py", "store", "--help"], True),
+    ("nces geocode --help", ["nces.py", "geocode", "--help"], False),
+    ("nces find-logo --help", ["nces.py", "find-logo", "--help"], False),
+    ("python csv2district.py --help", ["csv2district.py", "--help"], False),
+)
+
+DEFAULT_STARTUP_REPEAT = 10
+
+
+def corpus_files(data_dir: Path = DATA_DIR) -> dict[str, list[Path]]:
+    """
+    Find the committed inputs for each kind of stage.
+    """
+    files: dict[str, list[Path]] = {
+        "html": [],
+        "schools": [],
+        "geocoded": [],
+        "districts": [],
+    }
+    for path in sorted(data_dir.glob("*/*")):
+        if path.suffix.lower() in HTML_EXTENSIONS:
+            files["html"].append(path)
+        elif path.name.startswith("geocoded_"):
+            files["geocoded"].append(path)
+        elif path.name.endswith("_districts.csv"):
+            files["districts"].append(path)
+        elif path.suffix == ".csv":
+            files["schools"].append(path)
+    return files
+
+
+def read_rows(path: Path) -> t.Iterator[dict[str, str]]:
+    if path.suffix.lower() in HTML_EXTENSIONS:
+        with open(path, "r", encoding=HTML_ENCODING) as html_file:
+            yield from iter_dict_rows(html_file)
+    else:
+        with open(path, "r", encoding="utf-8", newline="") as csv_file:
+            yield from csv.DictReader(csv_file)
+
+
+def count_rows(path: Path) -> int:
+    return sum(1 for _ in read_rows(path))
+
+
+def scaled_rows(
+    paths: t.Iterable[Path], count: int, id_columns: t.Sequence[str]
+) -> t.Iterator[dict[str, str]]:
+    """
+    Cycle through the rows of `paths` until there are `count` of them,
+    giving each copy after the first its own IDs.
+    """
+    rows = [row for path in paths for row in read_rows(path)]
+    for i in range(count):
+        row = dict(rows[i % len(rows)])
+        copy = i // len(rows)
+        if copy:
+            for column in id_columns:
+                row[column] = f"{row[column]}{copy:03d}"
+        yield row
+
+
+def write_csv(path: Path, rows: t.Iterable[dict[str, str]]) -> None:
+    rows = iter(rows)
+    first = next(rows)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(first))
+        writer.writeheader()
+        writer.writerows(itertools.chain([first], rows))
+
+
+def write_html(path: Path, rows: t.Iterable[dict[str, str]]) -> None:
+    """
+    Write rows as an NCES-style HTML "spreadsheet".
+    """
+    rows = iter(rows)
+    first = next(rows)
+
+    def tr(cells: t.Iterable[str]) -> str:
+        return "<tr>" + "".join(f"<td>{html.escape(c)}</td>" for c in cells) + "</tr>\n"
+
+    with open(path, "w", encoding=HTML_ENCODING, errors="replace") as f:
+        f.write("<html><body><table>\n")
+        f.write(tr(first))
+        f.writelines(tr(row.values()) for row in itertools.chain([first], rows))
+        f.write("</table></body></html>\n")
+
+
+def synthesize(
+    work_dir: Path, scale: int, data_dir: Path = DATA_DIR
+) -> dict[str, list[Path]]:
+    """
+    Write a national-size set of inputs, `scale` schools strong, built by
+    repeating the committed ones.
+    """
+    corpus = corpus_files(data_dir)
+    school_ids = ["NCES School ID", "NCES District ID"]
+    district_ids = ["NCES District ID"]
+    districts = int(scale * DISTRICTS_PER_SCHOOL)
+    files = {
+        "html": [
+            work_dir / "national_schools.html",
+            work_dir / "national_districts.html",
+        ],
+        "schools": [work_dir / "national_schools.csv"],
+        "geocoded": [work_dir / "geocoded_national_schools.csv"],
+        "districts": [work_dir / "national_districts.csv"],
+    }
+    write_csv(files["schools"][0], scaled_rows(corpus["schools"], scale, school_ids))
+    write_csv(files["geocoded"][0], scaled_rows(corpus["geocoded"], scale, school_ids))
+    write_csv(
+        files["districts"][0], scaled_rows(corpus["districts"], districts, district_ids)
+    )
+    write_html(files["html"][0], read_rows(files["schools"][0]))
+    write_html(files["html"][1], read_rows(files["districts"][0]))
+    return files
+
+
+def detail_page(district: dict[str, str]) -> str:
+    """
+    A district detail page with the same structure as NCES's, padded to
+    about the same size.
+    """
+    website = f"www.{district['NCES District ID']}.k12.example.us"
+    city_state = f"{district['City']}&nbsp;{district['State']}"
+    zip_line = f"{district['ZIP']} &ndash;{district['ZIP 4-digit']}"
+    street = html.escape(district["Street Address"])
+    filler = "".join(
+        f"<tr><td><span>Field {i}:</span></td><td>{i * 37}</td></tr>"
+        for i in range(400)
+    )
+    return (
+        "<html><head><title>District Detail</title></head><body>"
+        "<table>"
+        f"<tr><td><span>District Name:</span> {html.escape(district['District Name'])}</td></tr>"
+        f'<tr><td><span>Website:</span></td><td><a href="/transfer.asp?location={website}">{website}</a></td></tr>'
+        f"<tr><td><span>Mailing Address:</span> <span>{street}</span> <span>{city_state}</span> <span>{zip_line}</span></td></tr>"
+        f'<tr><td><span>Physical Address:</span> <a href="https://maps.example/"><span>{street}</span><span>{city_state}</span><span>{zip_line}</span></a></td></tr>'
+        f"</table><table>{filler}</table></body></html>"
+    )
+
+
+class MockServer:
+    """
+    A local stand-in for the Google geocoding API and NCES's district
+    detail pages, running in a background thread.
+    """
+
+    def __init__(self, district_files: t.Iterable[Path]):
+        self.districts = {
+            row["NCES District ID"]: row
+            for path in district_files
+            for row in read_rows(path)
+        }
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; don't let them
+            # wait on delayed ACKs.
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == "/geocode":
+                    status, body, content_type = (
+                        200,
+                        geocode_body(query),
+                        "application/json",
+                    )
+                elif url.path == DETAIL_PATH and (
+                    district := server.districts.get(query.get("ID2", [""])[0])
+                ):
+                    status, body, content_type = 200, detail_page(district), "text/html"
+                else:
+                    status, body, content_type = 404, "", "text/plain"
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 256
+
+        self._httpd = Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def __enter__(self) -> t.Self:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def geocode_body(query: dict[str, list[str]]) -> str:
+    address = query.get("address", [""])[0]
+    digest = int.from_bytes(hashlib.blake2b(address.encode(), digest_size=8).digest())
+    lat = 25 + (digest % 2_400_000) / 100_000
+    lng = -70 - (digest // 2_400_000 % 5_400_000) / 100_000
+    return json.dumps(
+        {
+            "status": "OK",
+            "results": [{"geometry": {"location": {"lat": lat, "lng": lng}}}],
+        }
+    )
+
+
+# Linux counts a forked child's share of its parent towards the child's
+# peak RSS, so stages are started from this tiny launcher rather than from
+# the benchmark process. It reports the stage's wall time, peak RSS (in the
+# platform's ru_maxrss units) and exit code on stdout.
+LAUNCHER = """
+import os, sys, time
+devnull = [(os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0)]
+start = time.perf_counter()
+pid = os.posix_spawnp(sys.argv[1], sys.argv[1:], os.environ, file_actions=devnull)
+_, status, usage = os.wait4(pid, 0)
+elapsed = time.perf_counter() - start
+print(elapsed, usage.ru_maxrss, os.waitstatus_to_exitcode(status))
+"""
+
+
+def peak_rss_mb(maxrss: int) -> float:
+    # Linux reports kilobytes, macOS bytes.
+    scale = 1 if sys.platform == "darwin" else 1024
+    return maxrss * scale / (1024 * 1024)
+
+
+def time_command(command: list[str]) -> tuple[float, float]:
+    """
+    Run a command to completion, returning its wall time in seconds and
+    peak RSS in MiB.
+
+    Raises RuntimeError if it fails.
+    """
+    launched = subprocess.run(
+        [sys.executable, "-I", "-S", "-c", LAUNCHER, *command],
+        capture_output=True,
+        cwd=HERE,
+        check=False,
+    )
+    stderr = launched.stderr.decode(errors="replace")
+    if launched.returncode != 0:
+        # The launcher itself failed, so there's no timing line to read.
+        raise RuntimeError(
+            f"Launching {' '.join(command)} failed with {launched.returncode}:\n"
+            + stderr
+        )
+    elapsed, maxrss, returncode = launched.stdout.split()
+    if int(returncode) != 0:
+        raise RuntimeError(
+            f"{' '.join(command)} exited with {int(returncode)}:\n" + stderr
+        )
+    return float(elapsed), peak_rss_mb(int(maxrss))
+
+
+def run_stage(
+    stage: Stage, path: Path, label: str, rows: int, mock_url: str, repeat: int
+) -> Result:
+    """
+    Time a stage over one input, keeping the fastest of `repeat` runs.
+    """
+    runs = [time_command(stage.command(path, mock_url)) for _ in range(repeat)]
+    seconds = min(elapsed for elapsed, _ in runs)
+    return Result(
+        stage=stage.name,
+        input=label,
+        rows=rows,
+        seconds=round(seconds, 4),
+        rows_per_second=round(rows / seconds, 1),
+        peak_rss_mb=round(max(rss for _, rss in runs), 1),
+    )
+
+
+def load_results(path: str | Path) -> dict[tuple[str, str], Result]:
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    results = (Result(**result) for result in report["results"])
+    return {result.key: result for result in results}
+
+
+def compare(
+    results: t.Iterable[Result],
+    baseline: dict[tuple[str, str], Result],
+    threshold: float,
+) -> int:
+    """
+    Print each result against its baseline. Returns the number that got
+    slower, or used more memory, by more than `threshold`.
+    """
+    regressions = 0
+    print(
+        f"{'stage':<13} {'input':<40} {'seconds':>9} {'vs base':>8} "
+        f"{'RSS MiB':>8} {'vs base':>8}"
+    )
+    for result in results:
+        line = f"{result.stage:<13} {result.input:<40} {result.seconds:>9.3f} "
+        base = baseline.get(result.key)
+        if base is None:
+            print(f"{line}{'':>8} {result.peak_rss_mb:>8.1f}   (new)")
+            continue
+        slower = result.seconds > base.seconds * (1 + threshold)
+        fatter = result.peak_rss_mb > base.peak_rss_mb * (1 + threshold)
+        regressions += slower or fatter
+        print(
+            f"{line}{result.seconds / base.seconds - 1:>+8.1%} "
+            f"{result.peak_rss_mb:>8.1f} "
+            f"{result.peak_rss_mb / base.peak_rss_mb - 1:>+8.1%}"
+            + ("  REGRESSION" if slower or fatter else "")
+        )
+    return regressions
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option(
+    "--stage",
+    "stage_names",
+    multiple=True,
+    type=click.Choice([stage.name for stage in STAGES]),
+    help="Run only this stage; may be repeated. Defaults to all of them.",
+)
+@click.option(
+    "--scale",
+    default=DEFAULT_SCALE,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Schools in the synthetic national input; 0 to skip it.",
+)
+@click.option(
+    "--synthetic-network",
+    is_flag=True,
+    help="Run the network stages on the synthetic input too; this takes a while.",
+)
+@click.option(
+    "--repeat",
+    default=DEFAULT_REPEAT,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Runs per stage and input; the fastest is kept.",
+)
+@click.option(
+    "--work-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Keep the synthetic inputs here instead of a temporary directory.",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Save the results as JSON here.",
+)
+@click.option(
+    "--baseline",
+    "baseline_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Compare against results saved earlier, failing on regressions.",
+)
+@click.option(
+    "--threshold",
+    default=DEFAULT_THRESHOLD,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="How much slower or bigger than the baseline counts as a regression.",
+)
+def run(
+    stage_names: tuple[str, ...],
+    scale: int,
+    synthetic_network: bool,
+    repeat: int,
+    work_dir: Path | None,
+    output_path: str | None,
+    baseline_path: str | None,
+    threshold: float,
+):
+    """
+    Benchmark the pipeline stages on data/prelim and a synthetic national
+    input.
+    """
+    stages = [stage for stage in STAGES if not stage_names or stage.name in stage_names]
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        work_dir.mkdir(parents=True, exist_ok=True)
+
+        inputs = {
+            kind: [(path, str(path.relative_to(DATA_DIR))) for path in paths]
+            for kind, paths in corpus_files().items()
+        }
+        if scale:
+            print(f"Writing a synthetic input of {scale} schools...", file=sys.stderr)
+            for kind, paths in synthesize(work_dir, scale).items():
+                inputs[kind] += [(path, f"synthetic/{path.name}") for path in paths]
+
+        mock = stack.enter_context(MockServer(path for path, _ in inputs["districts"]))
+        results = []
+        for stage in stages:
+            for path, label in inputs[stage.kind]:
+                synthetic = label.startswith("synthetic/")
+                if stage.network and synthetic and not synthetic_network:
+                    continue
+                rows = count_rows(path)
+                result = run_stage(stage, path, label, rows, mock.url, repeat)
+                print(
+                    f"{stage.name:<13} {label:<40} {result.seconds:8.3f}s "
+                    f"{result.rows_per_second:>10.0f} rows/s "
+                    f"{result.peak_rss_mb:7.1f} MiB",
+                    file=sys.stderr,
+                )
+                results.append(result)
+
+    report = {
+        "created": datetime.now(UTC).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scale": scale,
+        "repeat": repeat,
+        "results": [asdict(result) for result in results],
+    }
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if baseline_path:
+        regressions = compare(results, load_results(baseline_path), threshold)
+        if regressions:
+            raise click.ClickException(
+                f"{regressions} results regressed by more than {threshold:.0%}"
+            )
+
+
+@main.command()
+@click.option(
+    "--repeat",
+    default=DEFAULT_STARTUP_REPEAT,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Runs per command; the fastest is kept.",
+)
+@click.option(
+    "--max-ms",
+    type=click.FloatRange(min=0),
+    help="Fail if any of the CSV-only commands takes longer than this.",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Save the results as JSON here.",
+)
+@click.option(
+    "--baseline",
+    "baseline_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Compare against results saved earlier, failing on regressions.",
+)
+@click.option(
+    "--threshold",
+    default=DEFAULT_THRESHOLD,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="How much slower or bigger than the baseline counts as a regression.",
+)
+def startup(
+    repeat: int,
+    max_ms: float | None,
+    output_path: str | None,
+    baseline_path: str | None,
+    threshold: float,
+):
+    """
+    Time how long `nces` and its subcommands take to start, by running
+    their --help.
+    """
+    results = []
+    too_slow = []
+    for label, args, light in STARTUP_COMMANDS:
+        runs = [time_command([sys.executable, *args]) for _ in range(repeat)]
+        times = sorted(elapsed for elapsed, _ in runs)
+        result = Result(
+            stage="startup",
+            input=label,
+            rows=0,
+            seconds=round(times[0], 4),
+            rows_per_second=0.0,
+            peak_rss_mb=round(max(rss for _, rss in runs), 1),
+        )
+        print(
+            f"{label:<42} {times[0] * 1000:7.1f} ms fastest "
+            f"{times[len(times) // 2] * 1000:7.1f} ms median "
+            f"{result.peak_rss_mb:7.1f} MiB",
+            file=sys.stderr,
+        )
+        if light and max_ms is not None and times[0] * 1000 > max_ms:
+            too_slow.append(label)
+        results.append(result)
+
+    if output_path:
+        report = {
+            "created": datetime.now(UTC).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+            "results": [asdict(result) for result in results],
+        }
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if baseline_path:
+        regressions = compare(results, load_results(baseline_path), threshold)
+        if regressions:
+            raise click.ClickException(
+                f"{regressions} results regressed by more than {threshold:.0%}"
+            )
+    if too_slow:
+        raise click.ClickException(
+            f"Slower than {max_ms:g} ms to start: {', '.join(too_slow)}"
+        )
+
+
+@main.command("compare")
+@click.argument("results_path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("baseline_path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--threshold",
+    default=DEFAULT_THRESHOLD,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="How much slower or bigger than the baseline counts as a regression.",
+)
+def compare_results(results_path: str, baseline_path: str, threshold: float):
+    """
+    Compare saved results against a saved baseline, failing on regressions.
+    """
+    results = load_results(results_path).values()
+    regressions = compare(results, load_results(baseline_path), threshold)
+    if regressions:
+        raise click.ClickException(
+            f"{regressions} results regressed by more than {threshold:.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
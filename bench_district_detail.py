@@ -0,0 +1,139 @@
+"""
+Micro-benchmark for parsing NCES district detail pages.
+
+Times the original per-field lookups, which rescan the whole page for every
+label, against DistrictDetailPage, which indexes the labels in one pass,
+for each installed parser. Checks that every approach extracts the same
+fields and prints the per-page parse time.
+
+Usage:
+    # Saved detail pages, as files or directories of .html files:
+    python bench_district_detail.py pages/
+
+    # Pages already in the scraper's HTTP cache:
+    python bench_district_detail.py --cache-dir .http-cache
+"""
+
+import sys
+import time
+import typing as t
+from pathlib import Path
+
+import click
+import httpx
+from bs4 import BeautifulSoup
+
+from enhance_districts import (
+    PARSERS,
+    DistrictDetailPage,
+    available_parsers,
+    get_mailing_address,
+    get_physical_address,
+    get_website_url,
+)
+from http_cache import ResponseCache
+
+
+def iter_saved_pages(paths: t.Iterable[str]) -> t.Iterator[str]:
+    for name in paths:
+        path = Path(name)
+        files = sorted(path.glob("*.htm*")) if path.is_dir() else [path]
+        for file in files:
+            yield file.read_text(encoding="utf-8", errors="replace")
+
+
+def iter_cached_pages(cache_dir: str) -> t.Iterator[str]:
+    """
+    Yield the body of every cached district detail page.
+    """
+    cache = ResponseCache(cache_dir, offline=True)
+    entries = [
+        entry
+        for entry in cache.entries()
+        if "district_detail" in entry.url and entry.status_code == 200
+    ]
+    for entry in sorted(entries, key=lambda entry: entry.url):
+        request = httpx.Request("GET", entry.url)
+        yield (
+            cache.build_response(request, entry)
+            .read()
+            .decode("utf-8", errors="replace")
+        )
+
+
+def parse_legacy(html: str, parser: str) -> tuple[str, str, str]:
+    soup = BeautifulSoup(html, parser)
+    return (
+        get_website_url(soup),
+        repr(get_mailing_address(soup)),
+        repr(get_physical_address(soup)),
+    )
+
+
+def parse_indexed(html: str, parser: str) -> tuple[str, str, str]:
+    page = DistrictDetailPage(html, parser=parser)
+    return (
+        page.website_url,
+        repr(page.mailing_address),
+        repr(page.physical_address),
+    )
+
+
+def time_parse(
+    func: t.Callable[[str, str], tuple[str, str, str]],
+    pages: list[str],
+    parser: str,
+    repeat: int,
+) -> tuple[float, list[tuple[str, str, str]]]:
+    """
+    Return the best per-page time, in seconds, over `repeat` passes, and the
+    fields extracted from each page.
+    """
+    best = float("inf")
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [func(html, parser) for html in pages]
+        best = min(best, (time.perf_counter() - start) / len(pages))
+    return best, results
+
+
+@click.command()
+@click.argument("paths", nargs=-1, type=click.Path(exists=True))
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, exists=True),
+    help="Benchmark detail pages stored in this HTTP cache.",
+)
+@click.option(
+    "--repeat",
+    default=3,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Passes over the pages; the fastest is reported.",
+)
+def bench(paths, cache_dir, repeat):
+    """
+    Compare detail page parse times before and after label indexing.
+    """
+    pages = list(iter_saved_pages(paths))
+    if cache_dir:
+        pages += list(iter_cached_pages(cache_dir))
+    if not pages:
+        raise click.UsageError("No detail pages given.")
+    print(f"{len(pages)} pages, best of {repeat}", file=sys.stderr)
+
+    baseline, expected = time_parse(parse_legacy, pages, PARSERS[0], repeat)
+    print(f"{'legacy ' + PARSERS[0]:<20} {baseline * 1000:8.2f} ms/page")
+    for parser in available_parsers():
+        elapsed, results = time_parse(parse_indexed, pages, parser, repeat)
+        mismatches = sum(a != b for a, b in zip(expected, results))
+        print(
+            f"{'indexed ' + parser:<20} {elapsed * 1000:8.2f} ms/page "
+            f"({baseline / elapsed:.2f}x)"
+            + (f", {mismatches} pages differ" if mismatches else "")
+        )
+
+
+if __name__ == "__main__":
+    bench()
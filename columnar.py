@@ -0,0 +1,472 @@
+"""
+Load NCES school and district files into typed columns, and roll schools
+up by district or county.
+
+NCES numbers arrive as text like "334.00000", with † (not applicable),
+‡ (doesn't meet data quality standards) or – (missing) where there's no
+value. load() parses each numeric column once into a flat array of
+numbers, alongside a mask saying for every row whether the value is there
+and, if not, which marker stood in for it:
+
+    frame = load(["data/prelim/wa/geocoded_washington_schools.csv"])
+    students = frame["Students*"]
+    students.values[0], students.missing[0]   # 159, PRESENT
+    students.sum(), students.count()            # over the values present
+
+Which columns are numbers, and whether they're counts or decimals, comes
+from nces_store.py's table definitions, so a column is typed here exactly
+as it is in the SQLite store.
+
+rollup() totals schools per NCES District ID, or per state and county:
+school counts by level (as determine_school_level assigns them), students,
+teachers, the student/teacher ratio and the free and reduced-price lunch
+(FRL) percentage. Work happens a column at a time using the masks rather
+than row by row, so rolling up all 20,000-odd schools in the repo takes
+about a tenth of a second; loading the CSVs takes most of the time.
+
+    python columnar.py rollup --by district data/prelim/*/geocoded_*.csv > districts.csv
+    python columnar.py rollup --by county data/prelim/wa/washington_schools.csv
+    python columnar.py describe data/prelim/wa/washington_districts.html
+"""
+
+import contextlib
+import csv
+import itertools
+import sys
+import time
+import typing as t
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+import click
+
+from compressed import data_suffix, open_input
+from csv2schools import determine_school_level
+from journal import atomic_output
+from nces_store import (
+    DISTRICT_ID_COLUMN,
+    SCHOOL_ID_COLUMN,
+    SCHOOLS,
+    Table,
+    table_for,
+)
+from nceshtml2csv import HTML_ENCODING, HTML_EXTENSIONS, iter_csv_rows, iter_table_rows
+
+# Why a value is missing, as recorded in a column's mask.
+PRESENT = 0
+BLANK = 1
+NOT_APPLICABLE = 2
+LOW_QUALITY = 3
+MISSING = 4
+
+MISSING_CODES = {"": BLANK, "†": NOT_APPLICABLE, "‡": LOW_QUALITY, "–": MISSING}
+MISSING_NAMES = {
+    BLANK: "blank",
+    NOT_APPLICABLE: "† not applicable",
+    LOW_QUALITY: "‡ low quality",
+    MISSING: "– missing",
+}
+
+# array typecodes for nces_store's numeric column types.
+TYPECODES = {"INTEGER": "q", "REAL": "d"}
+
+# Maps a mask to one with 1 where there's a value and 0 where there isn't,
+# for itertools.compress.
+_PRESENT_TABLE = bytes([1] + [0] * 255)
+
+LEVELS = ["Pre-K", "Elementary", "Middle", "High"]
+
+
+@dataclass(frozen=True)
+class TypedColumn:
+    name: str
+    # "TEXT", "INTEGER" or "REAL", as in nces_store.py.
+    type: str
+    # An array of numbers, or a list of strings for text. Missing values
+    # are 0 or "".
+    values: t.Any
+    # PRESENT, or why the value is missing, for each row.
+    missing: bytearray
+
+    def __len__(self) -> int:
+        return len(self.missing)
+
+    def present(self) -> bytes:
+        """
+        1 for each row with a value, 0 for each without.
+        """
+        return self.missing.translate(_PRESENT_TABLE)
+
+    def count(self) -> int:
+        return self.missing.count(PRESENT)
+
+    def sum(self) -> float:
+        return sum(itertools.compress(self.values, self.present()))
+
+    def missing_counts(self) -> dict[str, int]:
+        return {
+            name: count
+            for code, name in MISSING_NAMES.items()
+            if (count := self.missing.count(code))
+        }
+
+
+@dataclass(frozen=True)
+class Frame:
+    # nces_store.SCHOOLS or nces_store.DISTRICTS.
+    table: Table
+    columns: dict[str, TypedColumn]
+    size: int
+
+    def __getitem__(self, name: str) -> TypedColumn:
+        return self.columns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+
+def all_present(*masks: bytes) -> bytes:
+    """
+    Combine 0/1 masks, giving 1 only where every mask has 1.
+    """
+    size = len(masks[0])
+    combined = int.from_bytes(masks[0])
+    for mask in masks[1:]:
+        combined &= int.from_bytes(mask)
+    return combined.to_bytes(size)
+
+
+def read_table(path: str | Path) -> t.Iterator[list[str]]:
+    """
+    Yield the header row, then every data row, of a CSV or NCES HTML export.
+    """
+    path = Path(path)
+    if data_suffix(path) in HTML_EXTENSIONS:
+        with open_input(path, encoding=HTML_ENCODING) as html_file:
+            yield from iter_csv_rows(iter_table_rows(html_file))
+    else:
+        with open_input(path, newline="") as csv_file:
+            yield from csv.reader(csv_file)
+
+
+def parse_column(name: str, type: str, cells: t.Sequence[str]) -> TypedColumn:
+    """
+    Parse one column of cells into typed values and a missing-value mask.
+
+    Raises ValueError for numbers that don't parse.
+    """
+    missing = bytearray(len(cells))
+    codes = MISSING_CODES
+    if type not in TYPECODES:
+        values = []
+        for i, cell in enumerate(cells):
+            cell = cell.strip()
+            if (code := codes.get(cell)) is not None:
+                missing[i] = code
+                cell = ""
+            values.append(cell)
+        return TypedColumn(name, type, values, missing)
+
+    numbers = array(TYPECODES[type], bytes(8 * len(cells)))
+    integer = type == "INTEGER"
+    for i, cell in enumerate(cells):
+        cell = cell.strip()
+        if (code := codes.get(cell)) is not None:
+            missing[i] = code
+            continue
+        try:
+            number = float(cell)
+        except ValueError:
+            raise ValueError(f"{name}, row {i + 1}: {cell!r} isn't a number")
+        # NCES writes counts as "159.00000".
+        numbers[i] = round(number) if integer else number
+    return TypedColumn(name, type, numbers, missing)
+
+
+def load(paths: t.Iterable[str | Path]) -> Frame:
+    """
+    Load one or more schools files, or one or more districts files, into
+    typed columns. Files may have different columns; cells a file doesn't
+    have are blank.
+
+    Raises ValueError if the files aren't NCES schools or districts, or
+    hold numbers that don't parse.
+    """
+    readers = [read_table(path) for path in paths]
+    headers = [next(reader, None) or [] for reader in readers]
+    fieldnames: list[str] = []
+    for header in headers:
+        fieldnames += [name for name in header if name not in fieldnames]
+    table = table_for(fieldnames)
+
+    rows: list[t.Sequence[str]] = []
+    width = len(fieldnames)
+    for header, reader in zip(headers, readers):
+        if header == fieldnames:
+            rows += (
+                row if len(row) == width else (row + [""] * width)[:width]
+                for row in reader
+            )
+        else:
+            positions = [header.index(n) if n in header else None for n in fieldnames]
+            rows += (
+                [row[p] if p is not None and p < len(row) else "" for p in positions]
+                for row in reader
+            )
+
+    cells = list(zip(*rows)) if rows else [() for _ in fieldnames]
+    columns = {}
+    for name, column_cells in zip(fieldnames, cells):
+        column = table.column(name)
+        columns[name] = parse_column(
+            name, column.type if column else "TEXT", column_cells
+        )
+    return Frame(table, columns, len(rows))
+
+
+@dataclass(frozen=True)
+class Grouping:
+    # Rows are grouped by these columns together...
+    key: tuple[str, ...]
+    # ...and each group is labelled with the first value of these.
+    labels: tuple[str, ...] = ()
+
+
+GROUPINGS = {
+    "district": Grouping(key=(DISTRICT_ID_COLUMN,), labels=("District", "State")),
+    "county": Grouping(key=("State", "County Name*")),
+}
+
+ROLLUP_COLUMNS = [
+    "Schools",
+    *(f"{level} Schools" for level in LEVELS),
+    "Students",
+    "Teachers",
+    "Student Teacher Ratio",
+    "Free Lunch",
+    "Reduced Lunch",
+    "FRL %",
+]
+
+
+def factorize(values: t.Iterable[t.Hashable]) -> tuple[array, list[t.Any]]:
+    """
+    Number each distinct value in order of first appearance. Returns each
+    row's number and the distinct values.
+    """
+    values = list(values)
+    keys = list(dict.fromkeys(values))
+    index = dict(zip(keys, range(len(keys))))
+    return array("l", map(index.__getitem__, values)), keys
+
+
+def group_sums(
+    codes: array, groups: int, values: t.Sequence[float], mask: bytes
+) -> list[float]:
+    sums = [0] * groups
+    for group, value in itertools.compress(zip(codes, values), mask):
+        sums[group] += value
+    return sums
+
+
+def rollup(frame: Frame, by: str = "district") -> tuple[list[str], list[dict]]:
+    """
+    Total a schools frame per district or county. Returns the output
+    columns and one row per group, sorted by the grouping key.
+
+    A school listed more than once is counted once. Totals only include
+    schools that report the values involved, so the FRL percentage, for
+    instance, only covers schools that report students and both lunch
+    counts. A total is blank if no school in the group reports it.
+    """
+    if frame.table is not SCHOOLS:
+        raise ValueError("Rollups need a schools file")
+    grouping = GROUPINGS[by]
+
+    # Count each school once, as csv2schools.py does.
+    school_ids = frame[SCHOOL_ID_COLUMN].values
+    seen: set[str] = set()
+    first = bytes(
+        not (school_id in seen or seen.add(school_id)) for school_id in school_ids
+    )
+
+    key_columns = [frame[name].values for name in grouping.key]
+    codes, keys = factorize(
+        key_columns[0] if len(key_columns) == 1 else zip(*key_columns)
+    )
+    groups = len(keys)
+
+    def present(*names: str) -> bytes:
+        return all_present(first, *(frame[name].present() for name in names))
+
+    schools = Counter(itertools.compress(codes, first))
+
+    # Schools with the same grades have the same levels, and there are only
+    # a few dozen combinations of grades.
+    grade_codes, grades = factorize(
+        zip(frame["Low Grade*"].values, frame["High Grade*"].values)
+    )
+    grade_levels = [
+        determine_school_level(low, high).split(",") for low, high in grades
+    ]
+    levels: dict[str, list[int]] = {level: [0] * groups for level in LEVELS}
+    for (group, grade), count in Counter(
+        itertools.compress(zip(codes, grade_codes), first)
+    ).items():
+        for level in grade_levels[grade]:
+            if level:
+                levels[level][group] += count
+
+    def total(name: str) -> tuple[list[float], Counter[int]]:
+        mask = present(name)
+        sums = group_sums(codes, groups, frame[name].values, mask)
+        return sums, Counter(itertools.compress(codes, mask))
+
+    students, students_reported = total("Students*")
+    teachers, teachers_reported = total("Teachers*")
+    free_lunch, free_lunch_reported = total("Free Lunch*")
+    reduced_lunch, reduced_lunch_reported = total("Reduced Lunch*")
+
+    # Ratios only count schools that report both sides of them.
+    staffed = present("Students*", "Teachers*")
+    ratio_students = group_sums(codes, groups, frame["Students*"].values, staffed)
+    ratio_teachers = group_sums(codes, groups, frame["Teachers*"].values, staffed)
+    frl_mask = present("Students*", "Free Lunch*", "Reduced Lunch*")
+    frl_students = group_sums(codes, groups, frame["Students*"].values, frl_mask)
+    frl_free = group_sums(codes, groups, frame["Free Lunch*"].values, frl_mask)
+    frl_reduced = group_sums(codes, groups, frame["Reduced Lunch*"].values, frl_mask)
+
+    # Labels come from the same rows as the totals.
+    labels: list[dict[str, str]] = [{} for _ in range(groups)]
+    for name in grouping.labels:
+        for group, value in itertools.compress(zip(codes, frame[name].values), first):
+            if value and name not in labels[group]:
+                labels[group][name] = value
+
+    def reported(value: float, count: int, digits: int | None = None) -> t.Any:
+        if not count:
+            return ""
+        return round(value, digits) if digits is not None else value
+
+    rows = []
+    for group, key in enumerate(keys):
+        key = key if isinstance(key, tuple) else (key,)
+        row: dict[str, t.Any] = dict(zip(grouping.key, key))
+        row.update({name: labels[group].get(name, "") for name in grouping.labels})
+        row["Schools"] = schools[group]
+        for level in LEVELS:
+            row[f"{level} Schools"] = levels[level][group]
+        row["Students"] = reported(students[group], students_reported[group])
+        row["Teachers"] = reported(teachers[group], teachers_reported[group], 2)
+        row["Student Teacher Ratio"] = (
+            round(ratio_students[group] / ratio_teachers[group], 2)
+            if ratio_teachers[group]
+            else ""
+        )
+        row["Free Lunch"] = reported(free_lunch[group], free_lunch_reported[group])
+        row["Reduced Lunch"] = reported(
+            reduced_lunch[group], reduced_lunch_reported[group]
+        )
+        row["FRL %"] = (
+            round(100 * (frl_free[group] + frl_reduced[group]) / frl_students[group], 1)
+            if frl_students[group]
+            else ""
+        )
+        rows.append(row)
+    rows.sort(key=lambda row: tuple(row[name] for name in grouping.key))
+    fieldnames = [*grouping.key, *grouping.labels, *ROLLUP_COLUMNS]
+    return fieldnames, rows
+
+
+def load_or_fail(paths: t.Iterable[str]) -> Frame:
+    try:
+        return load(paths)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@click.group()
+def main():
+    """
+    Load NCES files into typed columns and roll schools up by district or
+    county.
+    """
+
+
+@main.command("rollup")
+@click.argument(
+    "paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.option(
+    "--by",
+    default="district",
+    show_default=True,
+    type=click.Choice(list(GROUPINGS)),
+    help="Total schools per district or per state and county.",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Write the CSV here (atomically) instead of stdout.",
+)
+def rollup_files(paths: tuple[str, ...], by: str, output_path: str | None):
+    """
+    Total NCES school files (raw, converted or geocoded) per district or
+    county, as CSV.
+    """
+    start = time.perf_counter()
+    frame = load_or_fail(paths)
+    loaded = time.perf_counter()
+    try:
+        fieldnames, rows = rollup(frame, by)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    done = time.perf_counter()
+
+    with contextlib.ExitStack() as stack:
+        out = (
+            stack.enter_context(atomic_output(output_path))
+            if output_path
+            else sys.stdout
+        )
+        csv_writer = csv.DictWriter(out, fieldnames=fieldnames)
+        csv_writer.writeheader()
+        csv_writer.writerows(rows)
+    print(
+        f"Rolled {frame.size} schools up into {len(rows)} {by} rows "
+        f"(loaded in {loaded - start:.2f}s, rolled up in {done - loaded:.3f}s)",
+        file=sys.stderr,
+    )
+
+
+@main.command()
+@click.argument(
+    "paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+def describe(paths: tuple[str, ...]):
+    """
+    Summarize each column of NCES files: its type, how many rows have a
+    value, why the rest don't and, for numbers, their range and total.
+    """
+    frame = load_or_fail(paths)
+    print(f"{frame.size} {frame.table.name}")
+    for column in frame.columns.values():
+        line = f"{column.name:<28} {column.type:<8} {column.count():>8} present"
+        if column.type in TYPECODES and column.count():
+            present = list(itertools.compress(column.values, column.present()))
+            line += (
+                f"  min {min(present):g}  max {max(present):g}  sum {sum(present):g}"
+            )
+        if missing := column.missing_counts():
+            line += (
+                "  (" + ", ".join(f"{n} {name}" for name, n in missing.items()) + ")"
+            )
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Read and write .gz, .zst and .xz files as if they were plain text.
+
+The raw NCES downloads compress 20 times or more, so they can stay
+compressed on disk. Everything that reads an input file opens it with
+open_input(), which recognizes gzip, Zstandard and xz data by its first
+few bytes, whatever the file is called, and decompresses it as it's read.
+Standard input ("-") works the same way. Nothing is decompressed to a
+temporary file or read into memory all at once, so the scripts that
+stream their input still run in constant memory.
+
+Output is compressed when the file name asks for it: open_output() and
+journal.atomic_output() compress `schools.csv.gz` with gzip,
+`schools.csv.zst` with Zstandard and `schools.csv.xz` with xz. xz makes
+the smallest files but is several times slower than the others to write,
+and its compressor takes about 100MB of memory whatever the input size.
+
+Zstandard is built into Python from 3.14 (compression.zstd). On older
+Pythons, .zst files need the `zstandard` package; gzip and xz always work.
+"""
+
+import gzip
+import io
+import lzma
+import sys
+import typing as t
+from pathlib import Path
+
+import click
+
+GZIP = "gz"
+ZSTD = "zst"
+XZ = "xz"
+
+# The magic bytes each format starts with.
+MAGIC = {
+    GZIP: b"\x1f\x8b",
+    ZSTD: b"\x28\xb5\x2f\xfd",
+    XZ: b"\xfd7zXZ\x00",
+}
+MAGIC_LENGTH = max(len(magic) for magic in MAGIC.values())
+
+SUFFIXES = {".gz": GZIP, ".zst": ZSTD, ".xz": XZ}
+
+# zlib's default, and gzip's; level 9 is several times slower for a few
+# percent.
+GZIP_LEVEL = 6
+
+
+def compression_for(path: str | Path) -> str | None:
+    """
+    The compression a file's name asks for (GZIP, ZSTD or XZ), if any.
+    """
+    return SUFFIXES.get(Path(path).suffix.lower())
+
+
+def sniff_compression(head: bytes) -> str | None:
+    """
+    The compression the first bytes of a file say it uses, if any.
+    """
+    for compression, magic in MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def uncompressed_path(path: str | Path) -> Path:
+    """
+    `path` without its compression suffix, so "schools.xls.gz" gives
+    "schools.xls".
+    """
+    path = Path(path)
+    return path.with_suffix("") if compression_for(path) else path
+
+
+def data_suffix(path: str | Path) -> str:
+    """
+    The lower-cased suffix of the data inside a possibly compressed file:
+    ".xls" for "schools.xls.gz" as well as for "schools.xls".
+    """
+    return uncompressed_path(path).suffix.lower()
+
+
+def _zstd_file(raw: t.BinaryIO, mode: str) -> t.BinaryIO:
+    try:
+        from compression import zstd
+    except ImportError:
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError(
+                "Zstandard (.zst) files need Python 3.14 or the zstandard package"
+            ) from None
+        if mode == "rb":
+            return zstandard.ZstdDecompressor().stream_reader(
+                raw, read_across_frames=True, closefd=False
+            )
+        return zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+    return zstd.ZstdFile(raw, mode)
+
+
+def _compressed_file(raw: t.BinaryIO, compression: str, mode: str) -> t.BinaryIO:
+    """
+    Wrap a binary file in a (de)compressor that leaves it open when closed.
+    """
+    if compression == GZIP:
+        # No file name or timestamp in the header, so the same data always
+        # compresses to the same bytes.
+        return gzip.GzipFile(
+            filename="", mode=mode, fileobj=raw, compresslevel=GZIP_LEVEL, mtime=0
+        )
+    if compression == XZ:
+        return lzma.LZMAFile(raw, mode)
+    return _zstd_file(raw, mode)
+
+
+class CompressedText(io.TextIOWrapper):
+    """
+    Text read from or written to a compressed stream. Closing it finishes
+    the stream and, if given one, closes the file underneath.
+    """
+
+    def __init__(self, stream: t.BinaryIO, file: t.BinaryIO | None, **kwargs):
+        super().__init__(stream, **kwargs)
+        self._file = file
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            if self._file is not None:
+                self._file.close()
+
+
+class _Replayed(io.RawIOBase):
+    """
+    A binary stream with the bytes already read from its start put back,
+    so a pipe can be sniffed and then read from the beginning. Closing it
+    closes the stream.
+    """
+
+    def __init__(self, head: bytes, stream: t.BinaryIO):
+        self._head = head
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: t.Any) -> int:
+        if self._head:
+            n = min(len(buffer), len(self._head))
+            buffer[:n] = self._head[:n]
+            self._head = self._head[n:]
+            return n
+        return self._stream.readinto(buffer)
+
+    def close(self) -> None:
+        if not self.closed:
+            super().close()
+            self._stream.close()
+
+
+def open_input(
+    path: str | Path,
+    encoding: str = "utf-8",
+    newline: str | None = None,
+    errors: str = "strict",
+) -> t.TextIO:
+    """
+    Open a file, or stdin if `path` is "-", for reading text, decompressing
+    it on the fly if it's gzip, Zstandard or xz data.
+
+    Raises OSError if it can't be opened, and ValueError if it's Zstandard
+    and nothing is installed to read it.
+    """
+    # The stream outlives this function: closing what it returns closes it.
+    if str(path) == "-":
+        stream = open(sys.stdin.fileno(), "rb", buffering=0, closefd=False)  # noqa: SIM115
+    else:
+        stream = open(path, "rb", buffering=0)  # noqa: SIM115
+    try:
+        # A pipe can hand over fewer bytes than the magic number at a time.
+        head = b""
+        while len(head) < MAGIC_LENGTH:
+            chunk = stream.read(MAGIC_LENGTH - len(head))
+            if not chunk:
+                break
+            head += chunk
+    except BaseException:
+        stream.close()
+        raise
+    raw = io.BufferedReader(_Replayed(head, stream))
+    try:
+        compression = sniff_compression(head)
+        if compression is None:
+            return io.TextIOWrapper(
+                raw, encoding=encoding, errors=errors, newline=newline
+            )
+        return CompressedText(
+            _compressed_file(raw, compression, "rb"),
+            raw,
+            encoding=encoding,
+            errors=errors,
+            newline=newline,
+        )
+    except BaseException:
+        raw.close()
+        raise
+
+
+class _Unflushed(io.BufferedIOBase):
+    """
+    Passes writes through to a compressor, but not flushes. The streaming
+    scripts flush after every row, and a compressor that's flushed ends a
+    block each time, which makes for a much bigger file. The compressor
+    is finished when this is closed.
+    """
+
+    def __init__(self, stream: t.BinaryIO):
+        self._stream = stream
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: t.Any) -> int:
+        return self._stream.write(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if not self.closed:
+            super().close()
+            self._stream.close()
+
+
+def compressed_writer(
+    raw: t.BinaryIO,
+    compression: str,
+    encoding: str = "utf-8",
+    newline: str | None = None,
+) -> t.TextIO:
+    """
+    Write compressed text to an open binary file. Closing the result
+    finishes the compressed stream but leaves `raw` open.
+    """
+    return CompressedText(
+        _Unflushed(_compressed_file(raw, compression, "wb")),
+        None,
+        encoding=encoding,
+        newline=newline,
+    )
+
+
+def open_output(
+    path: str | Path, encoding: str = "utf-8", newline: str | None = None
+) -> t.TextIO:
+    """
+    Open a file for writing text, compressed if its name ends in .gz, .zst
+    or .xz.
+    """
+    compression = compression_for(path)
+    if compression is None:
+        return open(path, "w", encoding=encoding, newline=newline)
+    # Closed along with the CompressedText that wraps it.
+    raw = open(path, "wb")  # noqa: SIM115
+    try:
+        return CompressedText(
+            _Unflushed(_compressed_file(raw, compression, "wb")),
+            raw,
+            encoding=encoding,
+            newline=newline,
+        )
+    except BaseException:
+        raw.close()
+        raise
+
+
+class InputFile(click.File):
+    """
+    A click.File for reading text that decompresses gzip, Zstandard and xz
+    inputs, including on stdin.
+    """
+
+    name = "input file"
+
+    def __init__(self, encoding: str = "utf-8", newline: str | None = ""):
+        super().__init__("r", encoding=encoding)
+        self.newline = newline
+
+    def convert(
+        self, value: t.Any, param: click.Parameter | None, ctx: click.Context | None
+    ) -> t.Any:
+        if hasattr(value, "read"):
+            return value
+        try:
+            f = open_input(
+                value, encoding=self.encoding or "utf-8", newline=self.newline
+            )
+        except (OSError, ValueError) as e:
+            self.fail(f"{click.format_filename(value)!r}: {e}", param, ctx)
+        if ctx is not None:
+            ctx.call_on_close(f.close)
+        return f
@@ -5,31 +5,65 @@ columns that match the expected names for Josh's AirTable base.
 This is a big HACK HACK HACK but here we go.
 """
 
+import contextlib
 import csv
 import sys
+import typing as t
 
 import click
 
+from compressed import InputFile
+from instrument import STATS, stats_options
+from journal import atomic_output
+
+DISTRICT_FIELDNAMES = ["NCES-District-ID", "District-Name", "District-Phone"]
+
 
 @click.command()
-@click.argument("input_csv", type=click.File("r"))
-def extract_district_info(input_csv):
+@stats_options
+@click.argument("input_csv", type=InputFile())
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Write to this file, atomically at the end, instead of stdout. It's "
+    "compressed if the name ends in .gz, .zst or .xz.",
+)
+def extract_district_info(input_csv, output_path):
     """
     Extract district information (name and phone) from a geocoded CSV and output it as a CSV with two columns:
     District-Name and District-Phone.
     """
     csv_reader = csv.DictReader(input_csv)
-    fieldnames = ["NCES-District-ID", "District-Name", "District-Phone"]
-    csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
 
-    # Write the header
-    csv_writer.writeheader()
+    with contextlib.ExitStack() as stack:
+        out = (
+            stack.enter_context(atomic_output(output_path))
+            if output_path
+            else sys.stdout
+        )
+        csv_writer = csv.DictWriter(out, fieldnames=DISTRICT_FIELDNAMES)
+
+        # Write the header
+        csv_writer.writeheader()
+
+        for record in district_records(STATS.timed("read", csv_reader)):
+            with STATS.phase("write"):
+                csv_writer.writerow(record)
+            STATS.count("rows")
 
+
+def district_records(rows: t.Iterable[dict[str, str]]) -> t.Iterator[dict[str, str]]:
+    """
+    Turn NCES district rows into AirTable district records, skipping
+    districts that have already been seen.
+    """
     # Set to keep track of seen district name and phone tuples
     seen_districts = set()
 
     # Process each row and extract relevant information
-    for row in csv_reader:
+    for row in rows:
         district_id = row["NCES District ID"]
 
         if district_id not in seen_districts:
@@ -39,7 +73,7 @@ def extract_district_info(input_csv):
                 "District-Phone": row["Phone"],
                 "NCES-District-ID": district_id,
             }
-            csv_writer.writerow(district_info)
+            yield district_info
 
 
 if __name__ == "__main__":
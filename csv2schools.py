@@ -5,41 +5,75 @@ columns that match the expected names for Josh's AirTable base.
 This is a big HACK HACK HACK but here we go.
 """
 
+import contextlib
 import csv
 import sys
+import typing as t
 
 import click
 
+from compressed import InputFile
+from instrument import STATS, stats_options
+from journal import atomic_output
+
+SCHOOL_FIELDNAMES = [
+    "NCES-School-ID",
+    "School-Name",
+    "School-Type",
+    "NCES-District-ID",
+    "District",
+    "School-Level",
+    "Address",
+    "Phone",
+    "Latitude",
+    "Longitude",
+]
+
 
 @click.command()
-@click.argument("input_csv", type=click.File("r"))
-def extract_school_info(input_csv):
+@stats_options
+@click.argument("input_csv", type=InputFile())
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Write to this file, atomically at the end, instead of stdout. It's "
+    "compressed if the name ends in .gz, .zst or .xz.",
+)
+def extract_school_info(input_csv, output_path):
     """
     Extract school information from a geocoded CSV and output it as a CSV with specified columns:
     School-Name, School-Type, District, School-Level, Address, Latitude, Longitude.
     """
     csv_reader = csv.DictReader(input_csv)
-    fieldnames = [
-        "NCES-School-ID",
-        "School-Name",
-        "School-Type",
-        "NCES-District-ID",
-        "District",
-        "School-Level",
-        "Address",
-        "Phone",
-        "Latitude",
-        "Longitude",
-    ]
-    csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-
-    # Write the header
-    csv_writer.writeheader()
 
+    with contextlib.ExitStack() as stack:
+        out = (
+            stack.enter_context(atomic_output(output_path))
+            if output_path
+            else sys.stdout
+        )
+        csv_writer = csv.DictWriter(out, fieldnames=SCHOOL_FIELDNAMES)
+
+        # Write the header
+        csv_writer.writeheader()
+
+        for record in school_records(STATS.timed("read", csv_reader)):
+            with STATS.phase("write"):
+                csv_writer.writerow(record)
+            STATS.count("rows")
+
+
+def school_records(rows: t.Iterable[dict[str, t.Any]]) -> t.Iterator[dict[str, t.Any]]:
+    """
+    Turn geocoded NCES school rows into AirTable school records, skipping
+    schools that have already been seen.
+    """
     seen_schools = set()
 
     # Process each row and extract relevant information
-    for row in csv_reader:
+    for row in rows:
         school_id = row["NCES School ID"]
         if school_id in seen_schools:
             continue
@@ -59,7 +93,7 @@ def extract_school_info(input_csv):
             "Latitude": row["Latitude"],
             "Longitude": row["Longitude"],
         }
-        csv_writer.writerow(school_info)
+        yield school_info
 
 
 def determine_school_level(low_grade, high_grade):
@@ -0,0 +1,52 @@
+"""
+Small commands that only rewrite CSV, kept apart from the scrapers so
+running them doesn't mean loading httpx and BeautifulSoup.
+
+Usage:
+    # Fixes website URLs that end with double slashes due to scraping
+    # or other weirdness:
+    python csv_tools.py fix-slashes input.csv > output.csv
+"""
+
+import csv
+import sys
+import typing as t
+
+import click
+
+from compressed import InputFile
+
+# Where enhance_districts.py puts each district's website.
+WEBSITE_COLUMN = "Web"
+
+
+@click.group()
+def main():
+    """
+    Clean up CSVs written by the other scripts.
+    """
+
+
+@main.command()
+@click.argument("input_csv", type=InputFile())
+def fix_slashes(input_csv: t.IO[str]):
+    """
+    Trim the doubled trailing slash from websites in enhance_districts.py
+    output.
+    """
+    csv_reader = csv.DictReader(input_csv)
+    fieldnames = list(csv_reader.fieldnames or [])
+    csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+    csv_writer.writeheader()
+
+    for district in csv_reader:
+        website_url = district.get(WEBSITE_COLUMN, "")
+        if website_url.endswith("//"):
+            website_url = website_url[:-1]
+        district[WEBSITE_COLUMN] = website_url
+        csv_writer.writerow(district)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,11 +8,33 @@ This is basically a big HACK HACK HACK but hey, here we go.
 Usage:
     python enhance_districts.py web input.csv > output.csv
 
+    # Checkpoint progress so an interrupted run can pick up where it left off:
+    python enhance_districts.py web --journal web.journal -o output.csv input.csv
+    python enhance_districts.py web --journal web.journal --resume -o output.csv input.csv
+
+    # Detail pages are fetched concurrently but politely; districts that
+    # still fail after retries are listed in a side file rather than
+    # aborting the run:
+    python enhance_districts.py web --workers 8 --failures failed.csv input.csv > output.csv
+
+    # Keep every fetched page in a local cache, then re-parse from it later
+    # without touching the network:
+    python enhance_districts.py web --cache-dir .http-cache input.csv > output.csv
+    python enhance_districts.py web --cache-dir .http-cache --offline input.csv > output.csv
+
+    # Parse detail pages with lxml instead of html.parser, if it's installed:
+    python enhance_districts.py web --parser lxml input.csv > output.csv
+
+    # See whether the time goes on the network, parsing or writing:
+    python enhance_districts.py web --stats - input.csv > output.csv
+
     # Fixes website URLs that end with double slashes due to scraping
     # or other weirdness:
     python enhance_districts.py fix_slashes input.csv > output.csv
 """
 
+import asyncio
+import contextlib
 import csv
 import sys
 import typing as t
@@ -20,11 +42,34 @@ from dataclasses import dataclass
 
 import click
 import httpx
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup, FeatureNotFound, Tag
+
+from compressed import InputFile
+from csv_tools import WEBSITE_COLUMN, fix_slashes
+from http_cache import DEFAULT_MAX_AGE, AsyncCachingTransport, ResponseCache
+from instrument import STATS, stats_options
+from journal import Journal, atomic_output
+from throttle import (
+    HostThrottle,
+    InstrumentedTransport,
+    ThrottledTransport,
+    get_with_retries,
+    map_ordered,
+)
 
 DISTRICT_URL_FMT = "https://nces.ed.gov/ccd/districtsearch/district_detail.asp?Search=1&details=1&ID2={district_id}"
 DISTRICT_ID_COLUMN = "NCES District ID"
-WEBSITE_COLUMN = "Web"
+
+# Defaults for being polite to nces.ed.gov.
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_MIN_DELAY = 0.25
+DEFAULT_MAX_RETRIES = 3
+
+# BeautifulSoup tree builders for detail pages. lxml is much faster but is
+# an optional extra, so it has to be asked for.
+DEFAULT_PARSER = "html.parser"
+PARSERS = ("html.parser", "lxml")
 
 
 # The NCES website has a number of columns that are *wrong* -- they claim
@@ -47,6 +92,21 @@ GOOD_MAILING_STATE_COLUMN = "Mailing State"
 GOOD_MAILING_ZIP_COLUMN = "Mailing ZIP"
 GOOD_MAILING_ZIP4_COLUMN = "Mailing ZIP 4-digit"
 
+# The columns `web` adds, in the order it adds them.
+SCRAPED_COLUMNS = [
+    WEBSITE_COLUMN,
+    GOOD_MAILING_STATE_COLUMN,
+    GOOD_MAILING_STREET_COLUMN,
+    GOOD_MAILING_CITY_COLUMN,
+    GOOD_MAILING_ZIP_COLUMN,
+    GOOD_MAILING_ZIP4_COLUMN,
+    GOOD_PHYSICAL_CITY_COLUMN,
+    GOOD_PHYSICAL_STATE_COLUMN,
+    GOOD_PHYSICAL_STREET_COLUMN,
+    GOOD_PHYSICAL_ZIP_COLUMN,
+    GOOD_PHYSICAL_ZIP4_COLUMN,
+]
+
 
 @click.group()
 def main():
@@ -61,8 +121,31 @@ def get_named_span(soup: BeautifulSoup, name: str) -> Tag | None:
     return None
 
 
+def index_named_spans(
+    soup: BeautifulSoup, names: t.Collection[str] = ()
+) -> dict[str, Tag]:
+    """
+    Walk the spans once and map each label ("Website", "Mailing Address",
+    ...) to the first span that reads "<label>:". If `names` is given, stop
+    as soon as all of them have been seen.
+    """
+    labels: dict[str, Tag] = {}
+    wanted = set(names)
+    for span in soup.find_all("span"):
+        text = span.get_text(strip=True)
+        if text.endswith(":"):
+            labels.setdefault(text[:-1], span)
+            wanted.discard(text[:-1])
+            if names and not wanted:
+                break
+    return labels
+
+
 def get_website_url(soup: BeautifulSoup) -> str:
-    span = get_named_span(soup, "Website")
+    return website_url_after(get_named_span(soup, "Website"))
+
+
+def website_url_after(span: Tag | None) -> str:
     if not span:
         return ""
     link = span.find_next("a")
@@ -113,7 +196,10 @@ class Address:
 
 
 def get_mailing_address(soup: BeautifulSoup) -> Address:
-    span = get_named_span(soup, "Mailing Address")
+    return mailing_address_after(get_named_span(soup, "Mailing Address"))
+
+
+def mailing_address_after(span: Tag | None) -> Address:
     assert isinstance(span, Tag)
     address_parts = []
     for sibling in span.next_siblings:
@@ -125,7 +211,10 @@ def get_mailing_address(soup: BeautifulSoup) -> Address:
 
 
 def get_physical_address(soup: BeautifulSoup) -> Address:
-    span = get_named_span(soup, "Physical Address")
+    return physical_address_after(get_named_span(soup, "Physical Address"))
+
+
+def physical_address_after(span: Tag | None) -> Address:
     assert isinstance(span, Tag)
     address_parts = []
     for sibling in span.next_siblings:
@@ -137,73 +226,322 @@ def get_physical_address(soup: BeautifulSoup) -> Address:
     return Address.from_string(address_str)
 
 
+def available_parsers() -> list[str]:
+    """
+    The PARSERS that are installed, in order.
+    """
+    parsers = []
+    for parser in PARSERS:
+        try:
+            BeautifulSoup("", parser)
+        except FeatureNotFound:
+            continue
+        parsers.append(parser)
+    return parsers
+
+
+def check_parser(parser: str) -> None:
+    """
+    Raise a UsageError before a run starts if `parser` isn't installed,
+    rather than have every district fail.
+    """
+    if parser not in available_parsers():
+        raise click.UsageError(
+            f"--parser {parser} isn't installed; try `uv pip install {parser}`."
+        )
+
+
+# The labels DistrictDetailPage reads.
+DETAIL_LABELS = ("Website", "Mailing Address", "Physical Address")
+
+
+class DistrictDetailPage:
+    """
+    An NCES district detail page, parsed once with its labels indexed so
+    each field is found without rescanning the document.
+    """
+
+    def __init__(self, html: str, parser: str = DEFAULT_PARSER):
+        self.soup = BeautifulSoup(html, parser)
+        self.labels = index_named_spans(self.soup, DETAIL_LABELS)
+
+    @property
+    def website_url(self) -> str:
+        return website_url_after(self.labels.get("Website"))
+
+    @property
+    def mailing_address(self) -> Address:
+        return mailing_address_after(self.labels.get("Mailing Address"))
+
+    @property
+    def physical_address(self) -> Address:
+        return physical_address_after(self.labels.get("Physical Address"))
+
+
 @main.command()
-@click.argument("input_csv", type=click.File("r", encoding="utf-8"))
-def web(input_csv: t.IO[str]):
+@stats_options
+@click.argument("input_csv", type=InputFile())
+@click.option(
+    "--journal",
+    "journal_path",
+    type=click.Path(dir_okay=False),
+    help="Checkpoint each finished district, by NCES ID, to this file.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue an interrupted run, skipping districts already in --journal.",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Write to this file, atomically at the end, instead of stdout.",
+)
+@click.option(
+    "--workers",
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of districts to work on at once.",
+)
+@click.option(
+    "--max-per-host",
+    default=DEFAULT_MAX_PER_HOST,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum concurrent connections to any one host.",
+)
+@click.option(
+    "--min-delay",
+    default=DEFAULT_MIN_DELAY,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Minimum seconds between requests to the same host.",
+)
+@click.option(
+    "--max-retries",
+    default=DEFAULT_MAX_RETRIES,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Retries for network errors, 429 and 5xx responses.",
+)
+@click.option(
+    "--failures",
+    "failures_path",
+    type=click.Path(dir_okay=False),
+    help="Write districts that could not be scraped to this CSV.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    envvar="HTTP_CACHE_DIR",
+    help="Cache fetched pages in this directory.",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Serve pages only from --cache-dir; never touch the network.",
+)
+@click.option(
+    "--cache-max-age",
+    default=DEFAULT_MAX_AGE,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Seconds to trust a cached page before revalidating it.",
+)
+@click.option(
+    "--parser",
+    default=DEFAULT_PARSER,
+    show_default=True,
+    type=click.Choice(PARSERS),
+    help="HTML parser for detail pages; lxml is faster if it's installed.",
+)
+@click.option(
+    "--detail-url",
+    default=DISTRICT_URL_FMT,
+    envvar="NCES_DETAIL_URL",
+    help="Detail page URL, with {district_id}; point this at a local mock server for testing.",
+)
+def web(
+    input_csv: t.IO[str],
+    journal_path: str | None,
+    resume: bool,
+    output_path: str | None,
+    workers: int,
+    max_per_host: int,
+    min_delay: float,
+    max_retries: int,
+    failures_path: str | None,
+    cache_dir: str | None,
+    offline: bool,
+    cache_max_age: float,
+    parser: str,
+    detail_url: str,
+):
     """
     Enhances a CSV file of school districts by scraping the NCES website
     for each district's website URL and mailing address, adding these as new columns.
     """
+    if resume and not journal_path:
+        raise click.UsageError("--resume needs --journal.")
+    if offline and not cache_dir:
+        raise click.UsageError("--offline needs --cache-dir.")
+    check_parser(parser)
+
+    cache = None
+    if cache_dir:
+        cache = ResponseCache(cache_dir, offline=offline, max_age=cache_max_age)
+        STATS.track_cache("http", cache)
+    transport = detail_transport(workers, max_per_host, min_delay, cache)
+
     csv_reader = csv.DictReader(input_csv)
-    fieldnames = (list(csv_reader.fieldnames or [])) + [
-        WEBSITE_COLUMN,
-        GOOD_MAILING_STATE_COLUMN,
-        GOOD_MAILING_STREET_COLUMN,
-        GOOD_MAILING_CITY_COLUMN,
-        GOOD_MAILING_ZIP_COLUMN,
-        GOOD_MAILING_ZIP4_COLUMN,
-        GOOD_PHYSICAL_CITY_COLUMN,
-        GOOD_PHYSICAL_STATE_COLUMN,
-        GOOD_PHYSICAL_STREET_COLUMN,
-        GOOD_PHYSICAL_ZIP_COLUMN,
-        GOOD_PHYSICAL_ZIP4_COLUMN,
-    ]
-    csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-    csv_writer.writeheader()
-
-    for district in csv_reader:
-        district_id = "unknown"
-        try:
-            district_id = district[DISTRICT_ID_COLUMN]
-            response = httpx.get(DISTRICT_URL_FMT.format(district_id=district_id))
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, "html.parser")
-            district[WEBSITE_COLUMN] = get_website_url(soup)
-            mailing_address = get_mailing_address(soup)
-            district[GOOD_MAILING_STREET_COLUMN] = mailing_address.street
-            district[GOOD_MAILING_CITY_COLUMN] = mailing_address.city
-            district[GOOD_MAILING_STATE_COLUMN] = mailing_address.state
-            district[GOOD_MAILING_ZIP_COLUMN] = mailing_address.zip
-            district[GOOD_MAILING_ZIP4_COLUMN] = mailing_address.zip4
-            physical_address = get_physical_address(soup)
-            district[GOOD_PHYSICAL_STREET_COLUMN] = physical_address.street
-            district[GOOD_PHYSICAL_CITY_COLUMN] = physical_address.city
-            district[GOOD_PHYSICAL_STATE_COLUMN] = physical_address.state
-            district[GOOD_PHYSICAL_ZIP_COLUMN] = physical_address.zip
-            district[GOOD_PHYSICAL_ZIP4_COLUMN] = physical_address.zip4
-            csv_writer.writerow(district)
-            sys.stdout.flush()
-        except Exception:
-            print(f"Error processing district ID {district_id}", file=sys.stderr)
-            print(district, file=sys.stderr)
-            raise
+    fieldnames = list(csv_reader.fieldnames or []) + SCRAPED_COLUMNS
+    with contextlib.ExitStack() as stack:
+        out = (
+            stack.enter_context(atomic_output(output_path))
+            if output_path
+            else sys.stdout
+        )
+        journal = None
+        if journal_path:
+            try:
+                journal = stack.enter_context(Journal(journal_path, resume=resume))
+            except FileExistsError as e:
+                raise click.UsageError(str(e))
+
+        failures_writer = None
+        if failures_path:
+            failures_file = stack.enter_context(
+                open(failures_path, "w", encoding="utf-8", newline="")
+            )
+            failures_writer = csv.DictWriter(
+                failures_file, fieldnames=[DISTRICT_ID_COLUMN, "Error"]
+            )
+            failures_writer.writeheader()
+
+        csv_writer = csv.DictWriter(out, fieldnames=fieldnames)
+        csv_writer.writeheader()
+
+        async def run():
+            semaphore = asyncio.Semaphore(workers)
+            failed = 0
+
+            async def process(district):
+                nonlocal failed
+                district_id = district.get(DISTRICT_ID_COLUMN, "")
+                if journal is not None and district_id in journal:
+                    return journal.get(district_id)
+                async with semaphore:
+                    try:
+                        await scrape_district(
+                            client,
+                            district,
+                            max_retries=max_retries,
+                            parser=parser,
+                            url_fmt=detail_url,
+                        )
+                    except Exception as e:  # noqa: BLE001 - logged with its type
+                        # Leave the scraped columns blank and keep going; the
+                        # district isn't journaled, so --resume retries it.
+                        failed += 1
+                        STATS.count("districts.failed")
+                        print(
+                            f"Error processing district ID {district_id}: {e!r}",
+                            file=sys.stderr,
+                        )
+                        if failures_writer is not None:
+                            failures_writer.writerow(
+                                {DISTRICT_ID_COLUMN: district_id, "Error": repr(e)}
+                            )
+                        return district
+                if journal is not None and district_id:
+                    journal.record(district_id, district)
+                return district
+
+            async with httpx.AsyncClient(timeout=30.0, transport=transport) as client:
+                districts = STATS.timed("read", csv_reader)
+                async for district in map_ordered(process, districts, workers * 4):
+                    with STATS.phase("write"):
+                        csv_writer.writerow(district)
+                    with STATS.phase("flush"):
+                        out.flush()
+                    STATS.count("rows")
+            if failed:
+                print(f"{failed} districts could not be scraped", file=sys.stderr)
+            if cache is not None:
+                print(cache.summary(), file=sys.stderr)
+
+        asyncio.run(run())
+
+
+def detail_transport(
+    workers: int,
+    max_per_host: int,
+    min_delay: float,
+    cache: ResponseCache | None = None,
+) -> httpx.AsyncBaseTransport:
+    """
+    Build the transport detail pages are fetched through. Requests go
+    through the cache (if any), and only the ones that reach the network
+    are throttled.
+    """
+    transport: httpx.AsyncBaseTransport = ThrottledTransport(
+        HostThrottle(max_concurrent=max_per_host, min_delay=min_delay),
+        InstrumentedTransport(
+            httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=workers))
+        ),
+    )
+    if cache is not None:
+        transport = AsyncCachingTransport(cache, transport)
+    return transport
+
+
+def parse_district_page(html: str, parser: str = DEFAULT_PARSER) -> dict[str, str]:
+    """
+    Parse a district's NCES detail page into its website and addresses,
+    keyed by output column.
+    """
+    page = DistrictDetailPage(html, parser=parser)
+    mailing_address = page.mailing_address
+    physical_address = page.physical_address
+    return {
+        WEBSITE_COLUMN: page.website_url,
+        GOOD_MAILING_STREET_COLUMN: mailing_address.street,
+        GOOD_MAILING_CITY_COLUMN: mailing_address.city,
+        GOOD_MAILING_STATE_COLUMN: mailing_address.state,
+        GOOD_MAILING_ZIP_COLUMN: mailing_address.zip,
+        GOOD_MAILING_ZIP4_COLUMN: mailing_address.zip4,
+        GOOD_PHYSICAL_STREET_COLUMN: physical_address.street,
+        GOOD_PHYSICAL_CITY_COLUMN: physical_address.city,
+        GOOD_PHYSICAL_STATE_COLUMN: physical_address.state,
+        GOOD_PHYSICAL_ZIP_COLUMN: physical_address.zip,
+        GOOD_PHYSICAL_ZIP4_COLUMN: physical_address.zip4,
+    }
+
+
+async def scrape_district(
+    client: httpx.AsyncClient,
+    district: dict[str, str],
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    parser: str = DEFAULT_PARSER,
+    url_fmt: str = DISTRICT_URL_FMT,
+) -> None:
+    """
+    Fetch a district's NCES detail page and fill in its website and
+    addresses in place. The district is left untouched if anything fails.
+    """
+    url = url_fmt.format(district_id=district[DISTRICT_ID_COLUMN])
+    with STATS.phase("fetch"):
+        response = await get_with_retries(client, url, max_retries=max_retries)
+    with STATS.phase("parse"):
+        district.update(parse_district_page(response.text, parser=parser))
 
 
-@main.command()
-@click.argument("input_csv", type=click.File("r", encoding="utf-8"))
-def fix_slashes(input_csv: t.IO[str]):
-    csv_reader = csv.DictReader(input_csv)
-    fieldnames = list(csv_reader.fieldnames or [])
-    csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-    csv_writer.writeheader()
-
-    for district in csv_reader:
-        website_url = district.get(WEBSITE_COLUMN, "")
-        if website_url.endswith("//"):
-            website_url = website_url[:-1]
-        district[WEBSITE_COLUMN] = website_url
-        csv_writer.writerow(district)
-        sys.stdout.flush()
+# It lives in csv_tools.py, so that running it on its own doesn't mean
+# loading httpx and BeautifulSoup, but it's still here as it always was.
+main.add_command(fix_slashes)
 
 
 if __name__ == "__main__":
@@ -7,21 +7,63 @@ Usage:
     uv run python find_logo.py one https://example-school-district.com
     uv run python find_logo.py all input.csv > output.csv
 
-    # If something goes wrong partway through, you can continue:
+    # Sites are searched concurrently; tune how hard we lean on the network
+    # and how long any one site gets:
+    uv run python find_logo.py --workers 32 --max-per-host 2 --site-timeout 30 all input.csv > output.csv
+
+    # Checkpoint progress so an interrupted run can pick up where it left
+    # off, optionally searching again for districts that got no logo:
+    uv run python find_logo.py all --journal logos.journal -o output.csv input.csv
+    uv run python find_logo.py all --journal logos.journal --resume -o output.csv input.csv
+    uv run python find_logo.py all --journal logos.journal --resume --retry-empty -o output.csv input.csv
+
+    # Or continue from the output of an earlier run, matching districts by
+    # NCES ID:
     uv run python find_logo.py all-continue input.csv previous_output.csv > output.csv
+    uv run python find_logo.py all-continue --retry-empty input.csv previous_output.csv > output.csv
+
+    # Remember image sizes (and which URLs weren't images) across runs, so
+    # favicons and theme images shared between sites are measured once:
+    uv run python find_logo.py --asset-cache logo-assets.sqlite3 all input.csv > output.csv
+
+    # Cache every page and image fetched, then rerun the heuristics later
+    # entirely from the cache:
+    uv run python find_logo.py --cache-dir .http-cache all input.csv > output.csv
+    uv run python find_logo.py --cache-dir .http-cache --offline all input.csv > output.csv
+
+    # Report where the time went, per phase and per host:
+    uv run python find_logo.py all --stats logo-stats.json input.csv > output.csv
 """
 
+import asyncio
+import contextlib
 import csv
 import sys
+import time
 import typing as t
+from dataclasses import dataclass
+from html.parser import HTMLParser
 from io import BytesIO
 from urllib.parse import urljoin
 
 import click
 import httpx
-from bs4 import BeautifulSoup
 from PIL import Image
 
+from asset_cache import DEFAULT_NEGATIVE_TTL_HOURS, AssetCache, AssetInfo
+from compressed import InputFile
+from http_cache import DEFAULT_MAX_AGE, AsyncCachingTransport, ResponseCache
+from image_size import sniff_image_size
+from instrument import STATS, stats_options
+from journal import Journal, atomic_output
+from throttle import (
+    HostThrottle,
+    InstrumentedTransport,
+    ThrottledTransport,
+    map_ordered,
+)
+
+DISTRICT_ID_COLUMN = "NCES District ID"
 WEBSITE_COLUMN = "Web"
 LOGO_URL_COLUMN = "Logo URL"
 
@@ -31,10 +73,175 @@ HEADERS = {
     "User-Agent": ALT_UA,
 }
 
+# How much of an image to read looking for its dimensions before giving up
+# and decoding the whole thing.
+SNIFF_BYTES = 32 * 1024
+
+# District sites are all different hosts, so we can afford to be much
+# busier overall than any one site sees.
+DEFAULT_WORKERS = 16
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_SITE_TIMEOUT = 60.0
+
+# How much of a homepage to read, and how many candidate images on it to
+# measure, before settling for what we've found.
+DEFAULT_MAX_PAGE_BYTES = 2 * 1024 * 1024
+DEFAULT_MAX_CANDIDATES = 40
+
+
+@dataclass(frozen=True)
+class SearchOptions:
+    workers: int = DEFAULT_WORKERS
+    max_connections: int = DEFAULT_MAX_CONNECTIONS
+    max_per_host: int = DEFAULT_MAX_PER_HOST
+    site_timeout: float = DEFAULT_SITE_TIMEOUT
+    max_page_bytes: int = DEFAULT_MAX_PAGE_BYTES
+    max_candidates: int = DEFAULT_MAX_CANDIDATES
+    cache: ResponseCache | None = None
+    assets: AssetCache | None = None
+
+
+def http_client(options: SearchOptions) -> httpx.AsyncClient:
+    """
+    Build the client shared by every request in a run.
+    """
+    # Requests go through the cache (if any), and only the ones that reach
+    # the network are throttled.
+    transport: httpx.AsyncBaseTransport = ThrottledTransport(
+        HostThrottle(max_concurrent=options.max_per_host),
+        InstrumentedTransport(
+            httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(max_connections=options.max_connections)
+            )
+        ),
+    )
+    if options.cache is not None:
+        transport = AsyncCachingTransport(options.cache, transport)
+    return httpx.AsyncClient(
+        headers=HEADERS,
+        follow_redirects=True,
+        # Waiting for a free connection is bounded by --site-timeout instead.
+        timeout=httpx.Timeout(10.0, pool=None),
+        transport=transport,
+    )
+
 
 @click.group()
-def main():
-    pass
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    envvar="HTTP_CACHE_DIR",
+    help="Cache fetched pages and images in this directory.",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Serve pages and images only from --cache-dir; never touch the network.",
+)
+@click.option(
+    "--cache-max-age",
+    default=DEFAULT_MAX_AGE,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Seconds to trust a cached response before revalidating it.",
+)
+@click.option(
+    "--workers",
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of district sites to search at once.",
+)
+@click.option(
+    "--max-connections",
+    default=DEFAULT_MAX_CONNECTIONS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum connections open at once, across all sites.",
+)
+@click.option(
+    "--max-per-host",
+    default=DEFAULT_MAX_PER_HOST,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum concurrent requests to any one host.",
+)
+@click.option(
+    "--site-timeout",
+    default=DEFAULT_SITE_TIMEOUT,
+    show_default=True,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Give up on a site's logo after this many seconds.",
+)
+@click.option(
+    "--max-page-bytes",
+    default=DEFAULT_MAX_PAGE_BYTES,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Stop reading a homepage after this many bytes.",
+)
+@click.option(
+    "--max-candidates",
+    default=DEFAULT_MAX_CANDIDATES,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Measure at most this many candidate images per site.",
+)
+@click.option(
+    "--asset-cache",
+    "asset_cache_path",
+    type=click.Path(dir_okay=False),
+    envvar="LOGO_ASSET_CACHE",
+    help="SQLite file to remember image sizes in across runs.",
+)
+@click.option(
+    "--asset-negative-ttl",
+    default=DEFAULT_NEGATIVE_TTL_HOURS,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Hours to remember that a URL wasn't a usable image.",
+)
+@click.pass_context
+def main(
+    ctx: click.Context,
+    cache_dir: str | None,
+    offline: bool,
+    cache_max_age: float,
+    workers: int,
+    max_connections: int,
+    max_per_host: int,
+    site_timeout: float,
+    max_page_bytes: int,
+    max_candidates: int,
+    asset_cache_path: str | None,
+    asset_negative_ttl: float,
+):
+    if offline and not cache_dir:
+        raise click.UsageError("--offline needs --cache-dir.")
+    cache = None
+    if cache_dir:
+        cache = ResponseCache(cache_dir, offline=offline, max_age=cache_max_age)
+        ctx.call_on_close(lambda: print(cache.summary(), file=sys.stderr))
+        STATS.track_cache("http", cache)
+    assets = AssetCache(asset_cache_path, negative_ttl_hours=asset_negative_ttl)
+    STATS.track_cache("assets", assets)
+    ctx.call_on_close(lambda: report_assets(assets))
+    ctx.obj = SearchOptions(
+        workers=workers,
+        max_connections=max_connections,
+        max_per_host=max_per_host,
+        site_timeout=site_timeout,
+        max_page_bytes=max_page_bytes,
+        max_candidates=max_candidates,
+        cache=cache,
+        assets=assets,
+    )
+
+
+def report_assets(assets: AssetCache) -> None:
+    assets.close()
+    print(assets.summary(), file=sys.stderr)
 
 
 class ImageError(Exception):
@@ -43,86 +250,243 @@ class ImageError(Exception):
     pass
 
 
-def get_image_size(abs_url: str) -> tuple[int, int]:
+async def probe_image(client: httpx.AsyncClient, abs_url: str) -> AssetInfo:
     """
-    Retrieve the image from the given URL and return its dimensions (width, height).
+    Retrieve the image from the given URL and describe it. If it can't be
+    fetched or isn't an image, the description says why instead of giving
+    a size.
+
+    Only as much of the image as it takes to read its header is downloaded;
+    the whole thing is fetched and decoded only if the header doesn't say.
     """
-    # Use python's built-in URL stuff to resolve relative URLs
-    try:
-        response = httpx.get(
-            abs_url, follow_redirects=True, timeout=10.0, headers=HEADERS
-        )
-        response.raise_for_status()
-    except Exception as e:
-        raise ImageError(f"Error fetching image from {abs_url}: {e}")
+    status = 0
+    content_type = ""
+
+    def failed(error: str) -> AssetInfo:
+        return AssetInfo(status, content_type, None, None, error, time.time())
 
-    # Is this an image mime type?
-    content_type = response.headers.get("Content-Type", "")
-    if not content_type.startswith("image/"):
-        raise ImageError(f"URL does not point to an image: {abs_url}")
+    def measured(size: tuple[int, int]) -> AssetInfo:
+        return AssetInfo(status, content_type, *size, "", time.time())
 
     try:
-        image = Image.open(BytesIO(response.content))
-        return image.size  # (width, height)
-    except Exception as e:
-        raise ImageError(f"Error processing image from {abs_url}: {e}")
+        async with client.stream("GET", abs_url) as response:
+            status = response.status_code
+            content_type = response.headers.get("Content-Type", "")
+            response.raise_for_status()
+
+            # Is this an image mime type?
+            if not content_type.startswith("image/"):
+                return failed(f"URL does not point to an image: {abs_url}")
+
+            # Leaving the block closes the connection, abandoning the rest
+            # of the body once we know the size.
+            head = b""
+            chunks = response.aiter_bytes()
+            async for chunk in chunks:
+                head += chunk
+                if size := sniff_image_size(head):
+                    return measured(size)
+                if len(head) >= SNIFF_BYTES:
+                    break
+            body = head + b"".join([chunk async for chunk in chunks])
+    except Exception as e:  # noqa: BLE001 - any failure just rules the image out
+        return failed(f"Error fetching image from {abs_url}: {e!r}")
 
+    try:
+        with STATS.phase("decode"):
+            image = Image.open(BytesIO(body))
+        return measured(image.size)  # (width, height)
+    except Exception as e:  # noqa: BLE001 - Pillow raises all sorts on bad data
+        return failed(f"Error processing image from {abs_url}: {e!r}")
 
-def find_logo_urls(
-    base_url: str, soup: BeautifulSoup
-) -> t.Iterable[tuple[str, tuple[int, int]]]:
+
+async def get_image_size(client: httpx.AsyncClient, abs_url: str) -> tuple[int, int]:
     """
-    Make several attempts to find a logo image URL from the given webpage:
+    Retrieve the image from the given URL and return its dimensions (width, height).
+    """
+    info = await probe_image(client, abs_url)
+    if info.size is None:
+        raise ImageError(info.error)
+    return info.size
+
+
+class ImageProber:
+    """
+    Measures candidate logo images for a whole run, so that an image shared
+    by many district sites is only fetched once.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, assets: AssetCache):
+        self.client = client
+        self.assets = assets
+        # Sites in flight that share an image wait on the same probe.
+        self._inflight: dict[str, asyncio.Future[AssetInfo]] = {}
+
+    async def measure(self, url: str) -> AssetInfo:
+        probe = self._inflight.get(url)
+        if probe is None:
+            if (info := self.assets.get(url)) is not None:
+                return info
+            probe = asyncio.ensure_future(self._probe(url))
+            self._inflight[url] = probe
+            probe.add_done_callback(lambda _: self._inflight.pop(url, None))
+        # One site timing out mustn't cancel a probe other sites are
+        # waiting on.
+        return await asyncio.shield(probe)
+
+    async def _probe(self, url: str) -> AssetInfo:
+        STATS.count("images.probed")
+        info = await probe_image(self.client, url)
+        self.assets.put(url, info)
+        return info
+
+
+@dataclass(frozen=True)
+class PageTag:
+    name: str
+    attrs: dict[str, str]
+    # The tag as written in the page, for logging.
+    text: str
+
+
+class PageTagParser(HTMLParser):
+    """
+    Picks the <img> and <link> tags out of an HTML page as it is fed in.
+
+    Found tags accumulate in `tags` for the caller to drain between feeds.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tags: list[PageTag] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag in ("img", "link"):
+            self.tags.append(
+                PageTag(
+                    tag,
+                    {name: value or "" for name, value in attrs},
+                    self.get_starttag_text() or "",
+                )
+            )
+
+
+async def iter_page_tags(
+    response: httpx.Response, max_bytes: int
+) -> t.AsyncIterator[PageTag]:
+    """
+    Yield the <img> and <link> tags of a streaming HTML response as they
+    arrive, reading no more than about `max_bytes` of it.
+    """
+    parser = PageTagParser()
+    async for text in response.aiter_text():
+        with STATS.phase("parse"):
+            parser.feed(text)
+        tags, parser.tags = parser.tags, []
+        for tag in tags:
+            yield tag
+        if response.num_bytes_downloaded >= max_bytes:
+            print(
+                f"Stopped reading {response.url} after {max_bytes} bytes",
+                file=sys.stderr,
+            )
+            return
+    parser.close()
+    for tag in parser.tags:
+        yield tag
+
+
+def is_icon_link(tag: PageTag) -> bool:
+    # Matches what BeautifulSoup does for rel=["icon", "shortcut icon"].
+    rel = tag.attrs.get("rel", "")
+    return "icon" in rel.split() or rel == "shortcut icon"
+
+
+def candidate_logo_url(base_url: str, tag: PageTag) -> str | None:
+    """
+    Return the URL of the image a tag refers to, if it might be the page's
+    logo:
 
     1. Any <img> tag with class "logo", or where the "alt" attribute contains "logo",
        or where the URL itself contains "logo" once lowered.
     2. Any <link> tag with rel="icon" or rel="shortcut icon".
-
-    For each found image URL, retrieve its dimensions and yield a tuple of (URL, (width, height)).
     """
     # Attempt 1: Look for <img> tags
-    for img in soup.find_all("img"):
-        print("CONSIDERING IMG TAG:", img, file=sys.stderr)
-        img_url = img.get("src", "")
-        if not isinstance(img_url, str) or not img_url:
-            continue
+    if tag.name == "img":
+        print("CONSIDERING IMG TAG:", tag.text, file=sys.stderr)
+        img_url = tag.attrs.get("src", "")
+        if not img_url:
+            return None
         img_url_lower = img_url.lower()
-        alt_text = img.get("alt", "")
-        if not isinstance(alt_text, str):
-            alt_text = ""
-        else:
-            alt_text = alt_text.lower()
+        alt_text = tag.attrs.get("alt", "").lower()
         if "logo" in alt_text or "logo" in img_url_lower or "brand" in img_url_lower:
-            try:
-                img_url = urljoin(base_url, img_url)
-                size = get_image_size(img_url)
-                yield (img_url, size)
-            except ImageError:
-                continue
+            return urljoin(base_url, img_url)
+        return None
 
     # Attempt 2: Look for <link> tags with rel="icon" or rel="shortcut icon"
-    for link in soup.find_all("link", rel=["icon", "shortcut icon"]):
-        icon_url = link.get("href", "")
-        if not isinstance(icon_url, str) or not icon_url:
-            continue
-        try:
-            icon_url = urljoin(base_url, icon_url)
-            size = get_image_size(icon_url)
-            yield (icon_url, size)
-        except ImageError:
-            continue
+    if tag.name == "link" and is_icon_link(tag):
+        icon_url = tag.attrs.get("href", "")
+        if not icon_url:
+            return None
+        return urljoin(base_url, icon_url)
+
+    return None
 
 
-def find_best_logo_url(base_url: str, soup: BeautifulSoup) -> str:
+async def find_logo_urls(
+    prober: ImageProber,
+    base_url: str,
+    tags: t.AsyncIterable[PageTag],
+    max_candidates: int = DEFAULT_MAX_CANDIDATES,
+) -> list[tuple[str, tuple[int, int]]]:
     """
-    Find the best logo URL from the given webpage soup.
+    Retrieve the dimensions of candidate logos on a webpage, starting on each
+    one as soon as its tag is read, and return a list of (URL, (width,
+    height)): images in page order, then icons in page order. Candidates
+    that aren't images, or can't be fetched, are left out.
+
+    Stops reading tags after `max_candidates` candidates.
+    """
+    images: list[tuple[str, asyncio.Future[AssetInfo]]] = []
+    icons: list[tuple[str, asyncio.Future[AssetInfo]]] = []
+    try:
+        async for tag in tags:
+            url = candidate_logo_url(base_url, tag)
+            if url is None:
+                continue
+            probe = asyncio.ensure_future(prober.measure(url))
+            (images if tag.name == "img" else icons).append((url, probe))
+            if len(images) + len(icons) >= max_candidates:
+                break
+        candidates = images + icons
+        probed = await asyncio.gather(*(probe for _, probe in candidates))
+    finally:
+        # Only reached with probes still running if we're giving up.
+        for _, probe in images + icons:
+            probe.cancel()
+    return [
+        (url, info.size)
+        for (url, _), info in zip(candidates, probed)
+        if info.size is not None
+    ]
+
+
+async def find_best_logo_url(
+    prober: ImageProber,
+    base_url: str,
+    tags: t.AsyncIterable[PageTag],
+    max_candidates: int = DEFAULT_MAX_CANDIDATES,
+) -> str:
+    """
+    Find the best logo URL among a webpage's tags.
 
     The "best" logo is defined as the one with the largest area (width * height).
     If no logos are found, return an empty string.
     """
     best_logo_url = ""
     best_area = 0
-    for logo_url, (width, height) in find_logo_urls(base_url, soup):
+    logos = await find_logo_urls(prober, base_url, tags, max_candidates)
+    for logo_url, (width, height) in logos:
         print("CONSIDERING LOGO:", logo_url, f"({width}x{height})", file=sys.stderr)
         area = width * height
         if area > best_area:
@@ -131,78 +495,245 @@ def find_best_logo_url(base_url: str, soup: BeautifulSoup) -> str:
     return best_logo_url
 
 
-def find_best_logo_url_from_site(website_url: str) -> str:
+async def find_best_logo_url_from_site(
+    prober: ImageProber,
+    website_url: str,
+    max_page_bytes: int = DEFAULT_MAX_PAGE_BYTES,
+    max_candidates: int = DEFAULT_MAX_CANDIDATES,
+) -> str:
     """
     Fetch the webpage at the given URL and find the best logo URL.
 
     Or return an empty string if none found or on error.
     """
     try:
-        response = httpx.get(
-            website_url, follow_redirects=True, timeout=10.0, headers=HEADERS
-        )
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        return find_best_logo_url(website_url, soup)
-    except Exception as e:
-        print(f"Error fetching website {website_url}: {e}", file=sys.stderr)
+        async with prober.client.stream("GET", website_url) as response:
+            response.raise_for_status()
+            tags = iter_page_tags(response, max_page_bytes)
+            return await find_best_logo_url(prober, website_url, tags, max_candidates)
+    except Exception as e:  # noqa: BLE001 - one bad site mustn't stop the run
+        print(f"Error fetching website {website_url}: {e!r}", file=sys.stderr)
         return ""
 
 
-@main.command()
-@click.argument("input_csv", type=click.File("r", encoding="utf-8"))
-def all(input_csv: t.IO[str]) -> None:
-    csv_reader = csv.DictReader(input_csv)
-    fieldnames = list(csv_reader.fieldnames or []) + [LOGO_URL_COLUMN]
-    csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-    csv_writer.writeheader()
+async def find_site_logo(
+    prober: ImageProber, website_url: str, options: SearchOptions
+) -> str:
+    """
+    Like find_best_logo_url_from_site, but give up after --site-timeout
+    seconds so one slow site can't hold up the rest.
+    """
+    try:
+        async with asyncio.timeout(options.site_timeout):
+            return await find_best_logo_url_from_site(
+                prober, website_url, options.max_page_bytes, options.max_candidates
+            )
+    except TimeoutError:
+        print(f"Timed out searching {website_url} for a logo", file=sys.stderr)
+        STATS.count("sites.timed_out")
+        return ""
 
-    for district in csv_reader:
+
+async def find_logos(
+    options: SearchOptions,
+    districts: t.Iterable[dict[str, str]],
+    known: t.Mapping[str, str] | None = None,
+    journal: Journal | None = None,
+) -> t.AsyncIterator[dict[str, str]]:
+    """
+    Search many districts' websites for logos concurrently, yielding each
+    district with its logo URL filled in, in input order.
+
+    Districts whose ID is in `known` get the logo URL recorded there instead
+    of being searched again. Newly searched districts are recorded in
+    `journal`, if given.
+    """
+    known = known or {}
+    semaphore = asyncio.Semaphore(options.workers)
+
+    async def process(district: dict[str, str]) -> dict[str, str]:
+        district_id = district.get(DISTRICT_ID_COLUMN, "")
+        if district_id in known:
+            district[LOGO_URL_COLUMN] = known[district_id]
+            return district
         website_url = district.get(WEBSITE_COLUMN, "")
         logo_url = ""
         if website_url:
-            logo_url = find_best_logo_url_from_site(website_url)
+            async with semaphore:
+                with STATS.phase("search"):
+                    logo_url = await find_site_logo(prober, website_url, options)
         district[LOGO_URL_COLUMN] = logo_url
-        csv_writer.writerow(district)
-        sys.stdout.flush()
+        if journal is not None and district_id:
+            journal.record(district_id, {LOGO_URL_COLUMN: logo_url})
+        return district
+
+    async with http_client(options) as client:
+        prober = ImageProber(client, options.assets or AssetCache())
+        districts = STATS.timed("read", districts)
+        async for district in map_ordered(process, districts, options.workers * 4):
+            yield district
+
+
+def write_logos(
+    options: SearchOptions,
+    districts: t.Iterable[dict[str, str]],
+    csv_writer: csv.DictWriter,
+    out: t.IO[str],
+    known: t.Mapping[str, str] | None = None,
+    journal: Journal | None = None,
+) -> None:
+    async def run():
+        found = 0
+        async for district in find_logos(options, districts, known, journal):
+            with STATS.phase("write"):
+                csv_writer.writerow(district)
+            with STATS.phase("flush"):
+                out.flush()
+            STATS.count("rows")
+            found += bool(district[LOGO_URL_COLUMN])
+        print(f"Found logos for {found} districts", file=sys.stderr)
+
+    asyncio.run(run())
+
+
+def journaled_logos(journal: Journal) -> dict[str, str]:
+    return {
+        district_id: entry.get(LOGO_URL_COLUMN, "")
+        for district_id, entry in journal.completed.items()
+    }
+
+
+def previous_logos(previous_csv: t.IO[str]) -> dict[str, str]:
+    """
+    Read the logo URL found for each district in an earlier run's output.
+    """
+    previous_reader = csv.DictReader(previous_csv)
+    if DISTRICT_ID_COLUMN not in (previous_reader.fieldnames or []):
+        raise click.UsageError(f"Previous output has no {DISTRICT_ID_COLUMN!r} column.")
+    return {
+        row[DISTRICT_ID_COLUMN]: row.get(LOGO_URL_COLUMN) or ""
+        for row in previous_reader
+    }
+
+
+def without_empty(logos: dict[str, str]) -> dict[str, str]:
+    return {district_id: url for district_id, url in logos.items() if url}
 
 
 @main.command()
-@click.argument("input_csv", type=click.File("r", encoding="utf-8"))
-@click.argument("previous_csv", type=click.File("r", encoding="utf-8"))
-def all_continue(input_csv: t.IO[str], previous_csv: t.IO[str]) -> None:
-    # The previous_csv represents a partial run of the `all` command.
-    # We read both input_csv and previous_csv in parallel, and emit
-    # previous_csv rows until they run out, at which point we continue
-    # processing input_csv.
-    previous_reader = csv.DictReader(previous_csv)
-    previous_rows = list(previous_reader)
+@stats_options
+@click.argument("input_csv", type=InputFile())
+@click.option(
+    "--journal",
+    "journal_path",
+    type=click.Path(dir_okay=False),
+    help="Checkpoint each finished district, by NCES ID, to this file.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue an interrupted run, skipping districts already in --journal.",
+)
+@click.option(
+    "--retry-empty",
+    is_flag=True,
+    help="With --resume, search again for districts that got no logo.",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Write to this file, atomically at the end, instead of stdout.",
+)
+@click.pass_obj
+def all(
+    options: SearchOptions,
+    input_csv: t.IO[str],
+    journal_path: str | None,
+    resume: bool,
+    retry_empty: bool,
+    output_path: str | None,
+) -> None:
+    if resume and not journal_path:
+        raise click.UsageError("--resume needs --journal.")
+    if retry_empty and not resume:
+        raise click.UsageError("--retry-empty needs --resume.")
+
+    csv_reader = csv.DictReader(input_csv)
+    fieldnames = list(csv_reader.fieldnames or []) + [LOGO_URL_COLUMN]
+    if journal_path and DISTRICT_ID_COLUMN not in fieldnames:
+        raise click.UsageError(f"--journal needs a {DISTRICT_ID_COLUMN!r} column.")
+
+    with contextlib.ExitStack() as stack:
+        out = (
+            stack.enter_context(atomic_output(output_path))
+            if output_path
+            else sys.stdout
+        )
+        journal = None
+        known: dict[str, str] = {}
+        if journal_path:
+            try:
+                journal = stack.enter_context(Journal(journal_path, resume=resume))
+            except FileExistsError as e:
+                raise click.UsageError(str(e))
+            known = journaled_logos(journal)
+            if retry_empty:
+                known = without_empty(known)
+            if resume:
+                print(f"Resuming with {len(known)} districts done", file=sys.stderr)
+
+        csv_writer = csv.DictWriter(out, fieldnames=fieldnames)
+        csv_writer.writeheader()
+        write_logos(options, csv_reader, csv_writer, out, known, journal)
+
+
+@main.command()
+@stats_options
+@click.argument("input_csv", type=InputFile())
+@click.argument("previous_csv", type=InputFile())
+@click.option(
+    "--retry-empty",
+    is_flag=True,
+    help="Search again for districts the previous run found no logo for.",
+)
+@click.pass_obj
+def all_continue(
+    options: SearchOptions,
+    input_csv: t.IO[str],
+    previous_csv: t.IO[str],
+    retry_empty: bool,
+) -> None:
+    # The previous_csv is the output of an earlier, possibly partial, run of
+    # the `all` command. Districts it already covers, matched by NCES ID so
+    # the input can be re-sorted or filtered in between, keep their logo;
+    # the rest are searched.
+    known = previous_logos(previous_csv)
+    if retry_empty:
+        known = without_empty(known)
+    print(f"Continuing with {len(known)} districts done", file=sys.stderr)
+
     csv_reader = csv.DictReader(input_csv)
     fieldnames = list(csv_reader.fieldnames or []) + [LOGO_URL_COLUMN]
+    if DISTRICT_ID_COLUMN not in fieldnames:
+        raise click.UsageError(f"Input has no {DISTRICT_ID_COLUMN!r} column.")
     csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
     csv_writer.writeheader()
-    previous_index = 0
-    for district in csv_reader:
-        if previous_index < len(previous_rows):
-            # Emit from previous
-            csv_writer.writerow(previous_rows[previous_index])
-            previous_index += 1
-            sys.stdout.flush()
-            continue
-
-        website_url = district.get(WEBSITE_COLUMN, "")
-        logo_url = ""
-        if website_url:
-            logo_url = find_best_logo_url_from_site(website_url)
-        district[LOGO_URL_COLUMN] = logo_url
-        csv_writer.writerow(district)
-        sys.stdout.flush()
+    write_logos(options, csv_reader, csv_writer, sys.stdout, known)
 
 
 @main.command()
+@stats_options
 @click.argument("website_url")
-def one(website_url: str) -> None:
-    logo_url = find_best_logo_url_from_site(website_url)
+@click.pass_obj
+def one(options: SearchOptions, website_url: str) -> None:
+    async def run():
+        async with http_client(options) as client:
+            prober = ImageProber(client, options.assets or AssetCache())
+            return await find_site_logo(prober, website_url, options)
+
+    logo_url = asyncio.run(run())
     if logo_url:
         print(logo_url)
     else:
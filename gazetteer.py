@@ -0,0 +1,375 @@
+"""
+An offline table of ZIP code and city centroids, for placing schools whose
+address doesn't say where the school is.
+
+Hundreds of NCES rows give a PO Box (`PO Box 878, Ojai`) or a rural route
+box instead of a street address. The geocoding API can only place those at
+their ZIP code or city anyway, so with --gazetteer, geocode.py and
+pipeline.py look them up here instead: instantly, and without spending an
+API request. Only real street addresses go to the API.
+
+The table is data/zip_centroids.csv.gz and covers the whole country.
+Where there are geocoded schools, a ZIP code's centroid is the median
+latitude and longitude of its schools, and a city's likewise; those land
+closest to where the API puts PO Boxes. Every other ZIP code comes from
+the national list in data/us_zip_codes.csv.gz, and every other city is the
+median of its ZIP codes there. Rebuild it when more states are geocoded:
+
+    python gazetteer.py build data/prelim/*/geocoded_*.csv
+
+Rows placed from the table are approximate, to within a few kilometres in
+towns and more in rural ZIP codes. geocode.py marks every row's precision
+in a Geocode Precision column: "zip" or "city" if it came from here, and
+for the API's answers "address" if it placed the address itself (its
+location_type is ROOFTOP or RANGE_INTERPOLATED) or "approximate" if it only
+got near (GEOMETRIC_CENTER or APPROXIMATE).
+"""
+
+import csv
+import functools
+import re
+import statistics
+import sys
+import typing as t
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+
+import click
+
+from compressed import open_input
+from journal import atomic_output
+
+DATA_DIR = Path(__file__).parent / "data"
+GAZETTEER_PATH = DATA_DIR / "zip_centroids.csv.gz"
+# Every US ZIP code's point, from the zipcodes package (MIT licensed; see
+# data/us_zip_codes.LICENSE.txt).
+ZIPS_PATH = DATA_DIR / "us_zip_codes.csv.gz"
+
+FIELDNAMES = ["State", "ZIP", "City", "Latitude", "Longitude", "Schools"]
+
+# Added to geocoded rows, and what it's set to.
+PRECISION_COLUMN = "Geocode Precision"
+ADDRESS = "address"
+APPROXIMATE = "approximate"
+ZIP = "zip"
+CITY = "city"
+
+# How precisely the API says it placed an address (its location_type).
+LOCATION_TYPE_PRECISION = {
+    "ROOFTOP": ADDRESS,
+    "RANGE_INTERPOLATED": ADDRESS,
+    "GEOMETRIC_CENTER": APPROXIMATE,
+    "APPROXIMATE": APPROXIMATE,
+}
+
+# About a metre; the centroids are nowhere near that accurate anyway.
+DECIMALS = 5
+
+# Street addresses that only say where the school collects its mail: PO
+# Boxes and drawers (however they're spelled), rural route, star route and
+# highway contract boxes, and general delivery.
+MAILING_ONLY = re.compile(
+    r"""
+    ^\s*(?:
+        p\.?\s*o\.?\s*(?:box|drawer)
+        | pob\b
+        | post\s+office\s+box
+        | box\s+(?:\d|[a-z]\b)
+        | (?:\w+\s+)?(?:rt|rte|route|rr|r\.r\.|hc|hcr|hci)\.?\s*\d*\s+box\b
+        | general\s+delivery
+    )
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+Row = dict[str, str]
+
+
+@dataclass(frozen=True)
+class Centroid:
+    lat: float
+    lng: float
+    # ZIP or CITY.
+    precision: str
+
+
+def is_mailing_only(street: str) -> bool:
+    """
+    Whether a street address is missing or only a mailing address, so the
+    best anyone can do is place it by its ZIP code or city.
+    """
+    return not street.strip() or MAILING_ONLY.match(street) is not None
+
+
+def api_precision(location_type: str) -> str:
+    """
+    The precision of an API result with this location_type. Results that
+    don't say, like ones cached before it was recorded, count as
+    approximate rather than claim more than is known.
+    """
+    return LOCATION_TYPE_PRECISION.get(location_type, APPROXIMATE)
+
+
+def zip5(value: str) -> str:
+    digits = value.strip()[:5]
+    return digits.zfill(5) if digits.isdigit() else ""
+
+
+def city_key(city: str, state: str) -> tuple[str, str]:
+    return (
+        " ".join(re.sub(r"[^\w\s]", " ", city.upper()).split()),
+        state.strip().upper(),
+    )
+
+
+class Gazetteer:
+    """
+    ZIP code and city centroids, held in dictionaries.
+    """
+
+    def __init__(
+        self,
+        zips: dict[str, Centroid],
+        cities: dict[tuple[str, str], Centroid],
+    ):
+        self.zips = zips
+        self.cities = cities
+        # Mailing-only addresses with neither their ZIP code nor city here.
+        self.unplaced = 0
+
+    @classmethod
+    def load(cls, path: str | Path = GAZETTEER_PATH) -> t.Self:
+        """
+        Load a table written by `build`. Raises OSError if it can't be read
+        and ValueError if it isn't one.
+        """
+        zips: dict[str, Centroid] = {}
+        cities: dict[tuple[str, str], Centroid] = {}
+        with open_input(path, newline="") as f:
+            reader = csv.reader(f)
+            if next(reader, None) != FIELDNAMES:
+                raise ValueError(f"{path} isn't a ZIP centroid table from `build`")
+            for state, zip_code, city, lat, lng, _ in reader:
+                if zip_code:
+                    zips[zip_code] = Centroid(float(lat), float(lng), ZIP)
+                else:
+                    cities[city_key(city, state)] = Centroid(
+                        float(lat), float(lng), CITY
+                    )
+        return cls(zips, cities)
+
+    def __len__(self) -> int:
+        return len(self.zips) + len(self.cities)
+
+    def locate(self, row: Row) -> Centroid | None:
+        """
+        Place a school whose street address is missing or mailing-only at
+        its ZIP code's centroid, or failing that its city's. None if the
+        address should go to the geocoding API instead.
+        """
+        if not is_mailing_only(row.get("Street Address", "")):
+            return None
+        centroid = self.zips.get(zip5(row.get("ZIP", "")))
+        if centroid is None:
+            centroid = self.cities.get(
+                city_key(row.get("City", ""), row.get("State", ""))
+            )
+        if centroid is None:
+            self.unplaced += 1
+        return centroid
+
+
+def median_point(points: list[tuple[float, float]]) -> tuple[str, str]:
+    lat = round(statistics.median(lat for lat, _ in points), DECIMALS)
+    lng = round(statistics.median(lng for _, lng in points), DECIMALS)
+    return str(lat), str(lng)
+
+
+def build_centroids(
+    rows: t.Iterable[Row], zip_rows: t.Iterable[Row] = ()
+) -> tuple[list[Row], int]:
+    """
+    The table's rows, ZIP codes first, for some geocoded school rows and
+    a national list of ZIP code points (ZIP, City, State, Latitude and
+    Longitude columns), and how many of the school rows had coordinates.
+
+    Centroids of the schools themselves win; the national list fills in
+    the ZIP codes and cities no geocoded school is in.
+    """
+    # Imported here so geocoding doesn't pay for the spatial index.
+    from spatial_index import parse_coordinates
+
+    Key = tuple[str, str]
+    zip_points: dict[str, list[tuple[float, float]]] = defaultdict(list)
+    zip_places: dict[str, Counter[Key]] = defaultdict(Counter)
+    city_points: dict[Key, list[tuple[float, float]]] = defaultdict(list)
+    city_names: dict[Key, str] = {}
+    count = 0
+    for row in rows:
+        coordinates = parse_coordinates(row)
+        if coordinates is None:
+            continue
+        count += 1
+        state = row.get("State", "").strip().upper()
+        city = row.get("City", "").strip()
+        zip_code = zip5(row.get("ZIP", ""))
+        if zip_code:
+            zip_points[zip_code].append(coordinates)
+            zip_places[zip_code][state, city] += 1
+        if city and state:
+            key = city_key(city, state)
+            city_points[key].append(coordinates)
+            city_names.setdefault(key, city)
+
+    national_zips: dict[str, Row] = {}
+    national_city_points: dict[Key, list[tuple[float, float]]] = defaultdict(list)
+    for row in zip_rows:
+        coordinates = parse_coordinates(row)
+        zip_code = zip5(row.get("ZIP", ""))
+        if coordinates is None or not zip_code:
+            continue
+        state = row.get("State", "").strip().upper()
+        city = row.get("City", "").strip()
+        lat, lng = median_point([coordinates])
+        national_zips[zip_code] = dict(
+            zip(FIELDNAMES, (state, zip_code, city, lat, lng, "0"))
+        )
+        if city and state:
+            key = city_key(city, state)
+            national_city_points[key].append(coordinates)
+            city_names.setdefault(key, city)
+
+    table = []
+    for zip_code, points in zip_points.items():
+        # The city most of the ZIP code's schools give, for reading the table.
+        (state, city), _ = min(
+            zip_places[zip_code].items(), key=lambda item: (-item[1], item[0])
+        )
+        table.append(
+            dict(
+                zip(
+                    FIELDNAMES,
+                    (state, zip_code, city, *median_point(points), str(len(points))),
+                )
+            )
+        )
+    table.extend(
+        row for zip_code, row in national_zips.items() if zip_code not in zip_points
+    )
+    for key, points in city_points.items():
+        table.append(
+            dict(
+                zip(
+                    FIELDNAMES,
+                    (
+                        key[1],
+                        "",
+                        city_names[key],
+                        *median_point(points),
+                        str(len(points)),
+                    ),
+                )
+            )
+        )
+    for key, points in national_city_points.items():
+        if key not in city_points:
+            table.append(
+                dict(
+                    zip(
+                        FIELDNAMES,
+                        (key[1], "", city_names[key], *median_point(points), "0"),
+                    )
+                )
+            )
+    table.sort(key=lambda row: (not row["ZIP"], row["State"], row["ZIP"], row["City"]))
+    return table, count
+
+
+def gazetteer_options[T](command: t.Callable[..., T]) -> t.Callable[..., T]:
+    """
+    Give a geocoding command --gazetteer and --gazetteer-file options, and
+    pass it the loaded table as `gazetteer`, or None without --gazetteer.
+    """
+
+    @click.option(
+        "--gazetteer",
+        "use_gazetteer",
+        is_flag=True,
+        help="Place PO Box and other mailing-only addresses at their ZIP code "
+        "or city from an offline centroid table instead of the API, and add a "
+        f"{PRECISION_COLUMN} column.",
+    )
+    @click.option(
+        "--gazetteer-file",
+        default=str(GAZETTEER_PATH),
+        type=click.Path(dir_okay=False),
+        help="Centroid table for --gazetteer, if not the bundled one.",
+    )
+    @functools.wraps(command)
+    def wrapper(
+        *args: t.Any, use_gazetteer: bool, gazetteer_file: str, **kwargs: t.Any
+    ) -> T:
+        gazetteer = None
+        if use_gazetteer:
+            try:
+                gazetteer = Gazetteer.load(gazetteer_file)
+            except (OSError, ValueError) as e:
+                raise click.ClickException(f"Couldn't load the gazetteer: {e}")
+        return command(*args, gazetteer=gazetteer, **kwargs)
+
+    return wrapper
+
+
+@click.group()
+def main():
+    """
+    Build the offline ZIP code and city centroid table.
+    """
+
+
+@main.command()
+@click.argument(
+    "paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.option(
+    "--zips",
+    "zips_path",
+    default=str(ZIPS_PATH),
+    show_default="data/us_zip_codes.csv.gz",
+    type=click.Path(exists=True, dir_okay=False),
+    help="National list of ZIP code points to fill in the rest of the country.",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    default=str(GAZETTEER_PATH),
+    show_default="data/zip_centroids.csv.gz",
+    type=click.Path(dir_okay=False),
+    help="Where to write the table.",
+)
+def build(paths: tuple[str, ...], zips_path: str, output_path: str):
+    """
+    Build the table from geocoded school CSVs and a national ZIP code list,
+    replacing any old one.
+    """
+    from spatial_index import read_geocoded
+
+    _, rows = read_geocoded(paths)
+    with open_input(zips_path, newline="") as zips_file:
+        table, count = build_centroids(rows, csv.DictReader(zips_file))
+    with atomic_output(output_path) as out:
+        writer = csv.DictWriter(out, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(table)
+    zips = sum(1 for row in table if row["ZIP"])
+    print(
+        f"Wrote {zips} ZIP codes and {len(table) - zips} cities from {count} "
+        f"geocoded schools to {output_path}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
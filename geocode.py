@@ -1,20 +1,81 @@
 """
 Geocode addresses in a CSV file using Google Maps Geocoding API.
 Outputs the result to stdout.
+
+Requests are made concurrently over a single pooled connection, limited to
+--concurrency requests in flight and --qps requests per second. Requests
+that hit OVER_QUERY_LIMIT or a server error are retried with backoff. Rows
+are always written in input order.
+
+With --cache, results are also stored in a SQLite file keyed by normalized
+address, so addresses seen in earlier runs (or earlier in the same file)
+are never paid for twice.
+
+With --journal, every finished row is also checkpointed by NCES ID. If a run
+dies, rerun it with --resume: rows already in the journal are replayed
+without touching the API and the rest pick up where it left off.
+
+With --stats, a JSON report of where the time went (reading, waiting on
+the rate limit, API latency, writing and flushing), retries and cache hits
+is written at the end; see instrument.py.
+
+With --gazetteer, PO Box and other mailing-only addresses are placed at
+their ZIP code or city from an offline table instead of the API, and a
+Geocode Precision column says how each row was placed; see gazetteer.py.
 """
 
+import asyncio
+import contextlib
 import csv
 import sys
+import typing as t
+from dataclasses import dataclass
 
 import click
 import httpx
 
+from compressed import InputFile
+from gazetteer import PRECISION_COLUMN, Gazetteer, api_precision, gazetteer_options
+from geocode_cache import (
+    DEFAULT_MAX_ENTRIES,
+    DEFAULT_TTL_DAYS,
+    GeocodeCache,
+    normalize_address,
+)
+from instrument import STATS, stats_options
+from journal import Journal, atomic_output, detect_id_column
+from throttle import InstrumentedTransport, TokenBucket, backoff_delay, map_ordered
+
 # Google Geocoding API URL
 GOOGLE_MAPS_API_URL = "https://maps.googleapis.com/maps/api/geocode/json"
 
+# Google's default quota for the Geocoding API is 3,000 requests per minute.
+DEFAULT_QPS = 50.0
+DEFAULT_CONCURRENCY = 10
+DEFAULT_MAX_RETRIES = 5
+
+# Statuses that are a definitive answer for an address, and so safe to cache.
+CACHEABLE_STATUSES = {"OK", "ZERO_RESULTS"}
+
+
+class RetryableGeocodeError(Exception):
+    """The geocoding API asked us to slow down or failed transiently."""
+
+
+@dataclass(frozen=True)
+class GeocodeResult:
+    lat: float | None
+    lng: float | None
+    status: str
+    # How precisely the API placed it: ROOFTOP, RANGE_INTERPOLATED,
+    # GEOMETRIC_CENTER or APPROXIMATE, if it said.
+    location_type: str = ""
+
 
 @click.command()
-@click.argument("input_csv", type=click.File("r"))
+@stats_options
+@gazetteer_options
+@click.argument("input_csv", type=InputFile())
 @click.option(
     "--api_key",
     prompt="Google Maps API Key",
@@ -24,51 +85,412 @@ GOOGLE_MAPS_API_URL = "https://maps.googleapis.com/maps/api/geocode/json"
     "--start",
     default=0,
     type=int,
-    help="Index of the first zero-indexed row to process.",
+    help="Index of the first zero-indexed row to process. Prefer --journal.",
+)
+@click.option(
+    "--concurrency",
+    default=DEFAULT_CONCURRENCY,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of geocoding requests in flight at once.",
+)
+@click.option(
+    "--qps",
+    default=DEFAULT_QPS,
+    show_default=True,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Maximum geocoding requests per second.",
+)
+@click.option(
+    "--max-retries",
+    default=DEFAULT_MAX_RETRIES,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Retries for OVER_QUERY_LIMIT, 5xx and network errors.",
+)
+@click.option(
+    "--api-url",
+    default=GOOGLE_MAPS_API_URL,
+    envvar="GEOCODE_API_URL",
+    help="Geocoding endpoint; point this at a local mock server for testing.",
+)
+@click.option(
+    "--cache",
+    "cache_path",
+    type=click.Path(dir_okay=False),
+    envvar="GEOCODE_CACHE",
+    help="SQLite file to cache results in across runs.",
+)
+@click.option(
+    "--cache-ttl-days",
+    default=DEFAULT_TTL_DAYS,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Re-geocode cached addresses older than this.",
+)
+@click.option(
+    "--cache-max-entries",
+    default=DEFAULT_MAX_ENTRIES,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Evict least recently used cache entries beyond this many.",
+)
+@click.option(
+    "--journal",
+    "journal_path",
+    type=click.Path(dir_okay=False),
+    help="Checkpoint each finished row, by NCES ID, to this file.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue an interrupted run, skipping rows already in --journal.",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Write to this file, atomically at the end, instead of stdout. It's "
+    "compressed if the name ends in .gz, .zst or .xz.",
 )
-def geocode_csv(input_csv, api_key, start):
+def geocode_csv(
+    input_csv,
+    api_key,
+    start,
+    concurrency,
+    qps,
+    max_retries,
+    api_url,
+    cache_path,
+    cache_ttl_days,
+    cache_max_entries,
+    gazetteer,
+    journal_path,
+    resume,
+    output_path,
+):
     """
     Geocode addresses in a CSV file using Google Maps Geocoding API and output the result to stdout.
     """
+    if resume and not journal_path:
+        raise click.UsageError("--resume needs --journal.")
+
     csv_reader = csv.DictReader(input_csv)
-    fieldnames = list(csv_reader.fieldnames or []) + ["Latitude", "Longitude"]
-    csv_writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
-
-    # Skip rows up to the start index
-    for _ in range(start):
-        next(csv_reader)
-
-    # Write the header to stdout only if start is 0
-    if start == 0:
-        csv_writer.writeheader()
-
-    # Process each row in the CSV synchronously
-    for row in csv_reader:
-        # Construct the address (adjust based on your column names)
-        address = (
-            f"{row['Street Address']}, {row['City']}, {row['State']}, {row['ZIP']}"
+    fieldnames = geocoded_fieldnames(csv_reader.fieldnames or [], gazetteer)
+
+    with contextlib.ExitStack() as stack:
+        out = (
+            stack.enter_context(atomic_output(output_path))
+            if output_path
+            else sys.stdout
         )
-        lat, lng = geocode_address(address, api_key)
-        row["Latitude"] = lat
-        row["Longitude"] = lng
-        csv_writer.writerow(row)
-        sys.stdout.flush()
+        csv_writer = csv.DictWriter(out, fieldnames=fieldnames)
+
+        # Skip rows up to the start index
+        for _ in range(start):
+            next(csv_reader)
+
+        # Write the header to stdout only if start is 0
+        if start == 0:
+            csv_writer.writeheader()
+
+        journal = None
+        id_column = ""
+        if journal_path:
+            try:
+                journal = stack.enter_context(Journal(journal_path, resume=resume))
+                id_column = detect_id_column(csv_reader.fieldnames or [])
+            except (FileExistsError, ValueError) as e:
+                raise click.UsageError(str(e))
+            if resume:
+                print(f"Resuming with {len(journal)} rows done", file=sys.stderr)
+
+        cache = None
+        if cache_path:
+            cache = GeocodeCache(
+                cache_path, ttl_days=cache_ttl_days, max_entries=cache_max_entries
+            )
+            stack.callback(report_cache, cache)
+            STATS.track_cache("geocode", cache)
+
+        async def run():
+            geocoder = AsyncGeocoder(
+                api_key,
+                concurrency=concurrency,
+                qps=qps,
+                max_retries=max_retries,
+                api_url=api_url,
+                cache=cache,
+                gazetteer=gazetteer,
+            )
 
+            failed = 0
 
-def geocode_address(address, api_key):
+            async def process(row):
+                nonlocal failed
+                row_id = row.get(id_column, "") if journal is not None else ""
+                if row_id and row_id in journal:
+                    return journal.get(row_id)
+                result = await geocoder.fill_row(row)
+                if result.status not in CACHEABLE_STATUSES:
+                    # Gave up (outage, quota, network); leave it out of the
+                    # journal so --resume tries it again.
+                    failed += 1
+                elif row_id:
+                    journal.record(row_id, row)
+                return row
+
+            async with geocoder:
+                rows = STATS.timed("read", csv_reader)
+                async for row in map_ordered(process, rows, concurrency * 4):
+                    with STATS.phase("write"):
+                        csv_writer.writerow(row)
+                    with STATS.phase("flush"):
+                        out.flush()
+                    STATS.count("rows")
+            print(geocoder.summary(), file=sys.stderr)
+            if failed:
+                print(f"{failed} addresses could not be geocoded", file=sys.stderr)
+
+        asyncio.run(run())
+
+
+def report_cache(cache: GeocodeCache) -> None:
+    cache.close()
+    print(
+        f"Geocode cache: {cache.hits} hits, {cache.misses} misses "
+        f"({cache.hit_rate:.1%} hit rate)",
+        file=sys.stderr,
+    )
+
+
+def geocoded_fieldnames(
+    fieldnames: t.Iterable[str], gazetteer: Gazetteer | None = None
+) -> list[str]:
+    """
+    The columns of a CSV once it's geocoded.
+    """
+    added = ["Latitude", "Longitude"]
+    if gazetteer is not None:
+        added.append(PRECISION_COLUMN)
+    return list(fieldnames) + added
+
+
+def row_address(row: dict[str, str]) -> str:
+    """
+    Construct the address to geocode from a CSV row.
+    """
+    # Adjust based on your column names
+    return f"{row['Street Address']}, {row['City']}, {row['State']}, {row['ZIP']}"
+
+
+def row_cache_key(row: dict[str, str]) -> str:
+    return normalize_address(
+        row["Street Address"], row["City"], row["State"], row["ZIP"]
+    )
+
+
+def parse_geocode_response(response: httpx.Response) -> GeocodeResult:
+    """
+    Pull the first result's latitude and longitude out of a geocoding API
+    response. Both are None if there isn't one.
+
+    Raises RetryableGeocodeError for responses that are worth retrying,
+    including a 200 whose body isn't the JSON we expect (a proxy's error
+    page, say).
+    """
+    if response.status_code >= 500:
+        raise RetryableGeocodeError(f"HTTP {response.status_code}")
+    if response.status_code == 200:
+        try:
+            data = response.json()
+            if data["status"] == "OK":
+                geometry = data["results"][0]["geometry"]
+                lat = geometry["location"]["lat"]
+                lng = geometry["location"]["lng"]
+                location_type = geometry.get("location_type") or ""
+                return GeocodeResult(lat, lng, data["status"], location_type)
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            raise RetryableGeocodeError(f"Malformed response: {e!r}") from e
+        if data["status"] in {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}:
+            raise RetryableGeocodeError(data["status"])
+        return GeocodeResult(None, None, data["status"])
+    return GeocodeResult(None, None, f"HTTP {response.status_code}")
+
+
+def geocode_address(address, api_key, api_url=GOOGLE_MAPS_API_URL):
     """
     Geocode an address using Google Maps Geocoding API with httpx.
     """
     params = {"address": address, "key": api_key}
-    response = httpx.get(GOOGLE_MAPS_API_URL, params=params)
-    if response.status_code == 200:
-        data = response.json()
-        if data["status"] == "OK":
-            geometry = data["results"][0]["geometry"]
-            lat = geometry["location"]["lat"]
-            lng = geometry["location"]["lng"]
-            return lat, lng
-    return None, None  # Return None if geocoding fails
+    response = httpx.get(api_url, params=params)
+    try:
+        result = parse_geocode_response(response)
+    except RetryableGeocodeError:
+        return None, None  # Return None if geocoding fails
+    return result.lat, result.lng
+
+
+class AsyncGeocoder:
+    """
+    Geocode many addresses concurrently over a pooled httpx.AsyncClient.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        qps: float = DEFAULT_QPS,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        api_url: str = GOOGLE_MAPS_API_URL,
+        cache: GeocodeCache | None = None,
+        gazetteer: Gazetteer | None = None,
+    ):
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.api_url = api_url
+        self.cache = cache
+        self.gazetteer = gazetteer
+        self.lookups = 0
+        self.requests = 0
+        # Rows placed from the gazetteer rather than looked up.
+        self.located = 0
+        # Rows in flight that share an address wait on the same lookup.
+        self._inflight: dict[str, asyncio.Future[GeocodeResult]] = {}
+        self._bucket = TokenBucket(qps)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=10.0,
+            transport=InstrumentedTransport(
+                httpx.AsyncHTTPTransport(
+                    limits=httpx.Limits(
+                        max_connections=concurrency,
+                        max_keepalive_connections=concurrency,
+                    )
+                )
+            ),
+        )
+
+    async def __aenter__(self) -> t.Self:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._client.aclose()
+
+    async def geocode_address(self, address: str) -> GeocodeResult:
+        """
+        Geocode one address, retrying with backoff on OVER_QUERY_LIMIT, 5xx
+        responses and network errors. Latitude and longitude are None if it
+        can't.
+        """
+        params = {"address": address, "key": self.api_key}
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    with STATS.phase("throttle"):
+                        await self._bucket.acquire()
+                    self.requests += 1
+                    response = await self._client.get(self.api_url, params=params)
+                result = parse_geocode_response(response)
+                STATS.count(f"geocode.status.{result.status}")
+                return result
+            except (RetryableGeocodeError, httpx.TransportError) as e:
+                if attempt == self.max_retries:
+                    print(f"Giving up on {address!r}: {e}", file=sys.stderr)
+                    STATS.count("geocode.failed")
+                    return GeocodeResult(None, None, str(e))
+                STATS.count("geocode.retries")
+                await asyncio.sleep(backoff_delay(attempt))
+        raise AssertionError("unreachable")
+
+    async def geocode_cached(self, key: str, address: str) -> GeocodeResult:
+        """
+        Geocode an address, consulting the cache and any identical lookup
+        already in flight before making an API request.
+        """
+        if key in self._inflight:
+            STATS.count("geocode.coalesced")
+            return await self._inflight[key]
+        if self.cache is not None and (cached := self.cache.get(key)):
+            return GeocodeResult(
+                cached.lat, cached.lng, cached.status, cached.location_type
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self.geocode_address(address)
+            if self.cache is not None and result.status in CACHEABLE_STATUSES:
+                self.cache.put(
+                    key, result.lat, result.lng, result.status, result.location_type
+                )
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved; if no other row is waiting on this address,
+            # asyncio would otherwise log it as never retrieved.
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def fill_row(self, row: dict[str, str]) -> GeocodeResult:
+        """
+        Fill in a row's coordinates, returning the result they came from so
+        callers can tell a final answer from a lookup that gave up.
+        """
+        self.lookups += 1
+        if self.gazetteer is not None:
+            centroid = self.gazetteer.locate(row)
+            if centroid is not None:
+                self.located += 1
+                STATS.count(f"geocode.gazetteer.{centroid.precision}")
+                row["Latitude"] = centroid.lat
+                row["Longitude"] = centroid.lng
+                row[PRECISION_COLUMN] = centroid.precision
+                return GeocodeResult(centroid.lat, centroid.lng, "OK", "APPROXIMATE")
+        result = await self.geocode_cached(row_cache_key(row), row_address(row))
+        row["Latitude"] = result.lat
+        row["Longitude"] = result.lng
+        if self.gazetteer is not None:
+            row[PRECISION_COLUMN] = (
+                api_precision(result.location_type) if result.lat is not None else ""
+            )
+        return result
+
+    async def geocode_row(self, row: dict[str, str]) -> dict[str, str]:
+        await self.fill_row(row)
+        return row
+
+    def summary(self) -> str:
+        summary = f"Geocoded {self.lookups} addresses with {self.requests} API requests"
+        if self.gazetteer is not None:
+            summary += f" ({self.located} placed from the gazetteer"
+            if self.gazetteer.unplaced:
+                summary += (
+                    f"; {self.gazetteer.unplaced} PO Box or other mailing-only "
+                    "addresses it had no ZIP code or city for went to the API"
+                )
+            summary += ")"
+        return summary
+
+    async def geocode_rows(
+        self, rows: t.Iterable[dict[str, str]] | t.AsyncIterable[dict[str, str]]
+    ) -> t.AsyncIterator[dict[str, str]]:
+        """
+        Geocode rows concurrently, yielding them back in input order.
+
+        Only a bounded window of rows is read ahead of the one being yielded,
+        so memory stays flat however long the input is.
+        """
+        async for row in map_ordered(self.geocode_row, rows, self.concurrency * 4):
+            yield row
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+"""
+A persistent SQLite cache of geocoding results, keyed by a normalized form
+of the address so trivially different spellings of the same address share
+an entry.
+
+Entries older than the TTL are treated as missing, and once the cache holds
+more than `max_entries` rows the least recently used ones are evicted.
+"""
+
+import re
+import sqlite3
+import time
+import typing as t
+from dataclasses import dataclass
+from pathlib import Path
+
+DEFAULT_TTL_DAYS = 365
+DEFAULT_MAX_ENTRIES = 1_000_000
+
+# Commit to disk every this many writes so a crash loses little work.
+COMMIT_EVERY = 100
+
+# Spellings that show up interchangeably in NCES addresses.
+ADDRESS_ABBREVIATIONS = {
+    "STREET": "ST",
+    "AVENUE": "AVE",
+    "ROAD": "RD",
+    "DRIVE": "DR",
+    "BOULEVARD": "BLVD",
+    "LANE": "LN",
+    "HIGHWAY": "HWY",
+    "PARKWAY": "PKWY",
+    "COURT": "CT",
+    "PLACE": "PL",
+    "CIRCLE": "CIR",
+    "NORTH": "N",
+    "SOUTH": "S",
+    "EAST": "E",
+    "WEST": "W",
+}
+
+
+def normalize_address(street: str, city: str, state: str, zip_code: str) -> str:
+    """
+    Return a cache key for an address: upper-cased, punctuation stripped,
+    whitespace collapsed, common street words abbreviated and the ZIP cut
+    down to five digits.
+    """
+
+    def clean(value: str) -> str:
+        value = re.sub(r"[^\w\s]", " ", value.upper())
+        words = [ADDRESS_ABBREVIATIONS.get(word, word) for word in value.split()]
+        return " ".join(words)
+
+    street = re.sub(r"\bP\s*O\s+BOX\b", "PO BOX", clean(street))
+    return "|".join([street, clean(city), clean(state), zip_code.strip()[:5]])
+
+
+@dataclass(frozen=True)
+class CachedGeocode:
+    lat: float | None
+    lng: float | None
+    status: str
+    created: float
+    location_type: str = ""
+
+
+class GeocodeCache:
+    """
+    SQLite-backed map from normalized address to geocoding result.
+
+    Keeps hit/miss counts for the lifetime of the object so callers can
+    report a hit rate.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        ttl_days: float = DEFAULT_TTL_DAYS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.ttl = ttl_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._uncommitted = 0
+        self._db = sqlite3.connect(path)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS geocodes (
+                key TEXT PRIMARY KEY,
+                lat REAL,
+                lng REAL,
+                status TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS geocodes_accessed ON geocodes (accessed);
+            """
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(geocodes)")}
+        if "location_type" not in columns:
+            # Caches from before location_type was kept.
+            self._db.execute("ALTER TABLE geocodes ADD COLUMN location_type TEXT")
+
+    def __enter__(self) -> t.Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def get(self, key: str) -> CachedGeocode | None:
+        """
+        Look up a normalized address. Expired entries count as misses.
+        """
+        now = time.time()
+        row = self._db.execute(
+            "SELECT lat, lng, status, created, location_type FROM geocodes "
+            "WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None or now - row[3] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._db.execute("UPDATE geocodes SET accessed = ? WHERE key = ?", (now, key))
+        return CachedGeocode(
+            lat=row[0],
+            lng=row[1],
+            status=row[2],
+            created=row[3],
+            location_type=row[4] or "",
+        )
+
+    def put(
+        self,
+        key: str,
+        lat: float | None,
+        lng: float | None,
+        status: str,
+        location_type: str = "",
+    ) -> None:
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO geocodes "
+            "(key, lat, lng, status, created, accessed, location_type) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, lat, lng, status, now, now, location_type),
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def evict(self) -> int:
+        """
+        Drop expired entries, then the least recently used entries beyond
+        `max_entries`. Returns the number of entries removed.
+        """
+        removed = self._db.execute(
+            "DELETE FROM geocodes WHERE created < ?", (time.time() - self.ttl,)
+        ).rowcount
+        (count,) = self._db.execute("SELECT COUNT(*) FROM geocodes").fetchone()
+        if count > self.max_entries:
+            removed += self._db.execute(
+                """
+                DELETE FROM geocodes WHERE key IN (
+                    SELECT key FROM geocodes ORDER BY accessed LIMIT ?
+                )
+                """,
+                (count - self.max_entries,),
+            ).rowcount
+        return removed
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def close(self) -> None:
+        self.evict()
+        self._db.commit()
+        self._db.close()
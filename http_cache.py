@@ -0,0 +1,440 @@
+"""
+An on-disk HTTP response cache shared by the scrapers, so that tweaking a
+parser doesn't mean re-downloading thousands of pages.
+
+Responses are stored under a key derived from the method, the URL and the
+request headers that can change the response. Bodies are gzip'd and stored
+by the SHA-256 of their content, so identical assets served from many URLs
+are only stored once. Cached entries are revalidated with ETag and
+Last-Modified when possible, and in offline mode are served without
+touching the network at all.
+
+Only pages are cached: responses whose Content-Type is text (or missing)
+and whose body is at most `max_body_bytes` (1 MiB by default). Anything
+else, like the images find_logo.py measures, is passed through as it
+streams in, so callers that only read the start of a body (the image
+header sniff, the cap on homepage bytes) still only download that much.
+Those responses aren't available offline; find_logo.py's --asset-cache is
+what remembers image sizes between runs.
+
+The cache plugs into httpx as a transport:
+
+    client = httpx.Client(transport=CachingTransport(ResponseCache(path)))
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+import typing as t
+from dataclasses import dataclass
+from pathlib import Path
+
+import httpx
+
+# Request headers that can change what a server sends back.
+KEY_HEADERS = ("accept", "accept-language", "user-agent")
+
+# Responses worth replaying. Redirects are included so offline runs can
+# follow the same chains the online run did.
+CACHEABLE_STATUSES = {200, 203, 300, 301, 302, 303, 307, 308, 404, 410}
+
+# How long, in seconds, to trust a cached response without revalidating it.
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+# Bodies bigger than this, as sent, are streamed through instead of cached.
+DEFAULT_MAX_BODY_BYTES = 1024 * 1024
+
+# Content types worth caching; the rest are streamed through.
+CACHEABLE_TYPES = ("text/", "application/xhtml+xml")
+
+
+class OfflineCacheMiss(httpx.RequestError):
+    """An offline request for something that isn't in the cache."""
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+    url: str
+    status_code: int
+    headers: list[tuple[str, str]]
+    body_digest: str
+    stored: float
+
+    def header(self, name: str) -> str | None:
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+
+class ResponseCache:
+    """
+    Content-addressed store of HTTP responses in a directory.
+
+    Entries younger than `max_age` seconds are served without revalidation;
+    older ones are revalidated if the server gave us a validator, and
+    fetched again otherwise. In `offline` mode every entry is served as-is
+    and misses raise OfflineCacheMiss.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        offline: bool = False,
+        max_age: float = DEFAULT_MAX_AGE,
+        max_body_bytes: int = DEFAULT_MAX_BODY_BYTES,
+    ):
+        self.directory = Path(directory)
+        self.offline = offline
+        self.max_age = max_age
+        self.max_body_bytes = max_body_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def key(self, request: httpx.Request) -> str:
+        parts = [request.method, str(request.url)]
+        parts += [f"{h}:{request.headers.get(h, '')}" for h in KEY_HEADERS]
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    def _meta_path(self, key: str) -> Path:
+        return self.directory / "meta" / key[:2] / f"{key}.json"
+
+    def _body_path(self, digest: str) -> Path:
+        return self.directory / "body" / digest[:2] / f"{digest}.gz"
+
+    def lookup(self, request: httpx.Request) -> CacheEntry | None:
+        return self._read_entry(self._meta_path(self.key(request)))
+
+    def entries(self) -> t.Iterator[CacheEntry]:
+        """
+        Yield every usable entry in the cache, in no particular order.
+        """
+        for meta_path in (self.directory / "meta").glob("*/*.json"):
+            if entry := self._read_entry(meta_path):
+                yield entry
+
+    def read_body(self, entry: CacheEntry) -> bytes:
+        """
+        Return an entry's raw body, still content-encoded if it was sent so.
+        """
+        with open(self._body_path(entry.body_digest), "rb") as f:
+            return gzip.decompress(f.read())
+
+    def _read_entry(self, meta_path: Path) -> CacheEntry | None:
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            # Another process is replacing it, or it was damaged; refetch.
+            return None
+        entry = CacheEntry(
+            url=meta["url"],
+            status_code=meta["status_code"],
+            headers=[(k, v) for k, v in meta["headers"]],
+            body_digest=meta["body_digest"],
+            stored=meta["stored"],
+        )
+        if not self._body_path(entry.body_digest).exists():
+            return None
+        return entry
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return self.offline or time.time() - entry.stored < self.max_age
+
+    def conditional_headers(self, entry: CacheEntry) -> dict[str, str]:
+        """
+        Return the headers that ask the server whether `entry` is stale.
+        """
+        headers = {}
+        if etag := entry.header("etag"):
+            headers["If-None-Match"] = etag
+        if last_modified := entry.header("last-modified"):
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def should_store(self, request: httpx.Request, response: httpx.Response) -> bool:
+        """
+        Whether a response is worth reading in full to cache, judging by its
+        headers alone. Bodies that turn out bigger than `max_body_bytes`
+        aren't stored either.
+        """
+        if request.method != "GET" or response.status_code not in CACHEABLE_STATUSES:
+            return False
+        content_type = response.headers.get("content-type", "").lower()
+        if content_type and not content_type.startswith(CACHEABLE_TYPES):
+            return False
+        try:
+            length = int(response.headers.get("content-length", 0))
+        except ValueError:
+            length = 0
+        return length <= self.max_body_bytes
+
+    def store(
+        self, request: httpx.Request, response: httpx.Response, raw: bytes
+    ) -> CacheEntry:
+        """
+        Save a response's raw (still content-encoded) body and headers.
+        """
+        digest = hashlib.sha256(raw).hexdigest()
+        body_path = self._body_path(digest)
+        if not body_path.exists():
+            _atomic_write(body_path, gzip.compress(raw))
+        entry = CacheEntry(
+            url=str(request.url),
+            status_code=response.status_code,
+            headers=list(response.headers.multi_items()),
+            body_digest=digest,
+            stored=time.time(),
+        )
+        self._write_entry(self.key(request), entry)
+        return entry
+
+    def touch(self, request: httpx.Request, entry: CacheEntry) -> CacheEntry:
+        """
+        Mark an entry as freshly validated.
+        """
+        entry = CacheEntry(
+            url=entry.url,
+            status_code=entry.status_code,
+            headers=entry.headers,
+            body_digest=entry.body_digest,
+            stored=time.time(),
+        )
+        self._write_entry(self.key(request), entry)
+        return entry
+
+    def _write_entry(self, key: str, entry: CacheEntry) -> None:
+        meta = {
+            "url": entry.url,
+            "status_code": entry.status_code,
+            "headers": entry.headers,
+            "body_digest": entry.body_digest,
+            "stored": entry.stored,
+        }
+        _atomic_write(self._meta_path(key), json.dumps(meta).encode())
+
+    def build_response(
+        self, request: httpx.Request, entry: CacheEntry
+    ) -> httpx.Response:
+        return httpx.Response(
+            entry.status_code,
+            headers=entry.headers,
+            stream=httpx.ByteStream(self.read_body(entry)),
+            request=request,
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.revalidated + self.misses
+        return (self.hits + self.revalidated) / lookups if lookups else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"HTTP cache: {self.hits} hits, {self.revalidated} revalidated, "
+            f"{self.misses} misses ({self.hit_rate:.1%} hit rate)"
+        )
+
+    # The two transports share everything except how they talk to the
+    # wrapped transport, so the decision logic lives here as a generator.
+    # It yields the request to send (if any) and receives the response,
+    # unread. If it wants to cache the response, it then yields how many
+    # bytes of raw body to read and receives them back; a transport that
+    # finds more than that streams the response through instead. When it
+    # returns a response other than the one it was sent, the transport
+    # closes that one.
+    def _handle(
+        self, request: httpx.Request
+    ) -> t.Generator[httpx.Request | int, httpx.Response | bytes, httpx.Response]:
+        entry = self.lookup(request)
+        if entry is not None and self.is_fresh(entry):
+            self.hits += 1
+            return self.build_response(request, entry)
+        if self.offline:
+            raise OfflineCacheMiss(f"Not in cache: {request.url}", request=request)
+
+        if entry is not None:
+            request.headers.update(self.conditional_headers(entry))
+        response = yield request
+        assert isinstance(response, httpx.Response)
+        if entry is not None and response.status_code == 304:
+            self.revalidated += 1
+            return self.build_response(request, self.touch(request, entry))
+
+        self.misses += 1
+        if not self.should_store(request, response):
+            return response
+        raw = yield self.max_body_bytes
+        assert isinstance(raw, bytes)
+        self.store(request, response, raw)
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=httpx.ByteStream(raw),
+            request=request,
+        )
+
+
+class CachingTransport(httpx.BaseTransport):
+    """
+    Synchronous httpx transport that serves and fills a ResponseCache.
+    """
+
+    def __init__(
+        self, cache: ResponseCache, transport: httpx.BaseTransport | None = None
+    ):
+        self.cache = cache
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        steps = self.cache._handle(request)
+        try:
+            outgoing = next(steps)
+        except StopIteration as stop:
+            return stop.value
+        assert isinstance(outgoing, httpx.Request)
+        response = self.transport.handle_request(outgoing)
+        try:
+            limit = steps.send(response)
+            assert isinstance(limit, int)
+            chunks = response.iter_raw()
+            head: list[bytes] = []
+            size = 0
+            for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
+                if size > limit:
+                    steps.close()
+                    return httpx.Response(
+                        response.status_code,
+                        headers=response.headers,
+                        stream=_Replayed(head, chunks, response),
+                        request=request,
+                    )
+            response.close()
+            steps.send(b"".join(head))
+        except StopIteration as stop:
+            if stop.value is not response:
+                response.close()
+            return stop.value
+        except BaseException:
+            response.close()
+            raise
+        raise AssertionError("unreachable")
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncCachingTransport(httpx.AsyncBaseTransport):
+    """
+    Asynchronous httpx transport that serves and fills a ResponseCache.
+    """
+
+    def __init__(
+        self, cache: ResponseCache, transport: httpx.AsyncBaseTransport | None = None
+    ):
+        self.cache = cache
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        steps = self.cache._handle(request)
+        try:
+            outgoing = next(steps)
+        except StopIteration as stop:
+            return stop.value
+        assert isinstance(outgoing, httpx.Request)
+        response = await self.transport.handle_async_request(outgoing)
+        try:
+            limit = steps.send(response)
+            assert isinstance(limit, int)
+            chunks = response.aiter_raw()
+            head: list[bytes] = []
+            size = 0
+            async for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
+                if size > limit:
+                    steps.close()
+                    return httpx.Response(
+                        response.status_code,
+                        headers=response.headers,
+                        stream=_AsyncReplayed(head, chunks, response),
+                        request=request,
+                    )
+            await response.aclose()
+            steps.send(b"".join(head))
+        except StopIteration as stop:
+            if stop.value is not response:
+                await response.aclose()
+            return stop.value
+        except BaseException:
+            await response.aclose()
+            raise
+        raise AssertionError("unreachable")
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class _Replayed(httpx.SyncByteStream):
+    """
+    The chunks of a body already read, then the rest of it as it arrives.
+    """
+
+    def __init__(
+        self, head: list[bytes], rest: t.Iterator[bytes], response: httpx.Response
+    ):
+        self.head = head
+        self.rest = rest
+        self.response = response
+
+    def __iter__(self) -> t.Iterator[bytes]:
+        yield from self.head
+        yield from self.rest
+
+    def close(self) -> None:
+        self.response.close()
+
+
+class _AsyncReplayed(httpx.AsyncByteStream):
+    """
+    The chunks of a body already read, then the rest of it as it arrives.
+    """
+
+    def __init__(
+        self,
+        head: list[bytes],
+        rest: t.AsyncIterator[bytes],
+        response: httpx.Response,
+    ):
+        self.head = head
+        self.rest = rest
+        self.response = response
+
+    async def __aiter__(self) -> t.AsyncIterator[bytes]:
+        for chunk in self.head:
+            yield chunk
+        async for chunk in self.rest:
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self.response.aclose()
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
@@ -0,0 +1,151 @@
+"""
+Read an image's dimensions from the first few bytes of the file.
+
+Every format we see logos in (PNG, GIF, JPEG, WebP, ICO and SVG) records
+its width and height near the start, so there's no need to download and
+decode a multi-megabyte banner just to learn how big it is.
+"""
+
+import re
+import struct
+
+# JPEG start-of-frame markers, which carry the dimensions. C4, C8 and CC
+# share the range but are something else entirely.
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+SVG_TAG_RE = re.compile(rb"<svg\b[^>]*>", re.IGNORECASE)
+SVG_ATTR_RE = re.compile(
+    rb"""\s([a-zA-Z:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE
+)
+SVG_LENGTH_RE = re.compile(r"^\s*([0-9]*\.?[0-9]+)\s*(px)?\s*$")
+
+
+def sniff_image_size(head: bytes) -> tuple[int, int] | None:
+    """
+    Return the (width, height) recorded in the header of an image that
+    starts with `head`.
+
+    Returns None if `head` is too short to tell or the format isn't one we
+    know; reading more of the file, or decoding all of it, may still work.
+    """
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return _png_size(head)
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return _gif_size(head)
+    if head.startswith(b"\xff\xd8"):
+        return _jpeg_size(head)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return _webp_size(head)
+    if head[:4] == b"\x00\x00\x01\x00":
+        return _ico_size(head)
+    if b"<svg" in head[:4096].lower():
+        return _svg_size(head)
+    return None
+
+
+def _png_size(head: bytes) -> tuple[int, int] | None:
+    # The IHDR chunk always comes first.
+    if len(head) < 24 or head[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", head[16:24])
+    return width, height
+
+
+def _gif_size(head: bytes) -> tuple[int, int] | None:
+    if len(head) < 10:
+        return None
+    width, height = struct.unpack("<HH", head[6:10])
+    return width, height
+
+
+def _jpeg_size(head: bytes) -> tuple[int, int] | None:
+    # Walk the segments until we reach a start-of-frame.
+    offset = 2
+    while offset + 4 <= len(head):
+        if head[offset] != 0xFF:
+            return None
+        marker = head[offset + 1]
+        if marker == 0xFF:
+            # Padding before a marker.
+            offset += 1
+            continue
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:
+            # Markers without a payload.
+            offset += 2
+            continue
+        (length,) = struct.unpack(">H", head[offset + 2 : offset + 4])
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > len(head):
+                return None
+            height, width = struct.unpack(">HH", head[offset + 5 : offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def _webp_size(head: bytes) -> tuple[int, int] | None:
+    if len(head) < 30:
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8 ":
+        # Lossy: a keyframe header follows the start code.
+        if head[23:26] != b"\x9d\x01\x2a":
+            return None
+        width, height = struct.unpack("<HH", head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        # Lossless: two packed 14-bit fields, each stored minus one.
+        if head[20] != 0x2F:
+            return None
+        (bits,) = struct.unpack("<I", head[21:25])
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        # Extended: 24-bit canvas size, each stored minus one.
+        width = int.from_bytes(head[24:27], "little") + 1
+        height = int.from_bytes(head[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def _ico_size(head: bytes) -> tuple[int, int] | None:
+    # Like PIL, report the largest image in the icon. A zero in the
+    # directory means 256 pixels.
+    if len(head) < 6:
+        return None
+    (count,) = struct.unpack("<H", head[4:6])
+    if count == 0 or len(head) < 6 + 16 * count:
+        return None
+    sizes = []
+    for i in range(count):
+        entry = head[6 + 16 * i : 6 + 16 * i + 2]
+        sizes.append((entry[0] or 256, entry[1] or 256))
+    return max(sizes, key=lambda size: size[0] * size[1])
+
+
+def _svg_size(head: bytes) -> tuple[int, int] | None:
+    match = SVG_TAG_RE.search(head)
+    if not match:
+        return None
+    attrs = {
+        name.decode().lower(): (double or single).decode(errors="replace")
+        for name, double, single in SVG_ATTR_RE.findall(match.group())
+    }
+    width = _svg_length(attrs.get("width", ""))
+    height = _svg_length(attrs.get("height", ""))
+    if width and height:
+        return round(width), round(height)
+    # Percentages and the like; fall back to the viewBox.
+    view_box = attrs.get("viewbox", "").replace(",", " ").split()
+    if len(view_box) == 4:
+        try:
+            width, height = float(view_box[2]), float(view_box[3])
+        except ValueError:
+            return None
+        if width > 0 and height > 0:
+            return round(width), round(height)
+    return None
+
+
+def _svg_length(value: str) -> float | None:
+    match = SVG_LENGTH_RE.match(value)
+    return float(match.group(1)) if match else None
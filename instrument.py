@@ -0,0 +1,328 @@
+"""
+Run statistics for the CLI scripts: how long each phase took, how slow the
+network was, how often requests were retried and how well the caches did.
+
+Every script records into the one process-wide STATS object, which does
+nothing until a --stats or --profile option switches it on, so library
+callers (pipeline.py, bench.py) pay nothing for it. Commands get those
+options from the stats_options decorator:
+
+    python geocode.py --stats - input.csv > output.csv
+    python enhance_districts.py web --stats web-stats.json input.csv > output.csv
+    python nceshtml2csv.py --profile convert.prof washington_schools.html > out.csv
+
+The JSON report looks like:
+
+    {
+      "command": "geocode.py",
+      "wall_seconds": 41.2,
+      "rows": 2314,
+      "rows_per_second": 56.2,
+      "phases": {"read": {"seconds": 0.05, "calls": 2315}, ...},
+      "counters": {"geocode.retries": 3, "geocode.status.OK": 2290, ...},
+      "latency": {"http maps.googleapis.com": {"count": 2317, "p50_ms": 50, ...}},
+      "caches": {"geocode": {"hits": 120, "misses": 2194, "hit_rate": 0.052}}
+    }
+
+Phase timers add up the time spent in each phase across every row, so
+phases that overlap on the event loop (waiting on the network, say) can
+add up to more than the wall time. Phases can also nest: "fetch" includes
+any "throttle" wait inside it.
+
+HTTP latencies come from throttle.InstrumentedTransport, which the
+network-facing scripts put under their clients.
+"""
+
+import bisect
+import contextlib
+import cProfile
+import functools
+import json
+import sys
+import time
+import typing as t
+from collections import Counter
+
+import click
+
+# Upper bounds, in milliseconds, of the latency histogram buckets.
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+class Timer:
+    __slots__ = ("calls", "seconds")
+
+    def __init__(self) -> None:
+        self.seconds = 0.0
+        self.calls = 0
+
+    def add(self, seconds: float) -> None:
+        self.seconds += seconds
+        self.calls += 1
+
+
+class _Phase:
+    __slots__ = ("start", "timer")
+
+    def __init__(self, timer: Timer):
+        self.timer = timer
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.timer.add(time.perf_counter() - self.start)
+
+
+class Histogram:
+    """
+    Count latencies into fixed, roughly logarithmic buckets.
+    """
+
+    def __init__(self) -> None:
+        # One more bucket than bounds, for everything slower than the last.
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        ms = seconds * 1000
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.min = min(self.min, ms)
+        self.max = max(self.max, ms)
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Estimate a percentile as the upper bound of the bucket it falls in,
+        capped at the slowest latency seen.
+        """
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self) -> dict[str, t.Any]:
+        if not self.count:
+            return {"count": 0}
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [
+            f">{LATENCY_BUCKETS_MS[-1]}ms"
+        ]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3),
+            "min_ms": round(self.min, 3),
+            "p50_ms": round(self.percentile(0.5), 3),
+            "p90_ms": round(self.percentile(0.9), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "max_ms": round(self.max, 3),
+            "buckets": {
+                label: count for label, count in zip(labels, self.buckets) if count
+            },
+        }
+
+
+class CacheLike(t.Protocol):
+    hits: int
+    misses: int
+
+    @property
+    def hit_rate(self) -> float: ...
+
+
+class Stats:
+    """
+    Timers, counters, latency histograms and caches for one run.
+
+    Updates are cheap no-ops until enable() is called. They're expected to
+    come from the main thread or the event loop.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        # Caches are tracked whether or not stats are on, since they're
+        # usually set up before the command that turns them on runs.
+        self.caches: dict[str, CacheLike] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = time.perf_counter()
+        self.timers: dict[str, Timer] = {}
+        self.counters: Counter[str] = Counter()
+        self.histograms: dict[str, Histogram] = {}
+
+    def enable(self) -> None:
+        self.reset()
+        self.enabled = True
+
+    def _timer(self, name: str) -> Timer:
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = Timer()
+        return timer
+
+    def phase(self, name: str) -> t.ContextManager[None]:
+        """
+        Time the block as one call of the named phase.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return _Phase(self._timer(name))
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """
+        Count time measured some other way as one call of the named phase.
+        """
+        if self.enabled:
+            self._timer(name).add(seconds)
+
+    def timed[T](self, name: str, items: t.Iterable[T]) -> t.Iterable[T]:
+        """
+        Wrap an iterable so the time spent producing each item, such as
+        reading or parsing a row, is counted against the named phase.
+        """
+        if not self.enabled:
+            return items
+        return self._timed(self._timer(name), iter(items))
+
+    def _timed[T](self, timer: Timer, items: t.Iterator[T]) -> t.Iterator[T]:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                timer.add(time.perf_counter() - start)
+            yield item
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            self.counters[name] += n
+
+    def observe(self, name: str, seconds: float) -> None:
+        """
+        Record one latency in the named histogram.
+        """
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def track_cache(self, name: str, cache: CacheLike) -> None:
+        """
+        Include a cache's hits and misses, as they stand at the end of the
+        run, in the report.
+        """
+        self.caches[name] = cache
+
+    def report(self, command: str = "") -> dict[str, t.Any]:
+        wall = time.perf_counter() - self.started
+        rows = self.counters.get("rows", 0)
+        caches = {}
+        for name, cache in self.caches.items():
+            caches[name] = {"hits": cache.hits, "misses": cache.misses}
+            if (revalidated := getattr(cache, "revalidated", None)) is not None:
+                caches[name]["revalidated"] = revalidated
+            caches[name]["hit_rate"] = round(cache.hit_rate, 4)
+        return {
+            "command": command,
+            "wall_seconds": round(wall, 3),
+            "rows": rows,
+            "rows_per_second": round(rows / wall, 1) if wall else 0.0,
+            "phases": {
+                name: {"seconds": round(timer.seconds, 4), "calls": timer.calls}
+                for name, timer in sorted(self.timers.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "latency": {
+                name: histogram.as_dict()
+                for name, histogram in sorted(self.histograms.items())
+            },
+            "caches": caches,
+        }
+
+
+STATS = Stats()
+
+
+def write_report(path: str, command: str) -> None:
+    report = json.dumps(STATS.report(command), indent=2, ensure_ascii=False)
+    if path == "-":
+        print(report, file=sys.stderr)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+
+
+@contextlib.contextmanager
+def collecting(
+    command: str, stats_path: str | None = None, profile_path: str | None = None
+) -> t.Iterator[None]:
+    """
+    Collect stats for the block and write the report to `stats_path` ("-"
+    for stderr), and/or profile it with cProfile into `profile_path`.
+    Both are written even if the block fails.
+    """
+    if stats_path:
+        STATS.enable()
+    profiler = cProfile.Profile() if profile_path else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            print(
+                f"Profile written to {profile_path}; "
+                f"inspect it with: python -m pstats {profile_path}",
+                file=sys.stderr,
+            )
+        if stats_path:
+            write_report(stats_path, command)
+            STATS.enabled = False
+
+
+def stats_options[T](command: t.Callable[..., T]) -> t.Callable[..., T]:
+    """
+    Give a click command --stats and --profile options. Put it straight
+    under the @click.command() (or @group.command()) decorator.
+    """
+
+    @click.option(
+        "--stats",
+        "stats_path",
+        type=click.Path(dir_okay=False, allow_dash=True),
+        metavar="FILE",
+        help="Write a JSON report of phase timings, HTTP latency, retries, "
+        "cache hit rates and throughput here ('-' for stderr).",
+    )
+    @click.option(
+        "--profile",
+        "profile_path",
+        type=click.Path(dir_okay=False),
+        metavar="FILE",
+        help="Profile the run with cProfile and save the stats here.",
+    )
+    @functools.wraps(command)
+    def wrapper(
+        *args: t.Any,
+        stats_path: str | None,
+        profile_path: str | None,
+        **kwargs: t.Any,
+    ) -> T:
+        command_path = click.get_current_context().command_path
+        with collecting(command_path, stats_path, profile_path):
+            return command(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,151 @@
+"""
+Crash-safe checkpointing for long geocode and scrape runs.
+
+A Journal is an append-only JSON-lines file with one entry per finished
+row, keyed by NCES School or District ID. Every entry is fsync'd as it is
+written, so when a run dies the journal holds every row that was paid for;
+rerunning with --resume replays those rows from the journal instead of
+making the requests again.
+"""
+
+import contextlib
+import json
+import os
+import stat
+import sys
+import tempfile
+import typing as t
+from pathlib import Path
+
+from compressed import compressed_writer, compression_for
+
+ID_COLUMNS = ("NCES School ID", "NCES District ID")
+
+
+def detect_id_column(fieldnames: t.Sequence[str]) -> str:
+    """
+    Return the NCES ID column of a CSV, preferring the school ID since
+    school files also carry a district ID.
+    """
+    for column in ID_COLUMNS:
+        if column in fieldnames:
+            return column
+    raise ValueError(f"CSV has none of the ID columns {', '.join(ID_COLUMNS)}")
+
+
+class Journal:
+    """
+    Append-only record of finished rows, keyed by ID.
+    """
+
+    def __init__(self, path: str | Path, resume: bool = False):
+        self.path = Path(path)
+        self.completed: dict[str, dict[str, t.Any]] = {}
+        if self.path.exists() and not resume:
+            raise FileExistsError(
+                f"Journal {self.path} already exists; resume it or delete it."
+            )
+        if resume and self.path.exists():
+            self._load()
+        self._file = open(self.path, "a", encoding="utf-8")  # noqa: SIM115 - closed by close()
+
+    def _load(self) -> None:
+        line = b""
+        parsed = True
+        with open(self.path, "rb") as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write leaves at most one torn line at the end.
+                    print(
+                        f"Ignoring damaged journal line {line_number} in {self.path}",
+                        file=sys.stderr,
+                    )
+                    parsed = False
+                    continue
+                parsed = True
+                self.completed[entry["id"]] = entry["row"]
+            end = f.tell()
+        if line and not line.endswith(b"\n"):
+            if parsed:
+                # The entry is whole and only its newline is missing (say the
+                # file was edited by hand), so keep it and finish the line.
+                with open(self.path, "ab") as f:
+                    f.write(b"\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            else:
+                # Cut off a torn last line so new entries start on their own.
+                os.truncate(self.path, end - len(line))
+
+    def __enter__(self) -> t.Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __contains__(self, row_id: str) -> bool:
+        return row_id in self.completed
+
+    def __len__(self) -> int:
+        return len(self.completed)
+
+    def get(self, row_id: str) -> dict[str, t.Any] | None:
+        return self.completed.get(row_id)
+
+    def record(self, row_id: str, row: dict[str, t.Any]) -> None:
+        """
+        Durably record that `row_id` is finished, producing `row`.
+        """
+        self._file.write(json.dumps({"id": row_id, "row": row}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.completed[row_id] = row
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def output_mode(path: Path) -> int:
+    """
+    The permissions a file written to `path` should get: those of the file
+    it replaces, or what the umask allows for a new file, as a shell
+    redirect would.
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+@contextlib.contextmanager
+def atomic_output(path: str | Path, newline: str = "") -> t.Iterator[t.IO[str]]:
+    """
+    Open `path` for writing such that it only appears, complete, once the
+    block exits without an exception. It's compressed if its name ends in
+    .gz, .zst or .xz.
+    """
+    path = Path(path)
+    compression = compression_for(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        # mkstemp makes the file private (0600), and os.replace keeps that.
+        os.fchmod(fd, output_mode(path))
+        if compression is None:
+            with os.fdopen(fd, "w", encoding="utf-8", newline=newline) as f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            with os.fdopen(fd, "wb") as raw:
+                with compressed_writer(raw, compression, newline=newline) as f:
+                    yield f
+                raw.flush()
+                os.fsync(raw.fileno())
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
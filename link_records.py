@@ -0,0 +1,518 @@
+"""
+Find which existing SHIS (AirTable) records are which NCES schools or
+districts, when the records don't carry an NCES ID to join on.
+
+merge_districts.py and csv2schools.py match records by NCES ID and
+nothing else. Records entered by hand often have no ID, and their names,
+addresses and phone numbers are spelled a little differently from
+NCES's. This links them on those instead:
+
+    python link_records.py data/prelim/ca/california_public_schools.csv School-Table.csv > candidates.csv
+    python link_records.py --state WA data/prelim/wa/washington_districts.html District-Table.csv
+
+Names are compared after normalizing them: upper-cased, punctuation
+stripped and abbreviations like "Elem" and "Acad" spelled out. Streets,
+cities and ZIPs are compared too, taken from their own columns or split
+out of an "Address" like "PO Box 187, Beaumont, CA 92223", and phone
+numbers by their digits. Each of those scores between 0 and 1, and a
+candidate's score is their weighted average over whichever of them both
+sides have.
+
+Comparing every NCES row with every record would take hours for a state
+the size of California, so records are first put into blocks: one per
+state and ZIP, one per state and phonetic (Soundex) key of the first two
+distinctive words of the name, and one per phone number. Each NCES row is
+only compared with the records that share a block with it, which links
+10,000 schools against 10,000 records in a few seconds.
+
+The output is CSV with up to --limit candidates per NCES row, best first,
+scoring at least --min-score. Records are identified by their AirTable
+record ID if the export has one, or else by their row number in the file.
+"""
+
+import contextlib
+import csv
+import itertools
+import re
+import sys
+import typing as t
+from collections import defaultdict
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+
+import click
+
+from geocode_cache import normalize_address
+from instrument import STATS, stats_options
+from journal import atomic_output
+from merge_districts import is_defined, load_records
+from nces_store import DISTRICTS, SCHOOLS, read_rows, table_for
+
+# How much each field counts towards a candidate's score.
+WEIGHTS = {"name": 0.45, "street": 0.15, "phone": 0.2, "zip": 0.1, "city": 0.1}
+
+# The output column for each field's score.
+SCORE_COLUMNS = {
+    "name": "Name Score",
+    "street": "Street Score",
+    "phone": "Phone Score",
+    "zip": "ZIP Score",
+    "city": "City Score",
+}
+
+DEFAULT_MIN_SCORE = 0.7
+DEFAULT_LIMIT = 3
+
+# Blocks bigger than this (a ZIP that's a whole city, say) are too
+# unspecific to be worth comparing everything in them.
+MAX_BLOCK_SIZE = 500
+
+# Where to find each field in SHIS/AirTable records, in order of preference.
+RECORD_FIELDS = {
+    "name": ("School-Name", "District-Name", "Name"),
+    "address": ("Address", "School-Address", "District-Address"),
+    "city": ("City", "School-City", "District-City"),
+    "state": ("State", "School-State", "District-State"),
+    "zip": ("ZIP", "Zip", "School-ZIP", "District-ZIP"),
+    "phone": ("Phone", "School-Phone", "District-Phone"),
+}
+
+NCES_NAME_COLUMNS = {SCHOOLS: "School Name", DISTRICTS: "District Name"}
+
+# Spellings that show up interchangeably in school and district names.
+NAME_ABBREVIATIONS = {
+    "ACAD": "ACADEMY",
+    "CNTY": "COUNTY",
+    "CO": "COUNTY",
+    "CTR": "CENTER",
+    "EL": "ELEMENTARY",
+    "ELEM": "ELEMENTARY",
+    "HS": "HIGH",
+    "INTERMED": "INTERMEDIATE",
+    "JR": "JUNIOR",
+    "MS": "MIDDLE",
+    "MT": "MOUNT",
+    "PREP": "PREPARATORY",
+    "SCH": "SCHOOL",
+    "SCHL": "SCHOOL",
+    "SD": "DISTRICT",
+    "SR": "SENIOR",
+    "ST": "SAINT",
+    "USD": "UNIFIED",
+}
+
+# Words dropped from names entirely.
+NAME_STOPWORDS = {"THE", "OF", "AND", "AT"}
+
+# Words too common to block on.
+GENERIC_NAME_WORDS = {
+    "ACADEMY",
+    "CHARTER",
+    "COUNTY",
+    "DISTRICT",
+    "ELEMENTARY",
+    "HIGH",
+    "JUNIOR",
+    "MIDDLE",
+    "SCHOOL",
+    "SCHOOLS",
+    "SENIOR",
+    "UNIFIED",
+}
+
+# "..., Beaumont, CA 92223" at the end of an address, ZIP optional.
+ADDRESS_TAIL = re.compile(r",\s*([^,]+?),\s*([A-Z]{2})(?:\s+(\d{5})(?:-\d{4})?)?\s*$")
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("BFPV", "1"),
+    **dict.fromkeys("CGJKQSXZ", "2"),
+    **dict.fromkeys("DT", "3"),
+    "L": "4",
+    **dict.fromkeys("MN", "5"),
+    "R": "6",
+}
+
+
+@dataclass(frozen=True)
+class Entity:
+    # NCES ID, or the record's ID or row number.
+    id: str
+    # The name as written, for the output.
+    label: str
+    # Normalized fields; "" if unknown.
+    name: str
+    street: str
+    city: str
+    state: str
+    zip: str
+    phone: str
+
+    @property
+    def name_key(self) -> str:
+        """
+        The Soundex codes of the first two distinctive words of the name.
+        """
+        words = [w for w in self.name.split() if w not in GENERIC_NAME_WORDS]
+        return "".join(soundex(word) for word in words[:2])
+
+    def blocks(self) -> t.Iterator[tuple[str, ...]]:
+        if self.zip:
+            yield ("zip", self.state, self.zip)
+        if name_key := self.name_key:
+            yield ("name", self.state, name_key)
+        if self.phone:
+            yield ("phone", self.phone)
+
+
+@dataclass(frozen=True)
+class Candidate:
+    source: Entity
+    record: Entity
+    score: float
+    # The score for each field both sides have.
+    fields: dict[str, float]
+
+
+def soundex(word: str) -> str:
+    """
+    American Soundex: the first letter, then up to three digits coding the
+    consonants that follow it.
+    """
+    word = "".join(c for c in word.upper() if "A" <= c <= "Z")
+    if not word:
+        return ""
+    digits = []
+    previous = SOUNDEX_CODES.get(word[0], "")
+    for c in word[1:]:
+        code = SOUNDEX_CODES.get(c, "")
+        if code and code != previous:
+            digits.append(code)
+            if len(digits) == 3:
+                break
+        # H and W don't separate letters with the same code; vowels do.
+        if c not in "HW":
+            previous = code
+    return word[0] + "".join(digits).ljust(3, "0")
+
+
+def normalize_name(name: str) -> str:
+    words = re.sub(r"[^\w\s]", " ", name.upper().replace("'", "")).split()
+    words = [NAME_ABBREVIATIONS.get(word, word) for word in words]
+    return " ".join(word for word in words if word not in NAME_STOPWORDS)
+
+
+def normalize_street(street: str) -> str:
+    return normalize_address(street, "", "", "").partition("|")[0]
+
+
+def normalize_city(city: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", city.upper()).split())
+
+
+def normalize_phone(phone: str) -> str:
+    """
+    The last ten digits of a phone number, or "" if it has fewer than seven.
+    """
+    digits = re.sub(r"\D", "", phone)
+    return digits[-10:] if len(digits) >= 7 else ""
+
+
+def make_entity(
+    id: str,
+    name: str,
+    street: str,
+    city: str,
+    state: str,
+    zip_code: str,
+    phone: str,
+) -> Entity:
+    zip_code = zip_code.strip()[:5]
+    return Entity(
+        id=id,
+        label=name.strip(),
+        name=normalize_name(name),
+        street=normalize_street(street),
+        city=normalize_city(city),
+        state=state.strip().upper(),
+        zip=zip_code if zip_code.isdigit() and len(zip_code) == 5 else "",
+        phone=normalize_phone(phone),
+    )
+
+
+def nces_entities(paths: t.Iterable[str]) -> t.Iterator[Entity]:
+    """
+    Read NCES schools or districts (raw, converted or geocoded), once each.
+    """
+    seen = set()
+    for path in paths:
+        rows = read_rows(path)
+        first = next(rows, None)
+        if first is None:
+            continue
+        table = table_for(first)
+        id_column = table.key.source
+        for row in itertools.chain([first], rows):
+            if (nces_id := row.get(id_column, "")) in seen or not nces_id:
+                continue
+            seen.add(nces_id)
+            yield make_entity(
+                nces_id,
+                row.get(NCES_NAME_COLUMNS[table], ""),
+                row.get("Street Address", ""),
+                row.get("City", ""),
+                row.get("State", ""),
+                row.get("ZIP", ""),
+                row.get("Phone", ""),
+            )
+
+
+def record_entities(path: str, default_state: str = "") -> t.Iterator[Entity]:
+    """
+    Read an SHIS/AirTable export, as CSV or JSON.
+    """
+    for number, record in enumerate(load_records(path), start=1):
+        fields = {
+            field: next(
+                (
+                    str(record.fields[name])
+                    for name in names
+                    if is_defined(record.fields.get(name))
+                ),
+                "",
+            )
+            for field, names in RECORD_FIELDS.items()
+        }
+        street = fields["address"]
+        if (tail := ADDRESS_TAIL.search(street)) is not None:
+            street = street[: tail.start()]
+            city, state, zip_code = tail.groups()
+            fields["city"] = fields["city"] or city
+            fields["state"] = fields["state"] or state
+            fields["zip"] = fields["zip"] or zip_code or ""
+        yield make_entity(
+            record.id or f"#{number}",
+            fields["name"],
+            street,
+            fields["city"],
+            fields["state"] or default_state,
+            fields["zip"],
+            fields["phone"],
+        )
+
+
+def zip_similarity(a: str, b: str) -> float:
+    if a == b:
+        return 1.0
+    # Neighbouring ZIPs share their first three digits.
+    return 0.5 if a[:3] == b[:3] else 0.0
+
+
+def street_similarity(a: str, b: str) -> float:
+    """
+    The share of words the two streets have in common.
+    """
+    if a == b:
+        return 1.0
+    a_words, b_words = set(a.split()), set(b.split())
+    return len(a_words & b_words) / len(a_words | b_words)
+
+
+def phone_similarity(a: str, b: str) -> float:
+    if a == b:
+        return 1.0
+    # The same number with a different (or no) area code.
+    return 0.5 if a[-7:] == b[-7:] else 0.0
+
+
+def similarity(
+    matcher: SequenceMatcher, value: str, at_least: float = 0.0
+) -> float | None:
+    """
+    How similar `value` is to the matcher's second sequence, from 0 to 1,
+    or None if it's certainly less than `at_least`.
+    """
+    if value == matcher.b:
+        return 1.0
+    if at_least > 1.0:
+        return None
+    matcher.set_seq1(value)
+    if at_least > 0.0 and (
+        matcher.real_quick_ratio() < at_least or matcher.quick_ratio() < at_least
+    ):
+        return None
+    return matcher.ratio()
+
+
+class Linker:
+    """
+    Records indexed by block, for finding the ones that match an NCES row.
+    """
+
+    def __init__(self, records: t.Iterable[Entity]):
+        self.records = list(records)
+        blocks: dict[tuple[str, ...], list[int]] = defaultdict(list)
+        for i, record in enumerate(self.records):
+            for block in record.blocks():
+                blocks[block].append(i)
+        self.blocks = {
+            block: positions
+            for block, positions in blocks.items()
+            if len(positions) <= MAX_BLOCK_SIZE
+        }
+
+    def candidates(
+        self,
+        source: Entity,
+        min_score: float = DEFAULT_MIN_SCORE,
+        limit: int = DEFAULT_LIMIT,
+    ) -> list[Candidate]:
+        """
+        Score the records that share a block with `source`, and return the
+        best `limit` of those scoring at least `min_score`, best first.
+        """
+        positions: set[int] = set()
+        for block in source.blocks():
+            positions.update(self.blocks.get(block, ()))
+        STATS.count("pairs", len(positions))
+
+        # SequenceMatcher caches what it learns about its second sequence.
+        name_matcher = SequenceMatcher(None, "", source.name, autojunk=False)
+        candidates = []
+        for position in positions:
+            record = self.records[position]
+            # A name is needed to tell schools that share a ZIP or a
+            # switchboard apart.
+            if not (source.name and record.name):
+                continue
+            fields = {}
+            if source.street and record.street:
+                fields["street"] = street_similarity(source.street, record.street)
+            if source.phone and record.phone:
+                fields["phone"] = phone_similarity(source.phone, record.phone)
+            if source.zip and record.zip:
+                fields["zip"] = zip_similarity(source.zip, record.zip)
+            if source.city and record.city:
+                fields["city"] = float(source.city == record.city)
+            weight = WEIGHTS["name"] + sum(WEIGHTS[field] for field in fields)
+            partial = sum(WEIGHTS[field] * value for field, value in fields.items())
+
+            # Most records in a block are some other school nearby, so rule
+            # them out with the cheap upper bounds on the name's similarity
+            # before working it out properly.
+            needed = (min_score * weight - partial) / WEIGHTS["name"]
+            name = similarity(name_matcher, record.name, needed)
+            if name is None:
+                continue
+            fields = {"name": name, **fields}
+            score = (partial + WEIGHTS["name"] * name) / weight
+            if score >= min_score:
+                candidates.append(Candidate(source, record, score, fields))
+        candidates.sort(key=lambda candidate: -candidate.score)
+        return candidates[:limit]
+
+
+def candidate_row(candidate: Candidate, rank: int) -> dict[str, t.Any]:
+    source, record = candidate.source, candidate.record
+    row = {
+        "NCES ID": source.id,
+        "NCES Name": source.label,
+        "Rank": rank,
+        "Score": round(candidate.score, 3),
+        "Record": record.id,
+        "Record Name": record.label,
+    }
+    for field, column in SCORE_COLUMNS.items():
+        value = candidate.fields.get(field)
+        row[column] = "" if value is None else round(value, 3)
+    return row
+
+
+CANDIDATE_FIELDNAMES = [
+    "NCES ID",
+    "NCES Name",
+    "Rank",
+    "Score",
+    "Record",
+    "Record Name",
+    *SCORE_COLUMNS.values(),
+]
+
+
+@click.command()
+@stats_options
+@click.argument(
+    "nces_paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.argument("records_path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--state",
+    default="",
+    help="State to assume for records that don't say, e.g. for the "
+    "per-state data/shis district files.",
+)
+@click.option(
+    "--min-score",
+    default=DEFAULT_MIN_SCORE,
+    show_default=True,
+    type=click.FloatRange(0, 1),
+    help="Leave out candidates scoring lower than this.",
+)
+@click.option(
+    "--limit",
+    default=DEFAULT_LIMIT,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Candidates to list per NCES row.",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Write the CSV here (atomically) instead of stdout.",
+)
+def link_records(
+    nces_paths: tuple[str, ...],
+    records_path: str,
+    state: str,
+    min_score: float,
+    limit: int,
+    output_path: str | None,
+):
+    """
+    List the SHIS records in RECORDS_PATH (an AirTable export, as CSV or
+    JSON) that each NCES school or district in NCES_PATHS is likely to be,
+    as scored candidates.
+    """
+    with STATS.phase("read"):
+        try:
+            linker = Linker(record_entities(records_path, state.upper()))
+            sources = list(nces_entities(nces_paths))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    linked = 0
+    with contextlib.ExitStack() as stack:
+        out = (
+            stack.enter_context(atomic_output(output_path))
+            if output_path
+            else sys.stdout
+        )
+        csv_writer = csv.DictWriter(out, fieldnames=CANDIDATE_FIELDNAMES)
+        csv_writer.writeheader()
+        for source in sources:
+            with STATS.phase("compare"):
+                candidates = linker.candidates(source, min_score, limit)
+            linked += bool(candidates)
+            for rank, candidate in enumerate(candidates, start=1):
+                csv_writer.writerow(candidate_row(candidate, rank))
+            STATS.count("rows")
+    print(
+        f"Found candidates for {linked} of {len(sources)} NCES rows "
+        f"among {len(linker.records)} records",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    link_records()
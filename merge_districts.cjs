@@ -1,4 +1,6 @@
 // This is Dave and Josh's attempt at merging NCES districts into the primary District-Table
+//
+// merge_districts.py plans the same merge offline from table exports.
 
 // ------------------------------
 // CONFIGURATION: General
@@ -11,6 +13,11 @@ const MERGE_TO = "District-Table";
 
 const UNIQUE_FIELD_NAME = "NCES-District-ID";
 
+// Appended to an existing Data-Source-Date. Keep in step with
+// DEFAULT_DATA_SOURCE in merge_districts.py.
+const DATA_SOURCE_FIELD_NAME = "Data-Source-Date";
+const DATA_SOURCE = "NCES-November-2025";
+
 // ------------------------------
 // CONFIGURATION: Field Mappings
 // ------------------------------
@@ -122,11 +129,15 @@ async function mergeExistingDistricts() {
   const uniqueFieldName = UNIQUE_FIELD_NAME;
   const fieldMapping = DISTRICTS_FIELD_MAPPING;
 
-  const existingIDs = new Set(
-    targetRecords.records
-      .map((r) => r.getCellValue(uniqueFieldName))
-      .filter(Boolean)
-  );
+  // Index target records by ID once, rather than searching for each one.
+  // The first record with each ID wins, as records.find() would have it.
+  const targetRecordsByID = new Map();
+  for (const r of targetRecords.records) {
+    const id = r.getCellValue(uniqueFieldName);
+    if (id && !targetRecordsByID.has(id)) {
+      targetRecordsByID.set(id, r);
+    }
+  }
 
   let recordsToUpdate = [];
   let recordsUpdated = [];
@@ -135,17 +146,11 @@ async function mergeExistingDistricts() {
     const uniqueIdentifier = record.getCellValue(uniqueFieldName);
 
     // Only process records that already exist in the target table
-    if (!uniqueIdentifier || !existingIDs.has(uniqueIdentifier)) {
-      continue;
-    }
-
-    // Find the corresponding target record
-    const targetRecord = targetRecords.records.find(
-      (r) => r.getCellValue(uniqueFieldName) === uniqueIdentifier
-    );
+    const targetRecord = uniqueIdentifier
+      ? targetRecordsByID.get(uniqueIdentifier)
+      : undefined;
     if (!targetRecord) {
-      console.error(`Target record with ID '${uniqueIdentifier}' not found`);
-      throw new Error("abort");
+      continue;
     }
 
     // Map values from the "NCES" table to values suitable to updating the target table.
@@ -163,10 +168,18 @@ async function mergeExistingDistricts() {
       if (isDefined(sourceValue) && !isDefined(targetValue)) {
         const mappedValue = mapCellValue(sourceValue);
         updatedFields[fieldName] = mappedValue;
-      } else if (isDefined(targetValue) && fieldName === "Data-Source-Date") {
-        // Special case: update Data-Source-Date even if it exists by
-        // appending ", NCES-November-2025"
-        updatedFields[fieldName] = targetValue + ", NCES-November-2025";
+      } else if (
+        isDefined(targetValue) &&
+        fieldName === DATA_SOURCE_FIELD_NAME
+      ) {
+        // Special case: note the NCES release even though the field
+        // already has a value, unless it's already noted.
+        const sources = String(targetValue)
+          .split(",")
+          .map((s) => s.trim());
+        if (!sources.includes(DATA_SOURCE)) {
+          updatedFields[fieldName] = `${targetValue}, ${DATA_SOURCE}`;
+        }
       }
     }
 
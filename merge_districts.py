@@ -0,0 +1,331 @@
+"""
+Plan the merge of NCES districts into the primary District-Table, offline.
+
+This does what merge_districts.cjs does inside AirTable, but against
+exports on disk, and writes the changes out instead of making them:
+
+  * districts already in the target table get their empty fields filled
+    in from the NCES data; fields that already have a value are never
+    overwritten, except that Data-Source-Date gets the NCES release
+    appended to it;
+  * districts not in the target table are created.
+
+Target records are indexed by NCES-District-ID up front, so planning is a
+single pass over each table however big they get.
+
+The target is an AirTable export: a CSV download, or JSON as returned by
+the API (a list of records, or {"records": [...]}). Record IDs are kept if
+the export has them, either as "id" in JSON or as a "Record ID" column in
+CSV. The source is csv2district.py output, as CSV or JSON.
+
+The plan is JSONL, one batch of at most 50 records per line, ready to hand
+to any uploader:
+
+    {"action": "update", "table": "District-Table", "records": [{"id": "rec...", "fields": {...}}, ...]}
+    {"action": "create", "table": "District-Table", "records": [{"fields": {...}}, ...]}
+
+Update records without a record ID carry NCES-District-ID in their fields,
+so they can be applied as upserts merging on that field.
+
+Usage:
+    python merge_districts.py District-Table.csv data/shis/washington_districts.csv > plan.jsonl
+"""
+
+import csv
+import itertools
+import json
+import sys
+import typing as t
+from dataclasses import dataclass
+from pathlib import Path
+
+import click
+
+from compressed import data_suffix, open_input
+
+MERGE_TO = "District-Table"
+
+UNIQUE_FIELD_NAME = "NCES-District-ID"
+
+DISTRICTS_FIELD_MAPPING = [
+    "District-Name",
+    "District-State",
+    "District-City",
+    "District-Address",
+    "District-URL",
+    "District-Phone",
+    "State-District-ID",
+    "District-County",
+    "District-Students",
+    "District-Teachers",
+    "District-Schools",
+    "NCES-Locale",
+    "NCES-Type",
+    "Data-Source-Date",
+    # "District-Logo-Link",
+]
+
+# Appended to an existing Data-Source-Date. Keep in step with DATA_SOURCE
+# in merge_districts.cjs.
+DATA_SOURCE_FIELD_NAME = "Data-Source-Date"
+DEFAULT_DATA_SOURCE = "NCES-November-2025"
+
+# Where CSV exports keep the AirTable record ID, if they have one.
+RECORD_ID_COLUMNS = ("Record ID", "id")
+
+# AirTable accepts at most this many records per request.
+BATCH_SIZE = 50
+
+Fields = dict[str, t.Any]
+
+
+@dataclass(frozen=True)
+class Record:
+    id: str | None
+    fields: Fields
+
+
+@dataclass
+class MergePlan:
+    updates: list[Record]
+    creates: list[Record]
+    # IDs of source records that were skipped: missing, or repeated.
+    skipped: list[str]
+
+
+def is_defined(value: t.Any) -> bool:
+    """
+    True if a cell has a value. AirTable leaves empty cells out of JSON
+    exports, and they're blank in CSV ones.
+    """
+    return value is not None and value != "" and value != []
+
+
+def map_cell_value(value: t.Any) -> t.Any:
+    """
+    Map a value from the source table to one suitable for writing to the
+    target table.
+    """
+    if isinstance(value, list) and value and all(isinstance(v, dict) for v in value):
+        # Attachments
+        if all("url" in v for v in value):
+            return [{"url": v["url"]} for v in value]
+        # Multi-selects
+        if all("name" in v for v in value):
+            return [{"name": v["name"]} for v in value]
+        # Linked records (carry over their id, since we've got nothing
+        # better to do)
+        if all("id" in v for v in value):
+            return [{"id": v["id"]} for v in value]
+    # Named objects (but don't carry over their id baggage)
+    if isinstance(value, dict) and "name" in value:
+        return {"name": value["name"]}
+    return value
+
+
+def load_records(path: str | Path) -> list[Record]:
+    """
+    Read an AirTable export or csv2district.py output, as CSV or JSON.
+    """
+    path = Path(path)
+    with open_input(path, encoding="utf-8-sig", newline="") as f:
+        if data_suffix(path) != ".json":
+            records = []
+            for row in csv.DictReader(f):
+                record_id = next(
+                    (row.pop(c) for c in RECORD_ID_COLUMNS if c in row), None
+                )
+                records.append(Record(record_id or None, row))
+            return records
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data["records"]
+    return [
+        Record(item.get("id"), item["fields"])
+        if "fields" in item
+        else Record(None, item)
+        for item in data
+    ]
+
+
+def merged_fields(
+    source: Fields,
+    target: Fields,
+    field_mapping: t.Sequence[str] = DISTRICTS_FIELD_MAPPING,
+    data_source: str = DEFAULT_DATA_SOURCE,
+) -> Fields:
+    """
+    Return the fields to update on an existing target record: empty ones
+    that the source has a value for, and Data-Source-Date.
+    """
+    updated = {}
+    for field_name in field_mapping:
+        source_value = source.get(field_name)
+        target_value = target.get(field_name)
+        if is_defined(source_value) and not is_defined(target_value):
+            updated[field_name] = map_cell_value(source_value)
+        elif is_defined(target_value) and field_name == DATA_SOURCE_FIELD_NAME:
+            # Special case: note the NCES release even though the field
+            # already has a value, unless it's already noted.
+            sources = [s.strip() for s in str(target_value).split(",")]
+            if data_source not in sources:
+                updated[field_name] = f"{target_value}, {data_source}"
+    return updated
+
+
+def created_fields(
+    source: Fields, field_mapping: t.Sequence[str] = DISTRICTS_FIELD_MAPPING
+) -> Fields:
+    return {
+        field_name: map_cell_value(source[field_name])
+        for field_name in field_mapping
+        if is_defined(source.get(field_name))
+    }
+
+
+def plan_merge(
+    source: t.Iterable[Record],
+    target: t.Iterable[Record],
+    field_mapping: t.Sequence[str] = DISTRICTS_FIELD_MAPPING,
+    unique_field_name: str = UNIQUE_FIELD_NAME,
+    data_source: str = DEFAULT_DATA_SOURCE,
+) -> MergePlan:
+    """
+    Work out which target records to update and which to create, in one
+    pass over each table.
+    """
+    # The first target record with each ID wins, as with records.find().
+    index: dict[str, Record] = {}
+    for record in target:
+        unique_id = record.fields.get(unique_field_name)
+        if is_defined(unique_id):
+            index.setdefault(str(unique_id), record)
+
+    plan = MergePlan(updates=[], creates=[], skipped=[])
+    created = set()
+    for record in source:
+        unique_id = record.fields.get(unique_field_name)
+        if not is_defined(unique_id):
+            plan.skipped.append("(Missing ID)")
+            continue
+        unique_id = str(unique_id)
+
+        target_record = index.get(unique_id)
+        if target_record is not None:
+            fields = merged_fields(
+                record.fields, target_record.fields, field_mapping, data_source
+            )
+            if fields:
+                # Ensure the unique ID is included
+                fields[unique_field_name] = unique_id
+                plan.updates.append(Record(target_record.id, fields))
+        elif unique_id in created:
+            plan.skipped.append(unique_id)
+        else:
+            created.add(unique_id)
+            fields = {unique_field_name: unique_id}
+            fields.update(created_fields(record.fields, field_mapping))
+            plan.creates.append(Record(None, fields))
+    return plan
+
+
+def iter_batches(
+    plan: MergePlan, table: str = MERGE_TO, batch_size: int = BATCH_SIZE
+) -> t.Iterator[dict[str, t.Any]]:
+    """
+    Yield the plan as batches of operations, updates first.
+    """
+    for action, records in (("update", plan.updates), ("create", plan.creates)):
+        for batch in itertools.batched(records, batch_size):
+            yield {
+                "action": action,
+                "table": table,
+                "records": [
+                    {"id": r.id, "fields": r.fields} if r.id else {"fields": r.fields}
+                    for r in batch
+                ],
+            }
+
+
+def sample(items: t.Sequence[str], count: int) -> str:
+    return ", ".join(items[:count]) + ("..." if len(items) > count else "")
+
+
+@click.command()
+@click.argument("target_path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("source_path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--output",
+    "-o",
+    "output_file",
+    type=click.File("w", encoding="utf-8"),
+    default="-",
+    help="Write the plan here instead of stdout.",
+)
+@click.option(
+    "--batch-size",
+    default=BATCH_SIZE,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Records per batch.",
+)
+@click.option(
+    "--table",
+    default=MERGE_TO,
+    show_default=True,
+    help="Target table name recorded in each batch.",
+)
+@click.option(
+    "--data-source",
+    default=DEFAULT_DATA_SOURCE,
+    show_default=True,
+    help="Appended to existing Data-Source-Date values.",
+)
+def merge_districts(
+    target_path: str,
+    source_path: str,
+    output_file: t.IO[str],
+    batch_size: int,
+    table: str,
+    data_source: str,
+):
+    """
+    Plan merging csv2district.py output into an exported District-Table,
+    writing batches of updates and creates as JSONL.
+    """
+    plan = plan_merge(
+        load_records(source_path), load_records(target_path), data_source=data_source
+    )
+    for batch in iter_batches(plan, table=table, batch_size=batch_size):
+        output_file.write(json.dumps(batch) + "\n")
+
+    print(
+        f"{len(plan.updates)} to update, {len(plan.creates)} to create, "
+        f"{len(plan.skipped)} skipped",
+        file=sys.stderr,
+    )
+    if plan.updates:
+        print(
+            "Updates: "
+            + sample(
+                [
+                    f"{r.fields[UNIQUE_FIELD_NAME]} (fields: "
+                    f"{', '.join(f for f in r.fields if f != UNIQUE_FIELD_NAME)})"
+                    for r in plan.updates
+                ],
+                5,
+            ),
+            file=sys.stderr,
+        )
+    if plan.creates:
+        print(
+            "Creates: "
+            + sample([r.fields[UNIQUE_FIELD_NAME] for r in plan.creates], 10),
+            file=sys.stderr,
+        )
+    if plan.skipped:
+        print(f"Skipped: {sample(plan.skipped, 10)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    merge_districts()
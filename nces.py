@@ -0,0 +1,161 @@
+"""
+One `nces` command for all of the scripts in this repo:
+
+    nces html2csv data/prelim/wa/washington_schools.html > washington_schools.csv
+    nces csv2district data/prelim/wa/washington_districts.csv
+    nces enhance-districts fix-slashes enhanced-districts.csv
+    nces geocode --api_key ABC123 washington_schools.csv
+
+Each subcommand is the script's own click command, so it takes the same
+arguments and options as `python <script>.py` does. Scripts are only
+imported when their subcommand runs, so `nces --help` and the CSV-only
+commands start without loading httpx, BeautifulSoup or Pillow. That adds
+up when they run in a shell loop over every state's files. `python
+bench.py startup` measures it.
+
+`uv sync` installs the `nces` command; `uv run nces ...` or `python
+nces.py ...` work too.
+"""
+
+import importlib
+import typing as t
+from dataclasses import dataclass
+
+import click
+
+
+@dataclass(frozen=True)
+class LazyCommand:
+    # "module:attribute" of the click command.
+    target: str
+    # Shown by --help, so listing the commands imports none of them.
+    help: str
+
+    def load(self) -> click.Command:
+        module_name, _, name = self.target.partition(":")
+        try:
+            module = importlib.import_module(module_name)
+        except ModuleNotFoundError as e:
+            if e.name != module_name:
+                raise
+            # bench.py isn't installed with the rest.
+            raise click.UsageError(f"{module_name}.py only runs from a checkout.")
+        command = getattr(module, name)
+        assert isinstance(command, click.Command), self.target
+        return command
+
+
+class LazyGroup(click.Group):
+    """
+    A group whose commands are imported the first time they're needed.
+    """
+
+    def __init__(
+        self,
+        *args: t.Any,
+        lazy_commands: dict[str, LazyCommand | click.Command],
+        **kwargs: t.Any,
+    ):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted({*super().list_commands(ctx), *self.lazy_commands})
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name in self.commands:
+            return self.commands[cmd_name]
+        lazy = self.lazy_commands.get(cmd_name)
+        if lazy is None:
+            return None
+        command = lazy.load() if isinstance(lazy, LazyCommand) else lazy
+        self.commands[cmd_name] = command
+        return command
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter):
+        rows = []
+        for name in self.list_commands(ctx):
+            command = self.commands.get(name) or self.lazy_commands[name]
+            rows.append(
+                (
+                    name,
+                    command.help
+                    if isinstance(command, LazyCommand)
+                    else command.get_short_help_str(),
+                )
+            )
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
+
+
+ENHANCE_DISTRICTS = LazyGroup(
+    "enhance-districts",
+    help="Add websites and addresses from NCES district pages.",
+    lazy_commands={
+        "web": LazyCommand(
+            "enhance_districts:web",
+            "Scrape each district's NCES detail page into the CSV.",
+        ),
+        "fix-slashes": LazyCommand(
+            "csv_tools:fix_slashes",
+            "Trim doubled trailing slashes from scraped websites.",
+        ),
+    },
+)
+
+COMMANDS: dict[str, LazyCommand | click.Command] = {
+    "html2csv": LazyCommand(
+        "nceshtml2csv:convert_html_to_csv",
+        "Convert NCES HTML exports to CSV.",
+    ),
+    "csv2schools": LazyCommand(
+        "csv2schools:extract_school_info",
+        "Turn geocoded schools into AirTable school records.",
+    ),
+    "csv2district": LazyCommand(
+        "csv2district:extract_district_info",
+        "Turn NCES districts into AirTable district records.",
+    ),
+    "geocode": LazyCommand(
+        "geocode:geocode_csv", "Add latitude and longitude to schools."
+    ),
+    "gazetteer": LazyCommand(
+        "gazetteer:main", "Build the offline ZIP code centroid table."
+    ),
+    "enhance-districts": ENHANCE_DISTRICTS,
+    "find-logo": LazyCommand("find_logo:main", "Find logos on district websites."),
+    "pipeline": LazyCommand(
+        "pipeline:pipeline", "Turn NCES exports into AirTable CSVs in one go."
+    ),
+    "refresh": LazyCommand(
+        "refresh:main", "Update geocoded or enhanced CSVs for a new NCES release."
+    ),
+    "merge-districts": LazyCommand(
+        "merge_districts:merge_districts",
+        "Plan merging districts into the District-Table.",
+    ),
+    "link-records": LazyCommand(
+        "link_records:link_records",
+        "Match SHIS records without NCES IDs to NCES rows.",
+    ),
+    "store": LazyCommand(
+        "nces_store:main", "Keep schools and districts in a SQLite store."
+    ),
+    "spatial": LazyCommand(
+        "spatial_index:main", "Find schools near a place, or in a box."
+    ),
+    "columnar": LazyCommand("columnar:main", "Roll schools up by district or county."),
+    "bench": LazyCommand("bench:main", "Benchmark the pipeline and startup time."),
+}
+
+
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
+def main():
+    """
+    Tools for working with downloaded NCES school data.
+    """
+
+
+if __name__ == "__main__":
+    main()
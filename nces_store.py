@@ -0,0 +1,505 @@
+"""
+A local SQLite store of NCES schools and districts, keyed by NCES ID.
+
+Every other script here reads and rescans flat CSVs. This one loads them
+into a single indexed database instead:
+
+    schools    NCES School ID primary key; indexed by state, district, ZIP
+    districts  NCES District ID primary key; indexed by state, ZIP
+
+Columns are typed (counts are integers, ratios and coordinates are reals)
+and NCES's "not applicable" and "missing" markers (†, ‡, –) are stored as
+NULL. Anything we've added along the way is stored too: the geocoded
+Latitude/Longitude, the district website and addresses scraped by
+enhance_districts.py, and find_logo.py's Logo URL.
+
+Importing upserts by ID and only touches the columns the input file
+actually has, so the same store can be fed the raw export, then the
+geocoded or enhanced version, without losing anything:
+
+    python nces_store.py import data/prelim/wa/washington_districts.html
+    python nces_store.py import data/prelim/wa/geocoded_washington_schools.csv
+    python nces_store.py import enhanced-districts.csv logos.csv
+
+Queries are indexed lookups and come back as CSV with the original NCES
+column names, or with --airtable, shaped like csv2schools.py and
+csv2district.py output:
+
+    python nces_store.py schools --state WA --zip 98520
+    python nces_store.py schools --district 5300030 --airtable > schools.csv
+    python nces_store.py districts --state WA --airtable > districts.csv
+"""
+
+import contextlib
+import csv
+import itertools
+import sqlite3
+import sys
+import typing as t
+from dataclasses import dataclass
+from pathlib import Path
+
+import click
+
+from compressed import data_suffix, open_input
+from csv2district import DISTRICT_FIELDNAMES, district_records
+from csv2schools import SCHOOL_FIELDNAMES, school_records
+from journal import atomic_output
+from nceshtml2csv import HTML_ENCODING, HTML_EXTENSIONS, iter_dict_rows
+
+DEFAULT_DB = "nces.sqlite3"
+
+# Rows are written to the database this many at a time.
+BATCH_SIZE = 1000
+
+# What NCES puts in a cell instead of a value: † not applicable, ‡ doesn't
+# meet data quality standards, – missing.
+MISSING_MARKERS = {"†", "‡", "–"}
+
+SCHOOL_ID_COLUMN = "NCES School ID"
+DISTRICT_ID_COLUMN = "NCES District ID"
+
+Row = dict[str, t.Any]
+
+
+@dataclass(frozen=True)
+class Column:
+    # The column's name in NCES exports and our CSVs.
+    source: str
+    # The column's name in the database.
+    name: str
+    type: str = "TEXT"
+
+
+@dataclass(frozen=True)
+class Table:
+    name: str
+    columns: tuple[Column, ...]
+    # Columns with a secondary index, besides the primary key.
+    indexed: tuple[str, ...]
+
+    @property
+    def key(self) -> Column:
+        return self.columns[0]
+
+    def column(self, source: str) -> Column | None:
+        for column in self.columns:
+            if column.source == source:
+                return column
+        return None
+
+
+SCHOOLS = Table(
+    name="schools",
+    columns=(
+        Column(SCHOOL_ID_COLUMN, "school_id"),
+        Column("State School ID", "state_school_id"),
+        Column(DISTRICT_ID_COLUMN, "district_id"),
+        Column("State District ID", "state_district_id"),
+        Column("Low Grade*", "low_grade"),
+        Column("High Grade*", "high_grade"),
+        Column("School Name", "school_name"),
+        Column("District", "district_name"),
+        Column("County Name*", "county_name"),
+        Column("Street Address", "street_address"),
+        Column("City", "city"),
+        Column("State", "state"),
+        Column("ZIP", "zip"),
+        Column("ZIP 4-digit", "zip4"),
+        Column("Phone", "phone"),
+        Column("Locale Code*", "locale_code"),
+        Column("Locale*", "locale"),
+        Column("Charter", "charter"),
+        Column("Students*", "students", "INTEGER"),
+        Column("Teachers*", "teachers", "REAL"),
+        Column("Student Teacher Ratio*", "student_teacher_ratio", "REAL"),
+        Column("Free Lunch*", "free_lunch", "INTEGER"),
+        Column("Reduced Lunch*", "reduced_lunch", "INTEGER"),
+        Column("Directly Certified*", "directly_certified", "INTEGER"),
+        Column("Type", "type"),
+        Column("Status", "status"),
+        Column("Latitude", "latitude", "REAL"),
+        Column("Longitude", "longitude", "REAL"),
+    ),
+    indexed=("state", "district_id", "zip"),
+)
+
+DISTRICTS = Table(
+    name="districts",
+    columns=(
+        Column(DISTRICT_ID_COLUMN, "district_id"),
+        Column("State District ID", "state_district_id"),
+        Column("District Name", "district_name"),
+        Column("County Name*", "county_name"),
+        Column("Street Address", "street_address"),
+        Column("City", "city"),
+        Column("State", "state"),
+        Column("ZIP", "zip"),
+        Column("ZIP 4-digit", "zip4"),
+        Column("Phone", "phone"),
+        Column("Students*", "students", "INTEGER"),
+        Column("Teachers*", "teachers", "REAL"),
+        Column("Schools", "schools", "INTEGER"),
+        Column("Locale Code*", "locale_code"),
+        Column("Locale*", "locale"),
+        Column("Student Teacher Ratio*", "student_teacher_ratio", "REAL"),
+        Column("Type", "type"),
+        Column("Status", "status"),
+        # Scraped by enhance_districts.py.
+        Column("Web", "website"),
+        Column("Mailing Street Address", "mailing_street_address"),
+        Column("Mailing City", "mailing_city"),
+        Column("Mailing State", "mailing_state"),
+        Column("Mailing ZIP", "mailing_zip"),
+        Column("Mailing ZIP 4-digit", "mailing_zip4"),
+        Column("Physical Street Address", "physical_street_address"),
+        Column("Physical City", "physical_city"),
+        Column("Physical State", "physical_state"),
+        Column("Physical ZIP", "physical_zip"),
+        Column("Physical ZIP 4-digit", "physical_zip4"),
+        # Found by find_logo.py.
+        Column("Logo URL", "logo_url"),
+    ),
+    indexed=("state", "zip"),
+)
+
+TABLES = (SCHOOLS, DISTRICTS)
+
+
+def to_sql(value: str | None, column: Column) -> t.Any:
+    """
+    Convert a CSV cell to the column's type. Blanks and NCES's missing
+    markers become NULL.
+
+    Raises ValueError for numbers that don't parse.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if not value or value in MISSING_MARKERS:
+        return None
+    if column.type == "INTEGER":
+        # NCES writes counts as "159.00000".
+        try:
+            return int(value)
+        except ValueError:
+            return round(float(value))
+    if column.type == "REAL":
+        return float(value)
+    return value
+
+
+def from_sql(value: t.Any) -> str:
+    if value is None:
+        return ""
+    return str(value)
+
+
+def table_for(fieldnames: t.Iterable[str]) -> Table:
+    """
+    Work out whether a file's columns describe schools or districts.
+
+    Raises ValueError if they're neither.
+    """
+    fieldnames = set(fieldnames)
+    if SCHOOL_ID_COLUMN in fieldnames:
+        return SCHOOLS
+    if DISTRICT_ID_COLUMN in fieldnames:
+        return DISTRICTS
+    raise ValueError(
+        f"Expected a {SCHOOL_ID_COLUMN!r} or {DISTRICT_ID_COLUMN!r} column"
+    )
+
+
+def read_rows(path: str | Path) -> t.Iterator[Row]:
+    """
+    Yield rows from a CSV file or an NCES HTML export, either of which may
+    be compressed.
+    """
+    path = Path(path)
+    if data_suffix(path) in HTML_EXTENSIONS:
+        with open_input(path, encoding=HTML_ENCODING) as html_file:
+            yield from iter_dict_rows(html_file)
+    else:
+        with open_input(path, newline="") as csv_file:
+            yield from csv.DictReader(csv_file)
+
+
+class NcesStore:
+    """
+    The SQLite store of schools and districts.
+    """
+
+    def __init__(self, path: str | Path = DEFAULT_DB):
+        self._db = sqlite3.connect(path)
+        statements = []
+        for table in TABLES:
+            columns = [f"{table.key.name} TEXT PRIMARY KEY"] + [
+                f"{column.name} {column.type}" for column in table.columns[1:]
+            ]
+            statements.append(
+                f"CREATE TABLE IF NOT EXISTS {table.name} ({', '.join(columns)});"
+            )
+            statements += [
+                f"CREATE INDEX IF NOT EXISTS {table.name}_{name} "
+                f"ON {table.name} ({name});"
+                for name in table.indexed
+            ]
+        self._db.executescript("\n".join(statements))
+
+    def __enter__(self) -> t.Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def import_rows(self, table: Table, rows: t.Iterable[Row]) -> int:
+        """
+        Upsert rows keyed by NCES ID, setting only the columns the rows
+        have. Rows without an ID are skipped. Returns the number of rows
+        written.
+
+        Everything is written in one transaction, so a bad file leaves the
+        store untouched.
+        """
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return 0
+        columns = [column for column in table.columns if column.source in first]
+        if table.key not in columns:
+            raise ValueError(f"Expected a {table.key.source!r} column")
+        names = [column.name for column in columns]
+        updates = [f"{name} = excluded.{name}" for name in names[1:]]
+        sql = (
+            f"INSERT INTO {table.name} ({', '.join(names)}) "
+            f"VALUES ({', '.join('?' * len(names))}) "
+            f"ON CONFLICT ({table.key.name}) DO "
+            + (f"UPDATE SET {', '.join(updates)}" if updates else "NOTHING")
+        )
+
+        def values(row: Row) -> tuple[t.Any, ...] | None:
+            if not (row.get(table.key.source) or "").strip():
+                return None
+            try:
+                return tuple(
+                    to_sql(row.get(column.source), column) for column in columns
+                )
+            except ValueError as e:
+                raise ValueError(f"{table.key.source} {row[table.key.source]}: {e}")
+
+        count = 0
+        with self._db:
+            for batch in itertools.batched(itertools.chain([first], rows), BATCH_SIZE):
+                params = [p for p in map(values, batch) if p is not None]
+                self._db.executemany(sql, params)
+                count += len(params)
+        return count
+
+    def query(
+        self,
+        table: Table,
+        ids: t.Collection[str] = (),
+        states: t.Collection[str] = (),
+        district_ids: t.Collection[str] = (),
+        zip_codes: t.Collection[str] = (),
+    ) -> t.Iterator[Row]:
+        """
+        Yield rows matching every filter given, keyed by their NCES column
+        names, in the order they were first imported.
+        """
+        filters = [
+            (table.key.name, ids),
+            ("state", [state.upper() for state in states]),
+            ("district_id", district_ids),
+            # ZIPs are stored as five digits; allow ZIP+4 in queries.
+            ("zip", [zip_code.strip()[:5] for zip_code in zip_codes]),
+        ]
+        clauses = []
+        params: list[str] = []
+        for name, values in filters:
+            if not values:
+                continue
+            if name == "district_id" and table is DISTRICTS:
+                name = table.key.name
+            clauses.append(f"{name} IN ({', '.join('?' * len(values))})")
+            params += values
+        sql = f"SELECT {', '.join(column.name for column in table.columns)} "
+        sql += f"FROM {table.name}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY rowid"
+        sources = [column.source for column in table.columns]
+        for values in self._db.execute(sql, params):
+            yield dict(zip(sources, map(from_sql, values)))
+
+    def counts(self) -> t.Iterator[tuple[str, str, int]]:
+        """
+        Yield (table, state, row count) for every state in each table.
+        """
+        for table in TABLES:
+            for state, count in self._db.execute(
+                f"SELECT state, COUNT(*) FROM {table.name} GROUP BY state"
+            ):
+                yield table.name, state or "", count
+
+    def close(self) -> None:
+        self._db.commit()
+        self._db.close()
+
+
+@click.group()
+@click.option(
+    "--db",
+    "db_path",
+    default=DEFAULT_DB,
+    show_default=True,
+    envvar="NCES_DB",
+    type=click.Path(dir_okay=False),
+    help="SQLite file holding the store.",
+)
+@click.pass_context
+def main(ctx: click.Context, db_path: str):
+    """
+    Load NCES schools and districts into SQLite and query them by ID,
+    state, district or ZIP.
+    """
+    ctx.obj = ctx.with_resource(NcesStore(db_path))
+
+
+@main.command("import")
+@click.argument(
+    "paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.pass_obj
+def import_files(store: NcesStore, paths: tuple[str, ...]):
+    """
+    Import NCES exports (.xls/.html) or CSVs derived from them.
+
+    Whether a file holds schools or districts is worked out from its
+    columns. Columns we don't know about are ignored.
+    """
+    for path in paths:
+        rows = read_rows(path)
+        first = next(rows, None)
+        if first is None:
+            print(f"{path}: no rows", file=sys.stderr)
+            continue
+        fieldnames = [name for name in first if name is not None]
+        try:
+            table = table_for(fieldnames)
+            count = store.import_rows(table, itertools.chain([first], rows))
+        except ValueError as e:
+            raise click.ClickException(f"{path}: {e}")
+        unknown = [name for name in fieldnames if table.column(name) is None]
+        print(f"{path}: imported {count} {table.name}", file=sys.stderr)
+        if unknown:
+            print(f"{path}: ignored columns {', '.join(unknown)}", file=sys.stderr)
+
+
+def query_options(func: t.Callable) -> t.Callable:
+    options = [
+        click.option("--id", "ids", multiple=True, help="NCES ID; may be repeated."),
+        click.option(
+            "--state", "states", multiple=True, help="State code; may be repeated."
+        ),
+        click.option(
+            "--district",
+            "district_ids",
+            multiple=True,
+            help="NCES District ID; may be repeated.",
+        ),
+        click.option(
+            "--zip", "zip_codes", multiple=True, help="ZIP code; may be repeated."
+        ),
+        click.option(
+            "--airtable",
+            is_flag=True,
+            help="Shape the output for the AirTable base, like csv2*.py.",
+        ),
+        click.option(
+            "-o",
+            "--output",
+            "output_path",
+            type=click.Path(dir_okay=False),
+            help="Write the CSV here (atomically) instead of stdout.",
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def write_query(
+    store: NcesStore,
+    table: Table,
+    records: t.Callable[[t.Iterable[Row]], t.Iterable[Row]],
+    airtable_fieldnames: list[str],
+    airtable: bool,
+    output_path: str | None,
+    **filters: t.Any,
+) -> None:
+    rows = store.query(table, **filters)
+    fieldnames = [column.source for column in table.columns]
+    if airtable:
+        rows = records(rows)
+        fieldnames = airtable_fieldnames
+    with contextlib.ExitStack() as stack:
+        out = (
+            stack.enter_context(atomic_output(output_path))
+            if output_path
+            else sys.stdout
+        )
+        csv_writer = csv.DictWriter(out, fieldnames=fieldnames)
+        csv_writer.writeheader()
+        csv_writer.writerows(rows)
+
+
+@main.command()
+@query_options
+@click.pass_obj
+def schools(store: NcesStore, airtable: bool, output_path: str | None, **filters):
+    """
+    Write the schools matching every filter given as CSV.
+    """
+    write_query(
+        store,
+        SCHOOLS,
+        school_records,
+        SCHOOL_FIELDNAMES,
+        airtable,
+        output_path,
+        **filters,
+    )
+
+
+@main.command()
+@query_options
+@click.pass_obj
+def districts(store: NcesStore, airtable: bool, output_path: str | None, **filters):
+    """
+    Write the districts matching every filter given as CSV.
+    """
+    write_query(
+        store,
+        DISTRICTS,
+        district_records,
+        DISTRICT_FIELDNAMES,
+        airtable,
+        output_path,
+        **filters,
+    )
+
+
+@main.command()
+@click.pass_obj
+def info(store: NcesStore):
+    """
+    Show how many schools and districts the store holds for each state.
+    """
+    for table, state, count in store.counts():
+        print(f"{table:<10} {state or '??':<3} {count:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,49 +2,382 @@
 Converts an HTML file containing a table of public schools or districts
 to CSV and writes to stdout.
 
+By default the file is tokenized incrementally and each CSV row is written
+as soon as its </tr> closes, so memory use stays flat no matter how large
+the download is. Pass --soup to use the original BeautifulSoup converter.
+
+With --out-dir, any number of files, directories or glob patterns can be
+given; they are converted in parallel, one worker per core, and each CSV is
+written to the output directory under the name of its source file.
+
 See the README for usage instructions.
 """
 
+import contextlib
 import csv
+import glob
+import os
 import sys
+import time
+import typing as t
+from html.parser import HTMLParser
+from pathlib import Path
 
 import click
-from bs4 import BeautifulSoup, Tag
 
+from compressed import (
+    GZIP,
+    XZ,
+    ZSTD,
+    data_suffix,
+    open_input,
+    open_output,
+    uncompressed_path,
+)
+from instrument import STATS, stats_options
+from journal import atomic_output
 
-@click.command()
-@click.argument("html_file", type=click.File("r", encoding="windows-1252"))
-def convert_html_to_csv(html_file):
+# How much of the HTML file to feed the tokenizer at a time.
+CHUNK_SIZE = 64 * 1024
+
+# NCES exports are windows-1252 encoded, whatever their extension says.
+HTML_ENCODING = "windows-1252"
+
+# Extensions we pick up when a directory is given in batch mode.
+HTML_EXTENSIONS = {".xls", ".html", ".htm"}
+
+
+def is_header_row(cells: list[str]) -> bool:
     """
-    Converts an HTML file containing a table of public schools to CSV and writes to stdout.
+    Return True if the row is the one that contains the column headers.
     """
-    # Parse the HTML
-    soup = BeautifulSoup(html_file, "html.parser")
+    # The row with 'NCES School ID' marks the start of the headers
+    return bool(cells) and (
+        "NCES School ID" in cells[0] or "NCES District ID" in cells[0]
+    )
 
-    # Find the table in the HTML
-    table = soup.find("table")
 
-    # Prepare CSV writer to emit to stdout
-    csvwriter = csv.writer(sys.stdout)
+class TableRowParser(HTMLParser):
+    """
+    Incremental tokenizer that collects the <td> text of each <tr> in the
+    first <table> of a document.
 
-    # Find the row that contains headers and write it
-    headers_written = False
+    Completed rows are appended to `rows`; the caller is expected to drain
+    that list after every call to `feed()`.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.rows: list[list[str]] = []
+        self._table_depth = 0
+        self._table_done = False
+        self._row: list[str] | None = None
+        self._cell: list[str] | None = None
+
+    def handle_starttag(self, tag, attrs):
+        if self._table_done:
+            return
+        if tag == "table":
+            self._table_depth += 1
+        elif self._table_depth == 0:
+            return
+        elif tag == "tr":
+            self._finish_row()
+            self._row = []
+        elif tag == "td" and self._row is not None:
+            self._finish_cell()
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if self._table_done or self._table_depth == 0:
+            return
+        if tag == "td":
+            self._finish_cell()
+        elif tag == "tr":
+            self._finish_row()
+        elif tag == "table":
+            self._table_depth -= 1
+            if self._table_depth == 0:
+                self._finish_row()
+                self._table_done = True
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+    def close(self):
+        super().close()
+        self._finish_row()
+
+    def _finish_cell(self):
+        if self._cell is not None and self._row is not None:
+            self._row.append("".join(self._cell).strip())
+        self._cell = None
+
+    def _finish_row(self):
+        self._finish_cell()
+        if self._row is not None:
+            self.rows.append(self._row)
+        self._row = None
+
+
+def iter_table_rows(html_file: t.IO[str]) -> t.Iterator[list[str]]:
+    """
+    Yield the cell text of every row in the first table of an NCES HTML
+    export, reading the file in fixed-size chunks.
+    """
+    parser = TableRowParser()
+    while chunk := html_file.read(CHUNK_SIZE):
+        parser.feed(chunk)
+        yield from parser.rows
+        parser.rows.clear()
+    parser.close()
+    yield from parser.rows
+    parser.rows.clear()
+
+
+def iter_table_rows_soup(html_file: t.IO[str]) -> t.Iterator[list[str]]:
+    """
+    Yield the cell text of every row in the first table of an NCES HTML
+    export by building a full BeautifulSoup tree.
+    """
+    # Imported here so the streaming converter, and everything that uses
+    # it, starts without loading BeautifulSoup.
+    from bs4 import BeautifulSoup, Tag
+
+    soup = BeautifulSoup(html_file, "html.parser")
+    table = soup.find("table")
     assert isinstance(table, Tag)
     for row in table.find_all("tr"):
-        headers = [cell.text.strip() for cell in row.find_all("td")]
-        if headers and (
-            "NCES School ID" in headers[0] or "NCES District ID" in headers[0]
-        ):  # The row with 'NCES School ID' marks the start of the headers
-            csvwriter.writerow(headers)
-            headers_written = True
-            break
-
-    # Write the remaining rows after headers
-    if headers_written:
-        for row in table.find_all("tr")[table.find_all("tr").index(row) + 1 :]:
-            cells = [cell.text.strip() for cell in row.find_all("td")]
-            if cells:  # Skip empty rows
-                csvwriter.writerow(cells)
+        yield [cell.text.strip() for cell in row.find_all("td")]
+
+
+def iter_csv_rows(rows: t.Iterable[list[str]]) -> t.Iterator[list[str]]:
+    """
+    Skip everything before the header row, then yield the header row and
+    every non-empty row after it.
+    """
+    headers_written = False
+    for cells in rows:
+        if not headers_written:
+            if is_header_row(cells):
+                yield cells
+                headers_written = True
+        elif cells:  # Skip empty rows
+            yield cells
+
+
+def iter_dict_rows(html_file: t.IO[str]) -> t.Iterator[dict[str, str]]:
+    """
+    Yield each data row of an NCES HTML export as a dict keyed by column
+    name, the way csv.DictReader would read it back from the CSV.
+    """
+    rows = iter_csv_rows(iter_table_rows(html_file))
+    fieldnames = next(rows, None)
+    if fieldnames is None:
+        return
+    for cells in rows:
+        row: dict[str, t.Any] = dict(zip(fieldnames, cells))
+        if len(cells) > len(fieldnames):
+            row[None] = cells[len(fieldnames) :]
+        for name in fieldnames[len(cells) :]:
+            row[name] = None
+        yield row
+
+
+def write_csv(html_file: t.IO[str], out: t.IO[str], soup: bool = False) -> int:
+    """
+    Convert an open NCES HTML export to CSV, returning the number of data
+    rows written (not counting the header).
+    """
+    rows = iter_table_rows_soup(html_file) if soup else iter_table_rows(html_file)
+    csvwriter = csv.writer(out)
+    count = -1
+    for cells in STATS.timed("parse", iter_csv_rows(rows)):
+        with STATS.phase("write"):
+            csvwriter.writerow(cells)
+        count += 1
+    STATS.count("rows", max(count, 0))
+    return max(count, 0)
+
+
+def convert_file(html_path: Path, csv_path: Path, soup: bool = False) -> int:
+    """
+    Convert one NCES HTML export on disk to a CSV file on disk. Either
+    may be compressed.
+
+    This runs in a worker process during batch conversion.
+    """
+    with (
+        open_input(html_path, encoding=HTML_ENCODING) as html_file,
+        open_output(csv_path, newline="") as out,
+    ):
+        return write_csv(html_file, out, soup=soup)
+
+
+def _timed_convert_file(
+    html_path: Path, csv_path: Path, soup: bool
+) -> tuple[int, float]:
+    start = time.perf_counter()
+    rows = convert_file(html_path, csv_path, soup=soup)
+    return rows, time.perf_counter() - start
+
+
+def expand_html_paths(patterns: t.Iterable[str]) -> list[Path]:
+    """
+    Expand a mix of file names, directories and glob patterns into a sorted,
+    de-duplicated list of HTML export paths.
+    """
+    paths: set[Path] = set()
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            paths.update(
+                p
+                for p in path.iterdir()
+                if p.is_file() and data_suffix(p) in HTML_EXTENSIONS
+            )
+        elif path.is_file():
+            paths.add(path)
+        else:
+            matches = [Path(m) for m in glob.glob(pattern, recursive=True)]
+            if not matches:
+                raise click.BadParameter(f"No such file, directory or glob: {pattern}")
+            paths.update(m for m in matches if m.is_file())
+    return sorted(paths)
+
+
+def convert_batch(
+    html_paths: list[Path],
+    out_dir: Path,
+    jobs: int | None,
+    soup: bool,
+    compress: str | None = None,
+) -> None:
+    """
+    Convert many NCES HTML exports in parallel, writing one CSV per export to
+    `out_dir` (compressed, if `compress` is GZIP, ZSTD or XZ) and a
+    per-file summary to stderr. A file that fails is reported and the rest
+    are still converted; then it raises a ClickException.
+    """
+    suffix = f".csv.{compress}" if compress else ".csv"
+    csv_paths = [out_dir / f"{uncompressed_path(p).stem}{suffix}" for p in html_paths]
+    if len(set(csv_paths)) != len(csv_paths):
+        raise click.UsageError(
+            "Two or more input files share a name; their CSVs would collide."
+        )
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # Loading the process pool machinery is slow, and only batches need it.
+    from concurrent.futures import ProcessPoolExecutor
+
+    start = time.perf_counter()
+    total_rows = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        # Submit the biggest files first so one large state doesn't end up
+        # running alone at the tail of the batch.
+        by_size = sorted(
+            zip(html_paths, csv_paths), key=lambda p: p[0].stat().st_size, reverse=True
+        )
+        submitted = {
+            html_path: executor.submit(_timed_convert_file, html_path, csv_path, soup)
+            for html_path, csv_path in by_size
+        }
+        futures = [submitted[html_path] for html_path in html_paths]
+        for html_path, csv_path, future in zip(html_paths, csv_paths, futures):
+            try:
+                rows, elapsed = future.result()
+            except Exception as e:  # noqa: BLE001 - one bad export mustn't sink the batch
+                failed += 1
+                STATS.count("files.failed")
+                print(f"{html_path}: {e!r}", file=sys.stderr)
+                continue
+            total_rows += rows
+            # Workers' own stats stay in their processes; count whole files.
+            STATS.add_time("convert", elapsed)
+            STATS.count("rows", rows)
+            print(
+                f"{html_path} -> {csv_path}: {rows} rows in {elapsed:.2f}s",
+                file=sys.stderr,
+            )
+    print(
+        f"Converted {len(html_paths) - failed} files, {total_rows} rows "
+        f"in {time.perf_counter() - start:.2f}s",
+        file=sys.stderr,
+    )
+    if failed:
+        raise click.ClickException(f"{failed} files could not be converted")
+
+
+@click.command()
+@stats_options
+@click.argument("html_files", nargs=-1, required=True)
+@click.option(
+    "--soup",
+    is_flag=True,
+    help="Parse the whole file with BeautifulSoup instead of streaming it.",
+)
+@click.option(
+    "--out-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    help="Batch mode: write one CSV per input file into this directory.",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    help="Number of worker processes in batch mode. Defaults to one per core.",
+)
+@click.option(
+    "--compress",
+    type=click.Choice([GZIP, ZSTD, XZ]),
+    help="Batch mode: compress each CSV, naming it e.g. schools.csv.gz.",
+)
+@click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Write the CSV here (atomically) instead of stdout; it's compressed "
+    "if the name ends in .gz, .zst or .xz.",
+)
+def convert_html_to_csv(html_files, soup, out_dir, jobs, compress, output_path):
+    """
+    Converts an HTML file containing a table of public schools to CSV and writes to stdout.
+
+    With --out-dir, converts every given file, directory or glob of HTML
+    exports in parallel instead.
+
+    Exports compressed with gzip, Zstandard or xz are decompressed as they're
+    read.
+    """
+    if out_dir is None:
+        if len(html_files) != 1:
+            raise click.UsageError("Pass --out-dir to convert more than one file.")
+        if compress:
+            raise click.UsageError(
+                "--compress is for --out-dir; name the -o file .gz, .zst or .xz "
+                "instead."
+            )
+        with contextlib.ExitStack() as stack:
+            try:
+                html_file = stack.enter_context(
+                    open_input(html_files[0], encoding=HTML_ENCODING)
+                )
+            except (OSError, ValueError) as e:
+                raise click.ClickException(str(e))
+            out = (
+                stack.enter_context(atomic_output(output_path))
+                if output_path
+                else sys.stdout
+            )
+            write_csv(html_file, out, soup=soup)
+        return
+
+    if output_path:
+        raise click.UsageError("-o is for a single file; use --out-dir for batches.")
+    convert_batch(expand_html_paths(html_files), out_dir, jobs, soup, compress)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,408 @@
+"""
+Run the whole NCES HTML -> AirTable CSV process in one go.
+
+Producing data/shis/*.csv by hand means running nceshtml2csv.py,
+geocode.py, csv2schools.py and csv2district.py one after another, each
+writing an intermediate CSV for the next to read. This script chains the
+same stages in a single process instead. Rows stream from the HTML export
+through geocoding to the AirTable CSVs, with no intermediate files:
+
+    schools HTML -> convert -> geocode -> shape -> schools CSV
+    districts HTML -> convert -> shape -> districts CSV
+
+Stages are joined by bounded queues, so memory stays flat however large
+the export is. Parsing HTML and writing CSV run in worker threads while
+geocoding runs concurrently on the event loop, and the districts run
+alongside the schools. Outputs are written atomically once everything has
+succeeded.
+
+Usage:
+    python pipeline.py --api_key ABC123 \\
+        --schools-html data/prelim/wa/washington_schools.html \\
+        --districts-html data/prelim/wa/washington_districts.html \\
+        --schools-out data/shis/washington_schools.csv \\
+        --districts-out data/shis/washington_districts.csv
+
+    # Also keep the intermediate geocoded CSV, as in data/prelim:
+    python pipeline.py ... --geocoded-out data/prelim/wa/geocoded_washington_schools.csv
+
+    # Place PO Boxes from the offline ZIP centroid table (see gazetteer.py):
+    python pipeline.py ... --gazetteer
+"""
+
+import asyncio
+import contextlib
+import csv
+import itertools
+import queue
+import sys
+import threading
+import typing as t
+
+import click
+
+from compressed import open_input
+from csv2district import DISTRICT_FIELDNAMES, district_records
+from csv2schools import SCHOOL_FIELDNAMES, school_records
+from gazetteer import gazetteer_options
+from geocode import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_QPS,
+    GOOGLE_MAPS_API_URL,
+    AsyncGeocoder,
+    geocoded_fieldnames,
+    report_cache,
+)
+from geocode_cache import GeocodeCache
+from instrument import STATS, stats_options
+from journal import atomic_output
+from nceshtml2csv import HTML_ENCODING, iter_dict_rows
+
+# Rows travel between stages in batches of this many, and each queue holds
+# at most this many batches.
+BATCH_SIZE = 100
+QUEUE_BATCHES = 16
+
+Row = dict[str, t.Any]
+
+
+class PipelineAborted(Exception):
+    """The stage downstream of a pipe gave up, so there's no point continuing."""
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_DONE = object()
+
+
+class Pipe:
+    """
+    A bounded queue of row batches from one stage to the next. Either end
+    may be a worker thread or the event loop.
+
+    The producer calls put() and finally close(), or fail() if it breaks;
+    the consumer iterates, and calls abort() if it gives up early so that a
+    producer blocked on a full pipe doesn't wait forever.
+    """
+
+    def __init__(self, max_batches: int = QUEUE_BATCHES):
+        self._queue: queue.Queue[t.Any] = queue.Queue(max_batches)
+        self._aborted = threading.Event()
+
+    def put(self, batch: t.Any) -> None:
+        while True:
+            if self._aborted.is_set():
+                raise PipelineAborted()
+            try:
+                self._queue.put(batch, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self) -> None:
+        self.put(_DONE)
+
+    def fail(self, error: BaseException) -> None:
+        with contextlib.suppress(PipelineAborted):
+            self.put(_Failed(error))
+
+    def abort(self) -> None:
+        self._aborted.set()
+
+    def get(self) -> t.Any:
+        while True:
+            if self._aborted.is_set():
+                raise PipelineAborted()
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _unpack(self, batch: t.Any) -> list[Row] | None:
+        if batch is _DONE:
+            return None
+        if isinstance(batch, _Failed):
+            raise batch.error
+        return batch
+
+    def __iter__(self) -> t.Iterator[Row]:
+        while (batch := self._unpack(self.get())) is not None:
+            yield from batch
+
+    async def __aiter__(self) -> t.AsyncIterator[Row]:
+        while (batch := self._unpack(await asyncio.to_thread(self.get))) is not None:
+            for row in batch:
+                yield row
+
+
+def fill_pipe(rows: t.Iterable[Row], pipe: Pipe) -> None:
+    """
+    Feed rows from a blocking source into a pipe; runs in a worker thread.
+    """
+    try:
+        for batch in itertools.batched(rows, BATCH_SIZE):
+            pipe.put(list(batch))
+        pipe.close()
+    except PipelineAborted:
+        pass
+    except BaseException as e:  # noqa: BLE001 - re-raised by the reader
+        pipe.fail(e)
+
+
+async def afill_pipe(rows: t.AsyncIterable[Row], pipe: Pipe) -> None:
+    """
+    Feed rows from an async source into a pipe.
+    """
+    try:
+        batch = []
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                await asyncio.to_thread(pipe.put, batch)
+                batch = []
+        if batch:
+            await asyncio.to_thread(pipe.put, batch)
+        await asyncio.to_thread(pipe.close)
+    except PipelineAborted:
+        pass
+    except BaseException as e:
+        pipe.fail(e)
+        raise
+
+
+def drain_pipe(
+    rows: t.Iterable[Row], pipe: Pipe, write: t.Callable[[Row], t.Any]
+) -> int:
+    """
+    Write every row from a pipe-fed generator chain; runs in a worker thread.
+    Returns the number of rows written.
+    """
+    count = 0
+    try:
+        for row in rows:
+            write(row)
+            count += 1
+    except BaseException:
+        pipe.abort()
+        raise
+    return count
+
+
+def read_html_rows(path: str) -> t.Iterator[Row]:
+    with open_input(path, encoding=HTML_ENCODING) as html_file:
+        yield from iter_dict_rows(html_file)
+
+
+def html_fieldnames(path: str) -> list[str]:
+    for row in read_html_rows(path):
+        return [name for name in row if name is not None]
+    return []
+
+
+def write_districts(html_path: str, out: t.IO[str]) -> int:
+    """
+    Convert and shape a districts export in one streaming pass.
+    """
+    csv_writer = csv.DictWriter(out, fieldnames=DISTRICT_FIELDNAMES)
+    csv_writer.writeheader()
+    count = 0
+    for record in district_records(read_html_rows(html_path)):
+        csv_writer.writerow(record)
+        count += 1
+    return count
+
+
+async def run_schools(
+    html_path: str,
+    geocoder: AsyncGeocoder,
+    out: t.IO[str],
+    geocoded_out: t.IO[str] | None,
+) -> int:
+    """
+    Convert, geocode and shape a schools export, streaming rows from stage
+    to stage. Returns the number of school records written.
+    """
+    csv_writer = csv.DictWriter(out, fieldnames=SCHOOL_FIELDNAMES)
+    csv_writer.writeheader()
+    geocoded_writer = None
+    if geocoded_out is not None:
+        fieldnames = geocoded_fieldnames(html_fieldnames(html_path), geocoder.gazetteer)
+        geocoded_writer = csv.DictWriter(geocoded_out, fieldnames=fieldnames)
+        geocoded_writer.writeheader()
+
+    converted = Pipe()
+    geocoded = Pipe()
+
+    def shaped_rows() -> t.Iterator[Row]:
+        for row in geocoded:
+            if geocoded_writer is not None:
+                geocoded_writer.writerow(row)
+            yield row
+
+    stages = [
+        asyncio.ensure_future(
+            asyncio.to_thread(fill_pipe, read_html_rows(html_path), converted)
+        ),
+        asyncio.ensure_future(afill_pipe(geocoder.geocode_rows(converted), geocoded)),
+        asyncio.ensure_future(
+            asyncio.to_thread(
+                drain_pipe,
+                school_records(shaped_rows()),
+                geocoded,
+                csv_writer.writerow,
+            )
+        ),
+    ]
+    try:
+        _, _, count = await asyncio.gather(*stages)
+    except BaseException:
+        # Unblock the threads and stop geocoding before the client closes.
+        converted.abort()
+        geocoded.abort()
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+        raise
+    return count
+
+
+@click.command()
+@stats_options
+@gazetteer_options
+@click.option(
+    "--schools-html",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="NCES public school export (.xls/.html).",
+)
+@click.option(
+    "--districts-html",
+    type=click.Path(exists=True, dir_okay=False),
+    help="NCES district export (.xls/.html).",
+)
+@click.option(
+    "--schools-out",
+    required=True,
+    type=click.Path(dir_okay=False),
+    help="Where to write the AirTable schools CSV.",
+)
+@click.option(
+    "--districts-out",
+    type=click.Path(dir_okay=False),
+    help="Where to write the AirTable districts CSV.",
+)
+@click.option(
+    "--geocoded-out",
+    type=click.Path(dir_okay=False),
+    help="Also write the geocoded schools CSV here.",
+)
+@click.option(
+    "--api_key",
+    prompt="Google Maps API Key",
+    help="Your Google Maps Geocoding API key.",
+)
+@click.option(
+    "--concurrency",
+    default=DEFAULT_CONCURRENCY,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of geocoding requests in flight at once.",
+)
+@click.option(
+    "--qps",
+    default=DEFAULT_QPS,
+    show_default=True,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Maximum geocoding requests per second.",
+)
+@click.option(
+    "--max-retries",
+    default=DEFAULT_MAX_RETRIES,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Retries for OVER_QUERY_LIMIT, 5xx and network errors.",
+)
+@click.option(
+    "--api-url",
+    default=GOOGLE_MAPS_API_URL,
+    envvar="GEOCODE_API_URL",
+    help="Geocoding endpoint; point this at a local mock server for testing.",
+)
+@click.option(
+    "--cache",
+    "cache_path",
+    type=click.Path(dir_okay=False),
+    envvar="GEOCODE_CACHE",
+    help="SQLite file to cache geocoding results in across runs.",
+)
+def pipeline(
+    schools_html,
+    districts_html,
+    schools_out,
+    districts_out,
+    geocoded_out,
+    api_key,
+    concurrency,
+    qps,
+    max_retries,
+    api_url,
+    cache_path,
+    gazetteer,
+):
+    """
+    Convert, geocode and shape NCES exports into AirTable CSVs in one pass.
+    """
+    if bool(districts_html) != bool(districts_out):
+        raise click.UsageError("--districts-html and --districts-out go together.")
+
+    with contextlib.ExitStack() as stack:
+        schools_file = stack.enter_context(atomic_output(schools_out))
+        geocoded_file = (
+            stack.enter_context(atomic_output(geocoded_out)) if geocoded_out else None
+        )
+        districts_file = (
+            stack.enter_context(atomic_output(districts_out)) if districts_out else None
+        )
+        cache = None
+        if cache_path:
+            cache = GeocodeCache(cache_path)
+            stack.callback(report_cache, cache)
+            STATS.track_cache("geocode", cache)
+
+        async def run():
+            geocoder = AsyncGeocoder(
+                api_key,
+                concurrency=concurrency,
+                qps=qps,
+                max_retries=max_retries,
+                api_url=api_url,
+                cache=cache,
+                gazetteer=gazetteer,
+            )
+            stages = []
+            async with geocoder:
+                stages.append(
+                    run_schools(schools_html, geocoder, schools_file, geocoded_file)
+                )
+                if districts_file is not None:
+                    stages.append(
+                        asyncio.to_thread(
+                            write_districts, districts_html, districts_file
+                        )
+                    )
+                counts = await asyncio.gather(*stages)
+            STATS.count("rows", counts[0])
+            print(geocoder.summary(), file=sys.stderr)
+            print(f"Wrote {counts[0]} schools", file=sys.stderr)
+            if len(counts) > 1:
+                print(f"Wrote {counts[1]} districts", file=sys.stderr)
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    pipeline()
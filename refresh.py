@@ -0,0 +1,539 @@
+"""
+Refresh geocoded schools and enhanced districts from a new NCES export
+without redoing the rows that haven't changed.
+
+Every row of the new export is matched by NCES ID against the previous
+snapshot (the geocoded or enhanced CSV from last time) and classified by
+comparing a hash of the columns both files share:
+
+    added      not in the previous snapshot
+    removed    in the previous snapshot but not the new export
+    moved      changed, including its address
+    changed    changed, but at the same address
+    unchanged  identical
+
+Only added and moved rows are geocoded or scraped again, along with any
+row whose geocode or scrape failed last time (all its Latitude/Longitude
+or scraped columns are blank), so failures get retried. `schools` adds a
+Geocode Status column saying what the API answered, so an address it has
+no result for (ZERO_RESULTS) counts as answered rather than failed and
+isn't paid for again on every refresh. Every other row
+carries forward the columns we added last time (Latitude/Longitude, the
+scraped website and addresses, the Logo URL and so on), so a refresh
+costs API calls and page fetches only for what NCES actually changed.
+Addresses are compared the way the geocode cache compares them, so a
+respelled "Street" doesn't count as a move.
+
+Usage:
+    # What changed between two exports or snapshots?
+    python refresh.py diff data/prelim/wa/geocoded_washington_schools.csv \\
+        new/washington_schools.html --changes changes.csv
+
+    # Geocode only the new and moved schools:
+    python refresh.py schools --api_key ABC123 \\
+        data/prelim/wa/geocoded_washington_schools.csv new/washington_schools.html \\
+        -o new/geocoded_washington_schools.csv
+
+    # Scrape only the new and moved districts:
+    python refresh.py districts enhanced-districts.csv new/washington_districts.html \\
+        -o new/enhanced-districts.csv
+"""
+
+import asyncio
+import contextlib
+import csv
+import hashlib
+import sys
+import typing as t
+from collections import Counter
+from dataclasses import dataclass
+
+import click
+import httpx
+
+from enhance_districts import (
+    DEFAULT_MAX_PER_HOST,
+    DEFAULT_MIN_DELAY,
+    DEFAULT_PARSER,
+    DEFAULT_WORKERS,
+    PARSERS,
+    SCRAPED_COLUMNS,
+    check_parser,
+    detail_transport,
+    scrape_district,
+)
+from enhance_districts import DEFAULT_MAX_RETRIES as DEFAULT_SCRAPE_RETRIES
+from gazetteer import PRECISION_COLUMN, Gazetteer, api_precision, gazetteer_options
+from geocode import (
+    CACHEABLE_STATUSES,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_QPS,
+    GOOGLE_MAPS_API_URL,
+    AsyncGeocoder,
+    report_cache,
+    row_cache_key,
+)
+from geocode_cache import GeocodeCache
+from http_cache import DEFAULT_MAX_AGE, ResponseCache
+from instrument import STATS, stats_options
+from journal import atomic_output, detect_id_column
+from nces_store import read_rows
+from throttle import map_ordered
+
+ADDED = "added"
+REMOVED = "removed"
+MOVED = "moved"
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+CHANGES = (ADDED, REMOVED, MOVED, CHANGED, UNCHANGED)
+
+# Rows that need geocoding or scraping again.
+STALE = {ADDED, MOVED}
+
+GEOCODED_COLUMNS = ["Latitude", "Longitude"]
+# The API's answer for a row, blank if it gave up. Together with the
+# coordinates, it's blank only when the geocode failed.
+GEOCODE_STATUS_COLUMN = "Geocode Status"
+
+Row = dict[str, t.Any]
+
+
+def read_fieldnames(path: str) -> list[str]:
+    for row in read_rows(path):
+        return [name for name in row if name is not None]
+    return []
+
+
+def content_hash(row: Row, columns: t.Iterable[str]) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    for column in columns:
+        digest.update((row.get(column) or "").encode())
+        digest.update(b"\x1f")
+    return digest.digest()
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    content: bytes
+    address: str
+    derived: tuple[str, ...]
+    # Every regenerated column is blank: the last geocode or scrape failed.
+    # A geocode with no results still has its Geocode Status.
+    failed: bool
+
+
+class Refresh:
+    """
+    A new export compared, row by row, against the previous snapshot.
+
+    Only the hashes and derived columns of the previous snapshot are kept
+    in memory; the new export is streamed.
+    """
+
+    def __init__(
+        self,
+        previous_path: str,
+        current_path: str,
+        derived_columns: t.Sequence[str] = (),
+    ):
+        self.current_path = current_path
+        self.fieldnames = read_fieldnames(current_path)
+        previous_fieldnames = read_fieldnames(previous_path)
+        self.id_column = detect_id_column(self.fieldnames)
+        if self.id_column not in previous_fieldnames:
+            raise ValueError(f"{previous_path} has no {self.id_column!r} column")
+        # NCES columns are compared only if both exports have them, and
+        # anything else the snapshot has is ours to carry forward.
+        self.compared = [
+            name for name in self.fieldnames if name in previous_fieldnames
+        ]
+        self.derived = list(derived_columns) + [
+            name
+            for name in previous_fieldnames
+            if name not in self.fieldnames and name not in derived_columns
+        ]
+        self.counts: Counter[str] = Counter()
+        # Rows redone only because their last geocode or scrape failed.
+        self.retried = 0
+        # (ID, change) for every row that isn't unchanged, removals last.
+        self.changes: list[tuple[str, str]] = []
+        self._previous: dict[str, Snapshot] = {}
+        for row in read_rows(previous_path):
+            self._previous[row[self.id_column]] = Snapshot(
+                content=content_hash(row, self.compared),
+                address=row_cache_key(row),
+                derived=tuple(row.get(name) or "" for name in self.derived),
+                failed=bool(derived_columns)
+                and not any(row.get(name) for name in derived_columns),
+            )
+
+    @property
+    def output_fieldnames(self) -> list[str]:
+        return self.fieldnames + self.derived
+
+    def classify(self, row: Row) -> str:
+        previous = self._previous.get(row[self.id_column])
+        if previous is None:
+            return ADDED
+        if content_hash(row, self.compared) == previous.content:
+            return UNCHANGED
+        if row_cache_key(row) == previous.address:
+            return CHANGED
+        return MOVED
+
+    def rows(self) -> t.Iterator[tuple[bool, Row]]:
+        """
+        Yield each row of the new export with whether it's stale: added,
+        moved, or failed last time. Rows that aren't stale already have
+        their derived columns carried forward; stale rows have them blank.
+
+        Once exhausted, `counts` and `changes` cover every change, removals
+        included.
+        """
+        seen = set()
+        for row in read_rows(self.current_path):
+            row.pop(None, None)
+            row_id = row[self.id_column]
+            seen.add(row_id)
+            change = self.classify(row)
+            self.counts[change] += 1
+            if change != UNCHANGED:
+                self.changes.append((row_id, change))
+            stale = change in STALE
+            if not stale and self._previous[row_id].failed:
+                stale = True
+                self.retried += 1
+            if stale:
+                row.update(dict.fromkeys(self.derived, ""))
+            else:
+                row.update(zip(self.derived, self._previous[row_id].derived))
+            yield stale, row
+        for row_id in self._previous:
+            if row_id not in seen:
+                self.counts[REMOVED] += 1
+                self.changes.append((row_id, REMOVED))
+
+    def summary(self) -> str:
+        summary = ", ".join(f"{self.counts[change]} {change}" for change in CHANGES)
+        if self.retried:
+            summary += f" ({self.retried} retried after failing last time)"
+        return summary
+
+
+def open_refresh(
+    previous_path: str, current_path: str, derived_columns: t.Sequence[str] = ()
+) -> Refresh:
+    try:
+        return Refresh(previous_path, current_path, derived_columns)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+
+def finish_refresh(refresh: Refresh, changes_path: str | None) -> None:
+    if changes_path:
+        with atomic_output(changes_path) as changes_file:
+            writer = csv.writer(changes_file)
+            writer.writerow([refresh.id_column, "Change"])
+            writer.writerows(refresh.changes)
+    print(refresh.summary(), file=sys.stderr)
+
+
+def output_file(stack: contextlib.ExitStack, output_path: str | None) -> t.IO[str]:
+    if output_path:
+        return stack.enter_context(atomic_output(output_path))
+    return sys.stdout
+
+
+@click.group()
+def main():
+    pass
+
+
+def refresh_arguments(func: t.Callable) -> t.Callable:
+    options = [
+        click.argument("previous", type=click.Path(exists=True, dir_okay=False)),
+        click.argument("current", type=click.Path(exists=True, dir_okay=False)),
+        click.option(
+            "--changes",
+            "changes_path",
+            type=click.Path(dir_okay=False),
+            help="Write each row's NCES ID and how it changed to this CSV.",
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def output_option(func: t.Callable) -> t.Callable:
+    return click.option(
+        "--output",
+        "-o",
+        "output_path",
+        type=click.Path(dir_okay=False),
+        help="Write to this file, atomically at the end, instead of stdout.",
+    )(func)
+
+
+@main.command()
+@refresh_arguments
+def diff(previous: str, current: str, changes_path: str | None):
+    """
+    Compare a new NCES export with the previous one, or with a snapshot
+    derived from it, by NCES ID.
+    """
+    refresh = open_refresh(previous, current)
+    for _ in refresh.rows():
+        pass
+    finish_refresh(refresh, changes_path)
+
+
+@main.command()
+@stats_options
+@refresh_arguments
+@output_option
+@click.option(
+    "--api_key",
+    prompt="Google Maps API Key",
+    help="Your Google Maps Geocoding API key.",
+)
+@click.option(
+    "--concurrency",
+    default=DEFAULT_CONCURRENCY,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of geocoding requests in flight at once.",
+)
+@click.option(
+    "--qps",
+    default=DEFAULT_QPS,
+    show_default=True,
+    type=click.FloatRange(min=0, min_open=True),
+    help="Maximum geocoding requests per second.",
+)
+@click.option(
+    "--max-retries",
+    default=DEFAULT_MAX_RETRIES,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Retries for OVER_QUERY_LIMIT, 5xx and network errors.",
+)
+@click.option(
+    "--api-url",
+    default=GOOGLE_MAPS_API_URL,
+    envvar="GEOCODE_API_URL",
+    help="Geocoding endpoint; point this at a local mock server for testing.",
+)
+@click.option(
+    "--cache",
+    "cache_path",
+    type=click.Path(dir_okay=False),
+    envvar="GEOCODE_CACHE",
+    help="SQLite file to cache geocoding results in across runs.",
+)
+@gazetteer_options
+def schools(
+    previous: str,
+    current: str,
+    changes_path: str | None,
+    output_path: str | None,
+    api_key: str,
+    concurrency: int,
+    qps: float,
+    max_retries: int,
+    api_url: str,
+    cache_path: str | None,
+    gazetteer: Gazetteer | None,
+):
+    """
+    Geocode a new schools export, carrying coordinates forward from the
+    previous geocoded CSV for schools that haven't moved.
+    """
+    derived_columns = GEOCODED_COLUMNS + [GEOCODE_STATUS_COLUMN]
+    if gazetteer is not None:
+        derived_columns.append(PRECISION_COLUMN)
+    refresh = open_refresh(previous, current, derived_columns)
+    # Without --gazetteer, a snapshot that has precisions still gets them
+    # for the rows geocoded again, so the column stays consistent.
+    precise = PRECISION_COLUMN in refresh.derived
+    with contextlib.ExitStack() as stack:
+        out = output_file(stack, output_path)
+        csv_writer = csv.DictWriter(out, fieldnames=refresh.output_fieldnames)
+        csv_writer.writeheader()
+        cache = None
+        if cache_path:
+            cache = GeocodeCache(cache_path)
+            stack.callback(report_cache, cache)
+            STATS.track_cache("geocode", cache)
+
+        async def run():
+            geocoder = AsyncGeocoder(
+                api_key,
+                concurrency=concurrency,
+                qps=qps,
+                max_retries=max_retries,
+                api_url=api_url,
+                cache=cache,
+                gazetteer=gazetteer,
+            )
+
+            async def process(item):
+                stale, row = item
+                if stale:
+                    result = await geocoder.fill_row(row)
+                    row[GEOCODE_STATUS_COLUMN] = (
+                        result.status if result.status in CACHEABLE_STATUSES else ""
+                    )
+                    if precise and gazetteer is None:
+                        row[PRECISION_COLUMN] = (
+                            api_precision(result.location_type)
+                            if result.lat is not None
+                            else ""
+                        )
+                return row
+
+            async with geocoder:
+                async for row in map_ordered(process, refresh.rows(), concurrency * 4):
+                    with STATS.phase("write"):
+                        csv_writer.writerow(row)
+                    STATS.count("rows")
+            print(geocoder.summary(), file=sys.stderr)
+
+        asyncio.run(run())
+    finish_refresh(refresh, changes_path)
+
+
+@main.command()
+@stats_options
+@refresh_arguments
+@output_option
+@click.option(
+    "--workers",
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of districts to work on at once.",
+)
+@click.option(
+    "--max-per-host",
+    default=DEFAULT_MAX_PER_HOST,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum concurrent connections to any one host.",
+)
+@click.option(
+    "--min-delay",
+    default=DEFAULT_MIN_DELAY,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Minimum seconds between requests to the same host.",
+)
+@click.option(
+    "--max-retries",
+    default=DEFAULT_SCRAPE_RETRIES,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Retries for network errors, 429 and 5xx responses.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    envvar="HTTP_CACHE_DIR",
+    help="Cache fetched pages in this directory.",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Serve pages only from --cache-dir; never touch the network.",
+)
+@click.option(
+    "--cache-max-age",
+    default=DEFAULT_MAX_AGE,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Seconds to trust a cached page before revalidating it.",
+)
+@click.option(
+    "--parser",
+    default=DEFAULT_PARSER,
+    show_default=True,
+    type=click.Choice(PARSERS),
+    help="HTML parser for detail pages; lxml is faster if it's installed.",
+)
+def districts(
+    previous: str,
+    current: str,
+    changes_path: str | None,
+    output_path: str | None,
+    workers: int,
+    max_per_host: int,
+    min_delay: float,
+    max_retries: int,
+    cache_dir: str | None,
+    offline: bool,
+    cache_max_age: float,
+    parser: str,
+):
+    """
+    Scrape a new districts export, carrying the scraped columns forward
+    from the previous enhanced CSV for districts that haven't moved.
+    """
+    if offline and not cache_dir:
+        raise click.UsageError("--offline needs --cache-dir.")
+    check_parser(parser)
+    refresh = open_refresh(previous, current, SCRAPED_COLUMNS)
+    cache = None
+    if cache_dir:
+        cache = ResponseCache(cache_dir, offline=offline, max_age=cache_max_age)
+        STATS.track_cache("http", cache)
+    transport = detail_transport(workers, max_per_host, min_delay, cache)
+
+    with contextlib.ExitStack() as stack:
+        out = output_file(stack, output_path)
+        csv_writer = csv.DictWriter(out, fieldnames=refresh.output_fieldnames)
+        csv_writer.writeheader()
+
+        async def run():
+            semaphore = asyncio.Semaphore(workers)
+            scraped = 0
+            failed = 0
+
+            async def process(item):
+                nonlocal scraped, failed
+                stale, district = item
+                if not stale:
+                    return district
+                async with semaphore:
+                    try:
+                        await scrape_district(
+                            client, district, max_retries=max_retries, parser=parser
+                        )
+                        scraped += 1
+                    except Exception as e:  # noqa: BLE001 - logged with its type
+                        # Leave the scraped columns blank, as `web` does.
+                        failed += 1
+                        print(
+                            f"Error processing district ID "
+                            f"{district[refresh.id_column]}: {e!r}",
+                            file=sys.stderr,
+                        )
+                return district
+
+            async with httpx.AsyncClient(timeout=30.0, transport=transport) as client:
+                async for district in map_ordered(process, refresh.rows(), workers * 4):
+                    with STATS.phase("write"):
+                        csv_writer.writerow(district)
+                    STATS.count("rows")
+            print(f"Scraped {scraped} districts", file=sys.stderr)
+            if failed:
+                print(f"{failed} districts could not be scraped", file=sys.stderr)
+            if cache is not None:
+                print(cache.summary(), file=sys.stderr)
+
+        asyncio.run(run())
+    finish_refresh(refresh, changes_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,705 @@
+"""
+A spatial index of geocoded schools, for asking which schools are near a
+point or an address without scanning every CSV.
+
+    python spatial_index.py build data/prelim/*/geocoded_*.csv
+    python spatial_index.py near --lat 47.6062 --lng -122.3321 --radius 5
+    python spatial_index.py near --lat 47.6062 --lng -122.3321 --limit 3
+    python spatial_index.py near --school 530486002475 --limit 5
+    python spatial_index.py near --address "400 Broad St, Seattle, WA 98109" --api_key ABC123
+    python spatial_index.py within --south 47.5 --west -122.45 --north 47.75 --east -122.2
+
+Schools are placed on the unit sphere and kept in a KD-tree, so radius,
+k-nearest and bounding-box queries only visit the parts of the tree near
+the answer. The straight-line (chord) distance between two points on the
+sphere orders them exactly as the great-circle distance does, so the tree
+needs no trigonometry, and reported distances are the equivalent
+haversine distances in kilometres. Working in 3D also means nothing
+special happens at the poles or across the antimeridian.
+
+The index is a SQLite file. The tree's coordinate arrays are stored as
+blobs and loaded in one go when the index is opened; each school's full
+CSV row is fetched by position only when it's in a result. Opening takes
+a few milliseconds, and a query well under one.
+
+Results are CSV with the geocoded files' columns: nearest first, with a
+Distance (km) column, for `near`; by NCES ID for `within`.
+"""
+
+import contextlib
+import csv
+import heapq
+import json
+import math
+import os
+import sqlite3
+import sys
+import typing as t
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+
+import click
+
+from compressed import open_input
+from journal import atomic_output, detect_id_column
+
+DEFAULT_INDEX = "schools.geoindex.sqlite3"
+
+# Bump when the file layout changes; older indexes must be rebuilt.
+INDEX_VERSION = 1
+
+# Mean radius, as used for haversine distances.
+EARTH_RADIUS_KM = 6371.0088
+
+LATITUDE_COLUMN = "Latitude"
+LONGITUDE_COLUMN = "Longitude"
+DISTANCE_COLUMN = "Distance (km)"
+
+# Ranges of the tree this small are scanned rather than split further.
+LEAF_SIZE = 8
+
+# Slack for float error when deciding whether a branch could hold points
+# inside a bounding box; points themselves are checked exactly.
+BOX_EPSILON = 1e-9
+
+# SQLite's default limit on bound parameters is 999.
+ROW_BATCH_SIZE = 500
+
+Point = tuple[float, float, float]
+# a·p >= b, for a point p on the unit sphere.
+HalfSpace = tuple[Point, float]
+Row = dict[str, str]
+
+
+def to_xyz(lat: float, lng: float) -> Point:
+    phi = math.radians(lat)
+    lam = math.radians(lng)
+    return (math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi))
+
+
+def chord_for_km(km: float) -> float:
+    """
+    The chord length, on the unit sphere, of a great-circle distance.
+    """
+    if km >= math.pi * EARTH_RADIUS_KM:
+        return 2.0
+    return 2 * math.sin(km / (2 * EARTH_RADIUS_KM))
+
+
+def km_for_chord(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """
+    Great-circle distance between two points, in kilometres.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_coordinates(row: Row) -> tuple[float, float] | None:
+    """
+    A row's latitude and longitude, or None if it wasn't geocoded.
+    """
+    try:
+        lat = float(row.get(LATITUDE_COLUMN) or "")
+        lng = float(row.get(LONGITUDE_COLUMN) or "")
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def bbox_regions(
+    south: float, west: float, north: float, east: float
+) -> list[list[HalfSpace]]:
+    """
+    Describe a latitude/longitude box as regions of the unit sphere, each
+    the intersection of half-spaces. A point is in the box if it's in any
+    of the regions.
+
+    The box crosses the antimeridian if west > east.
+    """
+    slab: list[HalfSpace] = [
+        ((0.0, 0.0, 1.0), math.sin(math.radians(south))),
+        ((0.0, 0.0, -1.0), -math.sin(math.radians(north))),
+    ]
+    width = (east - west) % 360 or (360 if east != west else 0)
+    if width >= 360:
+        return [slab]
+    # A wedge of longitudes is two half-spaces through the poles, as long
+    # as it's no more than half way round; wider ones are split in two.
+    if width > 180:
+        middle = west + width / 2
+        return bbox_regions(south, west, north, middle) + bbox_regions(
+            south, middle, north, east
+        )
+    w, e = math.radians(west), math.radians(east)
+    return [
+        slab
+        + [
+            ((-math.sin(w), math.cos(w), 0.0), 0.0),
+            ((math.sin(e), -math.cos(e), 0.0), 0.0),
+        ]
+    ]
+
+
+def in_bbox(
+    lat: float, lng: float, south: float, west: float, north: float, east: float
+) -> bool:
+    if not south <= lat <= north:
+        return False
+    if west <= east:
+        return west <= lng <= east
+    return lng >= west or lng <= east
+
+
+class KDTree:
+    """
+    Points on the unit sphere in an implicit KD-tree: the point that splits
+    each range of positions sits in the middle of that range, so the tree
+    needs no pointers and is stored as flat arrays.
+    """
+
+    def __init__(self, x: array, y: array, z: array, axes: array):
+        self.coords = (x, y, z)
+        # The axis each range is split on, at the range's middle position.
+        self.axes = axes
+        self.size = len(x)
+
+    @classmethod
+    def build(cls, points: t.Sequence[Point]) -> tuple[t.Self, list[int]]:
+        """
+        Build a tree from points, returning it along with the index into
+        `points` of the point at each position of the tree.
+        """
+        order = list(range(len(points)))
+        axes = array("b", [-1]) * len(points)
+        stack = [(0, len(points))]
+        while stack:
+            lo, hi = stack.pop()
+            if hi - lo <= LEAF_SIZE:
+                continue
+            # Split along the axis the range is most spread out on.
+            spreads = []
+            for axis in range(3):
+                values = [points[i][axis] for i in order[lo:hi]]
+                spreads.append(max(values) - min(values))
+            axis = spreads.index(max(spreads))
+            order[lo:hi] = sorted(order[lo:hi], key=lambda i: points[i][axis])
+            mid = (lo + hi) // 2
+            axes[mid] = axis
+            stack += [(lo, mid), (mid + 1, hi)]
+        x, y, z = (array("d", (points[i][axis] for i in order)) for axis in range(3))
+        return cls(x, y, z, axes), order
+
+    def nearest(
+        self, point: Point, k: int | None = None, max_chord: float = 2.0
+    ) -> list[tuple[float, int]]:
+        """
+        Return the (chord, position) of the `k` points nearest `point` that
+        are within `max_chord` of it, nearest first. With no `k`, return
+        every point within `max_chord`.
+        """
+        xs, ys, zs = self.coords
+        qx, qy, qz = point
+        bound = max_chord * max_chord
+        # With k, a max-heap of the best k so far; without, everything found.
+        found: list[tuple[float, int]] = []
+        # Ranges still to search, with a lower bound on their squared
+        # distance and the per-axis squared offsets that bound is made of.
+        stack = [(0, self.size, 0.0, (0.0, 0.0, 0.0))]
+        while stack:
+            lo, hi, floor, offsets = stack.pop()
+            if floor > bound:
+                continue
+            if hi - lo <= LEAF_SIZE:
+                candidates = range(lo, hi)
+            else:
+                mid = (lo + hi) // 2
+                axis = self.axes[mid]
+                diff = point[axis] - self.coords[axis][mid]
+                if diff < 0:
+                    near, far = (lo, mid), (mid + 1, hi)
+                else:
+                    near, far = (mid + 1, hi), (lo, mid)
+                far_offsets = list(offsets)
+                far_offsets[axis] = diff * diff
+                stack.append(
+                    (*far, floor - offsets[axis] + diff * diff, tuple(far_offsets))
+                )
+                stack.append((*near, floor, offsets))
+                candidates = range(mid, mid + 1)
+            for i in candidates:
+                dx, dy, dz = xs[i] - qx, ys[i] - qy, zs[i] - qz
+                d2 = dx * dx + dy * dy + dz * dz
+                if d2 > bound:
+                    continue
+                if k is None:
+                    found.append((d2, i))
+                elif len(found) < k:
+                    heapq.heappush(found, (-d2, i))
+                else:
+                    heapq.heappushpop(found, (-d2, i))
+                if k is not None and len(found) == k:
+                    bound = min(bound, -found[0][0])
+        return sorted((math.sqrt(abs(d2)), i) for d2, i in found)
+
+    def within(self, regions: list[list[HalfSpace]]) -> list[int]:
+        """
+        Return the positions of points inside any of the regions, give or
+        take BOX_EPSILON.
+        """
+        xs, ys, zs = self.coords
+
+        def reachable(box: list[float], region: list[HalfSpace]) -> bool:
+            # The most any point in the box can make of a·p is found at one
+            # of its corners, taking each coordinate separately.
+            for (ax, ay, az), b in region:
+                best = (
+                    max(ax * box[0], ax * box[1])
+                    + max(ay * box[2], ay * box[3])
+                    + max(az * box[4], az * box[5])
+                )
+                if best < b - BOX_EPSILON:
+                    return False
+            return True
+
+        def inside(i: int, region: list[HalfSpace]) -> bool:
+            return all(
+                ax * xs[i] + ay * ys[i] + az * zs[i] >= b - BOX_EPSILON
+                for (ax, ay, az), b in region
+            )
+
+        found = []
+        # Ranges still to search, with the box of space they occupy
+        # (min x, max x, min y, max y, min z, max z) and the regions that
+        # box could overlap.
+        stack = [(0, self.size, [-1.0, 1.0, -1.0, 1.0, -1.0, 1.0], regions)]
+        while stack:
+            lo, hi, box, live = stack.pop()
+            live = [region for region in live if reachable(box, region)]
+            if not live:
+                continue
+            if hi - lo <= LEAF_SIZE:
+                candidates = range(lo, hi)
+            else:
+                mid = (lo + hi) // 2
+                axis = self.axes[mid]
+                split = self.coords[axis][mid]
+                below, above = list(box), list(box)
+                below[2 * axis + 1] = split
+                above[2 * axis] = split
+                stack.append((lo, mid, below, live))
+                stack.append((mid + 1, hi, above, live))
+                candidates = range(mid, mid + 1)
+            found += [
+                i for i in candidates if any(inside(i, region) for region in live)
+            ]
+        return found
+
+
+@dataclass(frozen=True)
+class Match:
+    row: Row
+    # None for bounding-box matches.
+    distance_km: float | None = None
+
+
+def build_index(
+    path: str | Path, rows: t.Iterable[Row], fieldnames: t.Sequence[str]
+) -> tuple[int, int, int]:
+    """
+    Build an index of geocoded school rows at `path`, replacing any index
+    already there once the new one is complete. The first row for each
+    NCES ID wins.
+
+    Returns the number of schools indexed, rows skipped for having no
+    coordinates, and duplicate rows skipped.
+    """
+    id_column = detect_id_column(fieldnames)
+    seen = set()
+    points: list[Point] = []
+    coordinates: list[tuple[float, float]] = []
+    kept: list[tuple[str, Row]] = []
+    ungeocoded = duplicates = 0
+    for row in rows:
+        school_id = row.get(id_column) or ""
+        if school_id in seen:
+            duplicates += 1
+            continue
+        if (latlng := parse_coordinates(row)) is None:
+            ungeocoded += 1
+            continue
+        seen.add(school_id)
+        points.append(to_xyz(*latlng))
+        coordinates.append(latlng)
+        kept.append((school_id, {k: v for k, v in row.items() if k is not None}))
+
+    tree, order = KDTree.build(points)
+    meta: dict[str, t.Any] = {
+        "version": INDEX_VERSION,
+        "byteorder": sys.byteorder,
+        "fieldnames": json.dumps(list(fieldnames)),
+        "x": tree.coords[0].tobytes(),
+        "y": tree.coords[1].tobytes(),
+        "z": tree.coords[2].tobytes(),
+        "lat": array("d", (coordinates[i][0] for i in order)).tobytes(),
+        "lng": array("d", (coordinates[i][1] for i in order)).tobytes(),
+        "axes": tree.axes.tobytes(),
+    }
+
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.unlink(missing_ok=True)
+    db = sqlite3.connect(tmp_path)
+    try:
+        with db:
+            db.executescript(
+                """
+                CREATE TABLE meta (key TEXT PRIMARY KEY, value);
+                CREATE TABLE schools (
+                    pos INTEGER PRIMARY KEY, id TEXT NOT NULL, row TEXT NOT NULL
+                );
+                """
+            )
+            db.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+            db.executemany(
+                "INSERT INTO schools VALUES (?, ?, ?)",
+                (
+                    (pos, kept[i][0], json.dumps(kept[i][1], ensure_ascii=False))
+                    for pos, i in enumerate(order)
+                ),
+            )
+            db.execute("CREATE INDEX schools_id ON schools (id)")
+    finally:
+        db.close()
+    os.replace(tmp_path, path)
+    return len(kept), ungeocoded, duplicates
+
+
+class SpatialIndex:
+    """
+    A school index built by build_index, opened read-only for queries.
+    """
+
+    def __init__(self, path: str | Path = DEFAULT_INDEX):
+        if not Path(path).is_file():
+            raise FileNotFoundError(f"No index at {path}; build one first.")
+        self._db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        if int(meta.get("version", 0)) != INDEX_VERSION:
+            raise ValueError(f"{path} is from another version; rebuild it.")
+        self.fieldnames: list[str] = json.loads(meta["fieldnames"])
+
+        def load(name: str, typecode: str) -> array:
+            values = array(typecode)
+            values.frombytes(meta[name])
+            if meta["byteorder"] != sys.byteorder:
+                values.byteswap()
+            return values
+
+        self.tree = KDTree(
+            load("x", "d"), load("y", "d"), load("z", "d"), load("axes", "b")
+        )
+        self._lat = load("lat", "d")
+        self._lng = load("lng", "d")
+
+    def __enter__(self) -> t.Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.tree.size
+
+    def location(self, school_id: str) -> tuple[float, float] | None:
+        """
+        The latitude and longitude of a school in the index, by NCES ID.
+        """
+        found = self._db.execute(
+            "SELECT pos FROM schools WHERE id = ?", (school_id,)
+        ).fetchone()
+        if found is None:
+            return None
+        return self._lat[found[0]], self._lng[found[0]]
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        limit: int | None = 1,
+        radius_km: float | None = None,
+    ) -> list[Match]:
+        """
+        The `limit` schools nearest a point, nearest first, optionally only
+        those within `radius_km`. With no limit, every school within the
+        radius.
+        """
+        if limit is None and radius_km is None:
+            raise ValueError("Give a limit, a radius or both")
+        max_chord = chord_for_km(radius_km) if radius_km is not None else 2.0
+        found = self.tree.nearest(to_xyz(lat, lng), limit, max_chord)
+        rows = self._rows(pos for _, pos in found)
+        return [Match(rows[pos], km_for_chord(chord)) for chord, pos in found]
+
+    def within_radius(self, lat: float, lng: float, radius_km: float) -> list[Match]:
+        return self.nearest(lat, lng, limit=None, radius_km=radius_km)
+
+    def within_bbox(
+        self, south: float, west: float, north: float, east: float
+    ) -> list[Match]:
+        """
+        The schools inside a latitude/longitude box, by NCES ID. The box
+        crosses the antimeridian if west > east.
+        """
+        positions = [
+            pos
+            for pos in self.tree.within(bbox_regions(south, west, north, east))
+            if in_bbox(self._lat[pos], self._lng[pos], south, west, north, east)
+        ]
+        rows = self._rows(positions)
+        matches = [Match(rows[pos]) for pos in positions]
+        id_column = detect_id_column(self.fieldnames)
+        return sorted(matches, key=lambda m: m.row.get(id_column, ""))
+
+    def _rows(self, positions: t.Iterable[int]) -> dict[int, Row]:
+        rows = {}
+        positions = list(positions)
+        for start in range(0, len(positions), ROW_BATCH_SIZE):
+            batch = positions[start : start + ROW_BATCH_SIZE]
+            rows.update(
+                (pos, json.loads(row))
+                for pos, row in self._db.execute(
+                    f"SELECT pos, row FROM schools WHERE pos IN "
+                    f"({', '.join('?' * len(batch))})",
+                    batch,
+                )
+            )
+        return rows
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def read_geocoded(paths: t.Iterable[str]) -> tuple[list[str], t.Iterator[Row]]:
+    """
+    The combined columns of several geocoded CSVs, and their rows.
+    """
+    paths = list(paths)
+    fieldnames: list[str] = []
+    for path in paths:
+        with open_input(path, newline="") as f:
+            for name in csv.DictReader(f).fieldnames or []:
+                if name not in fieldnames:
+                    fieldnames.append(name)
+
+    def rows() -> t.Iterator[Row]:
+        for path in paths:
+            with open_input(path, newline="") as f:
+                yield from csv.DictReader(f)
+
+    return fieldnames, rows()
+
+
+def open_index(path: str) -> SpatialIndex:
+    try:
+        return SpatialIndex(path)
+    except (FileNotFoundError, ValueError) as e:
+        raise click.ClickException(str(e))
+
+
+def write_matches(
+    matches: list[Match],
+    fieldnames: list[str],
+    output_path: str | None,
+    with_distance: bool,
+) -> None:
+    if with_distance:
+        fieldnames = [DISTANCE_COLUMN] + fieldnames
+    with contextlib.ExitStack() as stack:
+        out = (
+            stack.enter_context(atomic_output(output_path))
+            if output_path
+            else sys.stdout
+        )
+        csv_writer = csv.DictWriter(out, fieldnames=fieldnames)
+        csv_writer.writeheader()
+        for match in matches:
+            row = match.row
+            if with_distance and match.distance_km is not None:
+                row = {DISTANCE_COLUMN: f"{match.distance_km:.3f}", **row}
+            csv_writer.writerow(row)
+    print(f"{len(matches)} schools", file=sys.stderr)
+
+
+output_option = click.option(
+    "--output",
+    "-o",
+    "output_path",
+    type=click.Path(dir_okay=False),
+    help="Write the CSV here (atomically) instead of stdout.",
+)
+
+
+@click.group()
+@click.option(
+    "--index",
+    "index_path",
+    default=DEFAULT_INDEX,
+    show_default=True,
+    envvar="SCHOOL_INDEX",
+    type=click.Path(dir_okay=False),
+    help="SQLite file holding the index.",
+)
+@click.pass_context
+def main(ctx: click.Context, index_path: str):
+    """
+    Find geocoded schools near a point, near an address, or in a box.
+    """
+    ctx.obj = index_path
+
+
+@main.command()
+@click.argument(
+    "paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.pass_obj
+def build(index_path: str, paths: tuple[str, ...]):
+    """
+    Build the index from geocoded school CSVs, replacing any old one.
+    """
+    fieldnames, rows = read_geocoded(paths)
+    try:
+        count, ungeocoded, duplicates = build_index(index_path, rows, fieldnames)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(
+        f"Indexed {count} schools from {len(paths)} files into {index_path} "
+        f"({ungeocoded} without coordinates, {duplicates} duplicates skipped)",
+        file=sys.stderr,
+    )
+
+
+@main.command()
+@click.option("--lat", type=click.FloatRange(-90, 90), help="Latitude to search from.")
+@click.option(
+    "--lng", type=click.FloatRange(-180, 180), help="Longitude to search from."
+)
+@click.option("--school", "school_id", help="Search from this school, by NCES ID.")
+@click.option("--address", help="Search from this address, geocoded first.")
+@click.option(
+    "--api_key",
+    envvar="GOOGLE_MAPS_API_KEY",
+    help="Google Maps Geocoding API key, for --address.",
+)
+@click.option(
+    "--api-url",
+    envvar="GEOCODE_API_URL",
+    help="Geocoding endpoint, if not Google's; point this at a local mock "
+    "server for testing.",
+)
+@click.option(
+    "--radius",
+    "radius_km",
+    type=click.FloatRange(min=0),
+    help="Only schools within this many kilometres.",
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    help="At most this many schools. Defaults to 1 without --radius.",
+)
+@output_option
+@click.pass_obj
+def near(
+    index_path: str,
+    lat: float | None,
+    lng: float | None,
+    school_id: str | None,
+    address: str | None,
+    api_key: str | None,
+    api_url: str | None,
+    radius_km: float | None,
+    limit: int | None,
+    output_path: str | None,
+):
+    """
+    Find the schools nearest a point, a school or an address, nearest
+    first.
+    """
+    origins = [lat is not None or lng is not None, bool(school_id), bool(address)]
+    if sum(origins) != 1:
+        raise click.UsageError("Give one of --lat/--lng, --school or --address.")
+    if (lat is None) != (lng is None):
+        raise click.UsageError("--lat and --lng go together.")
+    if address and not api_key:
+        raise click.UsageError("--address needs --api_key.")
+    if limit is None and radius_km is None:
+        limit = 1
+
+    with open_index(index_path) as index:
+        if school_id:
+            location = index.location(school_id)
+            if location is None:
+                raise click.ClickException(f"School {school_id} isn't in the index.")
+            lat, lng = location
+        elif address:
+            # geocode.py brings in httpx, which only --address needs.
+            from geocode import GOOGLE_MAPS_API_URL, geocode_address
+
+            lat, lng = geocode_address(address, api_key, api_url or GOOGLE_MAPS_API_URL)
+            if lat is None or lng is None:
+                raise click.ClickException(f"Couldn't geocode {address!r}.")
+        assert lat is not None and lng is not None
+
+        # A school is nearest to itself, so leave it out.
+        matches = index.nearest(
+            lat,
+            lng,
+            limit=limit + 1 if school_id and limit else limit,
+            radius_km=radius_km,
+        )
+        if school_id:
+            id_column = detect_id_column(index.fieldnames)
+            matches = [m for m in matches if m.row.get(id_column) != school_id]
+            matches = matches[:limit]
+        write_matches(matches, index.fieldnames, output_path, with_distance=True)
+
+
+@main.command()
+@click.option("--south", required=True, type=click.FloatRange(-90, 90))
+@click.option("--west", required=True, type=click.FloatRange(-180, 180))
+@click.option("--north", required=True, type=click.FloatRange(-90, 90))
+@click.option("--east", required=True, type=click.FloatRange(-180, 180))
+@output_option
+@click.pass_obj
+def within(
+    index_path: str,
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    output_path: str | None,
+):
+    """
+    Find the schools inside a latitude/longitude box. A box with west
+    greater than east crosses the antimeridian.
+    """
+    if south > north:
+        raise click.UsageError("--south must not be north of --north.")
+    with open_index(index_path) as index:
+        matches = index.within_bbox(south, west, north, east)
+        write_matches(matches, index.fieldnames, output_path, with_distance=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import httpx
+import pytest
+
+from geocode import GeocodeResult, RetryableGeocodeError, parse_geocode_response
+from throttle import is_transient
+
+REQUEST = httpx.Request("GET", "https://maps.example/geocode/json")
+
+
+def response(status_code: int, **kwargs) -> httpx.Response:
+    return httpx.Response(status_code, request=REQUEST, **kwargs)
+
+
+def test_ok_gives_first_result():
+    result = parse_geocode_response(
+        response(
+            200,
+            json={
+                "status": "OK",
+                "results": [
+                    {
+                        "geometry": {
+                            "location": {"lat": 47.6, "lng": -122.3},
+                            "location_type": "ROOFTOP",
+                        }
+                    },
+                    {"geometry": {"location": {"lat": 0, "lng": 0}}},
+                ],
+            },
+        )
+    )
+    assert result == GeocodeResult(47.6, -122.3, "OK", "ROOFTOP")
+
+
+def test_zero_results_is_an_answer():
+    result = parse_geocode_response(
+        response(200, json={"status": "ZERO_RESULTS", "results": []})
+    )
+    assert result == GeocodeResult(None, None, "ZERO_RESULTS")
+
+
+@pytest.mark.parametrize("status_code", [500, 502, 503])
+def test_server_errors_are_retried(status_code):
+    with pytest.raises(RetryableGeocodeError, match=str(status_code)):
+        parse_geocode_response(response(status_code, text="Unavailable"))
+
+
+@pytest.mark.parametrize("status", ["OVER_QUERY_LIMIT", "UNKNOWN_ERROR"])
+def test_transient_statuses_are_retried(status):
+    with pytest.raises(RetryableGeocodeError, match=status):
+        parse_geocode_response(response(200, json={"status": status, "results": []}))
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"text": "<html>Proxy error</html>"},
+        {"json": {"results": []}},
+        {"json": {"status": "OK", "results": []}},
+        {"json": {"status": "OK", "results": [{"geometry": {}}]}},
+        {"json": ["not", "an", "object"]},
+    ],
+)
+def test_malformed_200s_are_retried(body):
+    with pytest.raises(RetryableGeocodeError, match="Malformed response"):
+        parse_geocode_response(response(200, **body))
+
+
+def test_client_errors_are_given_up_on():
+    result = parse_geocode_response(response(403, text="Forbidden"))
+    assert result == GeocodeResult(None, None, "HTTP 403")
+
+
+@pytest.mark.parametrize(
+    "error, transient",
+    [
+        (httpx.ConnectError("refused", request=REQUEST), True),
+        (httpx.ReadTimeout("slow", request=REQUEST), True),
+        (httpx.HTTPStatusError("", request=REQUEST, response=response(429)), True),
+        (httpx.HTTPStatusError("", request=REQUEST, response=response(503)), True),
+        (httpx.HTTPStatusError("", request=REQUEST, response=response(404)), False),
+        (ValueError("parse failure"), False),
+    ],
+)
+def test_is_transient(error, transient):
+    assert is_transient(error) is transient
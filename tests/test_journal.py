@@ -0,0 +1,46 @@
+import pytest
+
+from journal import Journal
+
+FIRST = b'{"id": "1", "row": {"Name": "One"}}\n'
+SECOND = b'{"id": "2", "row": {"Name": "Two"}}'
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "run.journal"
+
+
+def test_existing_journal_needs_resume(path):
+    path.write_bytes(FIRST)
+    with pytest.raises(FileExistsError):
+        Journal(path)
+
+
+def test_records_are_replayed_on_resume(path):
+    with Journal(path) as journal:
+        journal.record("1", {"Name": "One"})
+        journal.record("2", {"Name": "Two"})
+    with Journal(path, resume=True) as journal:
+        assert journal.completed == {"1": {"Name": "One"}, "2": {"Name": "Two"}}
+
+
+def test_torn_last_line_is_cut_off(path, capsys):
+    path.write_bytes(FIRST + SECOND[:-9])
+    with Journal(path, resume=True) as journal:
+        assert journal.completed == {"1": {"Name": "One"}}
+        journal.record("3", {"Name": "Three"})
+    assert "Ignoring damaged journal line 2" in capsys.readouterr().err
+    with Journal(path, resume=True) as journal:
+        assert journal.completed == {"1": {"Name": "One"}, "3": {"Name": "Three"}}
+
+
+def test_last_line_missing_only_its_newline_is_kept(path, capsys):
+    path.write_bytes(FIRST + SECOND)
+    with Journal(path, resume=True) as journal:
+        assert set(journal.completed) == {"1", "2"}
+        journal.record("3", {"Name": "Three"})
+    assert capsys.readouterr().err == ""
+    assert path.read_bytes().count(b"\n") == 3
+    with Journal(path, resume=True) as journal:
+        assert set(journal.completed) == {"1", "2", "3"}
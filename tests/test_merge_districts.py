@@ -0,0 +1,174 @@
+import json
+import re
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from merge_districts import (
+    BATCH_SIZE,
+    DATA_SOURCE_FIELD_NAME,
+    DEFAULT_DATA_SOURCE,
+    UNIQUE_FIELD_NAME,
+    Record,
+    iter_batches,
+    plan_merge,
+)
+
+MERGER_JS = Path(__file__).parent.parent / "merge_districts.cjs"
+
+# What existing districts might already say about where their data came from.
+SOURCE_DATES = [
+    None,
+    "NCES-2023",
+    f"NCES-2023, {DEFAULT_DATA_SOURCE}",
+    DEFAULT_DATA_SOURCE,
+    f"{DEFAULT_DATA_SOURCE},NCES-2023",
+]
+
+
+def district_id(n: int) -> str:
+    return f"53{n:05d}"
+
+
+@pytest.fixture
+def target() -> list[Record]:
+    records = []
+    for n in range(60):
+        fields = {UNIQUE_FIELD_NAME: district_id(n), "District-Name": f"District {n}"}
+        if source_date := SOURCE_DATES[n % len(SOURCE_DATES)]:
+            fields[DATA_SOURCE_FIELD_NAME] = source_date
+        records.append(Record(f"rec{n:05d}", fields))
+    return records
+
+
+@pytest.fixture
+def source() -> list[Record]:
+    # 60 districts already in the target, 60 new ones, one without an ID
+    # and one repeated.
+    records = [
+        Record(
+            None,
+            {
+                UNIQUE_FIELD_NAME: district_id(n),
+                "District-Name": f"NCES District {n}",
+                "District-Phone": f"(360)555-{n:04d}",
+                DATA_SOURCE_FIELD_NAME: DEFAULT_DATA_SOURCE,
+            },
+        )
+        for n in range(120)
+    ]
+    records.append(Record(None, {"District-Name": "No ID"}))
+    records.append(records[-2])
+    return records
+
+
+def planned_batches(source: list[Record], target: list[Record]) -> list[dict]:
+    plan = plan_merge(source, target)
+    # As written to and read back from the JSONL plan.
+    return [json.loads(json.dumps(batch)) for batch in iter_batches(plan)]
+
+
+def test_batches_of_at_most_50_updates_first(source, target):
+    batches = planned_batches(source, target)
+    assert [(b["action"], len(b["records"])) for b in batches] == [
+        ("update", 50),
+        ("update", 10),
+        ("create", 50),
+        ("create", 10),
+    ]
+    assert BATCH_SIZE == 50
+
+
+def test_release_is_noted_once_per_record(source, target):
+    batches = planned_batches(source, target)
+    existing = {r.id: r.fields.get(DATA_SOURCE_FIELD_NAME) for r in target}
+    for batch in batches:
+        for record in batch["records"]:
+            # Updates leave it out if the target already notes the release.
+            noted = record["fields"].get(DATA_SOURCE_FIELD_NAME) or existing.get(
+                record.get("id")
+            )
+            sources = [s.strip() for s in noted.split(",")]
+            assert sources.count(DEFAULT_DATA_SOURCE) == 1, record
+    updates = [r for b in batches if b["action"] == "update" for r in b["records"]]
+    by_id = {r["id"]: r["fields"] for r in updates}
+    assert by_id["rec00000"][DATA_SOURCE_FIELD_NAME] == DEFAULT_DATA_SOURCE
+    assert by_id["rec00001"][DATA_SOURCE_FIELD_NAME] == (
+        f"NCES-2023, {DEFAULT_DATA_SOURCE}"
+    )
+    # Already noted, so only the empty phone is filled in.
+    assert by_id["rec00002"] == {
+        "District-Phone": "(360)555-0002",
+        UNIQUE_FIELD_NAME: district_id(2),
+    }
+
+
+def test_existing_values_are_kept(source, target):
+    for batch in planned_batches(source, target):
+        if batch["action"] == "update":
+            assert all("District-Name" not in r["fields"] for r in batch["records"])
+
+
+def test_js_merger_notes_the_same_release():
+    match = re.search(
+        r'^const DATA_SOURCE = "(.*)";$', MERGER_JS.read_text(), re.MULTILINE
+    )
+    assert match is not None
+    assert match.group(1) == DEFAULT_DATA_SOURCE
+
+
+# Runs merge_districts.cjs against in-memory tables, with dryRun off, and
+# prints the batches it sends to AirTable as JSON.
+AIRTABLE_HARNESS = """
+const fs = require("fs");
+const { source, target, script } = JSON.parse(fs.readFileSync(0, "utf8"));
+const batches = [];
+function table(records) {
+  return {
+    selectRecordsAsync: async () => ({
+      records: records.map((r) => ({
+        id: r.id,
+        getCellValue: (name) => r.fields[name] ?? null,
+      })),
+    }),
+    getField: () => true,
+    updateRecordsAsync: async (rs) => batches.push({ action: "update", records: rs }),
+    createRecordsAsync: async (rs) => batches.push({ action: "create", records: rs }),
+  };
+}
+const tables = { "NCES-District-Import": table(source), "District-Table": table(target) };
+const base = { getTable: (name) => tables[name] };
+const output = { markdown: () => {}, table: () => {} };
+const AsyncFunction = (async () => {}).constructor;
+const body = fs
+  .readFileSync(script, "utf8")
+  .replace("const dryRun = true;", "const dryRun = false;");
+new AsyncFunction("base", "output", body)(base, output).then(() =>
+  process.stdout.write(JSON.stringify(batches))
+);
+"""
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_js_merger_sends_the_planned_batches(source, target):
+    def records(rs: list[Record]) -> list[dict]:
+        return [{"id": r.id, "fields": r.fields} for r in rs]
+
+    ran = subprocess.run(
+        ["node", "-e", AIRTABLE_HARNESS],
+        input=json.dumps(
+            {
+                "source": records(source),
+                "target": records(target),
+                "script": str(MERGER_JS),
+            }
+        ),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    sent = json.loads(ran.stdout)
+    planned = planned_batches(source, target)
+    assert [{k: b[k] for k in ("action", "records")} for b in planned] == sent
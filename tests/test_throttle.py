@@ -0,0 +1,57 @@
+import asyncio
+
+from throttle import map_ordered
+
+
+async def collect(func, items, window):
+    return [result async for result in map_ordered(func, items, window)]
+
+
+def test_results_keep_input_order_when_finishing_out_of_order():
+    finished = []
+
+    async def slow_first(n):
+        # Earlier items take longer, so they finish last.
+        await asyncio.sleep((10 - n) * 0.005)
+        finished.append(n)
+        return n * n
+
+    results = asyncio.run(collect(slow_first, range(10), window=10))
+    assert results == [n * n for n in range(10)]
+    assert finished != sorted(finished)
+
+
+def test_window_bounds_read_ahead():
+    started = 0
+    most_ahead = 0
+    yielded = 0
+
+    async def track(n):
+        nonlocal started, most_ahead
+        started += 1
+        most_ahead = max(most_ahead, started - yielded)
+        await asyncio.sleep(0)
+        return n
+
+    async def run():
+        nonlocal yielded
+        results = []
+        async for result in map_ordered(track, range(20), window=3):
+            results.append(result)
+            yielded += 1
+        return results
+
+    assert asyncio.run(run()) == list(range(20))
+    assert most_ahead <= 3
+
+
+def test_async_iterables_are_accepted():
+    async def items():
+        for n in range(5):
+            yield n
+
+    async def double(n):
+        await asyncio.sleep((5 - n) * 0.001)
+        return n * 2
+
+    assert asyncio.run(collect(double, items(), window=2)) == [0, 2, 4, 6, 8]
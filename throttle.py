@@ -0,0 +1,224 @@
+"""
+Small asyncio helpers for being polite to remote services: a token-bucket
+rate limiter, a per-host connection throttle (usable as an httpx
+transport), a transport that times requests for --stats, exponential
+backoff with jitter, retrying GETs, and an order-preserving concurrent
+map.
+"""
+
+import asyncio
+import contextlib
+import random
+import time
+import typing as t
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+
+from instrument import STATS
+
+
+class TokenBucket:
+    """
+    Allow at most `rate` acquisitions per second on average, with bursts of
+    up to `capacity` acquisitions.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available, then take it.
+        """
+        # Holding the lock while sleeping keeps waiters first-come, first-served.
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class HostThrottle:
+    """
+    Limit each host to `max_concurrent` requests in flight, with request
+    starts spaced at least `min_delay` seconds apart.
+    """
+
+    def __init__(self, max_concurrent: int = 4, min_delay: float = 0.0):
+        self.max_concurrent = max_concurrent
+        self.min_delay = min_delay
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._last_start: dict[str, float] = {}
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url: str) -> t.AsyncIterator[None]:
+        """
+        Hold one of the host's connection slots for the duration of the block.
+        """
+        host = urlsplit(url).hostname or ""
+        semaphore = self._semaphores.setdefault(
+            host, asyncio.Semaphore(self.max_concurrent)
+        )
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with semaphore:
+            async with lock:
+                wait = (
+                    self._last_start.get(host, 0.0) + self.min_delay - time.monotonic()
+                )
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._last_start[host] = time.monotonic()
+            yield
+
+
+class ThrottledTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that sends every request through a HostThrottle.
+
+    Sitting below any caching transport, it only slows down requests that
+    actually go out over the network.
+    """
+
+    def __init__(
+        self, throttle: HostThrottle, transport: httpx.AsyncBaseTransport | None = None
+    ):
+        self.throttle = throttle
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        async with self.throttle.slot(str(request.url)):
+            STATS.add_time("throttle", time.perf_counter() - started)
+            return await self.transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that records each request's latency, up to the
+    response headers, in a per-host histogram, and counts response
+    statuses and network errors.
+
+    Sitting directly above the network transport, it only sees requests
+    that actually go out, not cache hits or time spent throttled.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport | None = None):
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not STATS.enabled:
+            return await self.transport.handle_async_request(request)
+        start = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError:
+            STATS.count("http.errors")
+            raise
+        STATS.observe(
+            f"http {urlsplit(str(request.url)).hostname or ''}",
+            time.perf_counter() - start,
+        )
+        STATS.count(f"http.status.{response.status_code}")
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """
+    Return how long to sleep before retry number `attempt` (starting at 0),
+    using exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def is_transient(error: Exception) -> bool:
+    """
+    Return True for errors worth retrying: network trouble, 429 and 5xx.
+    """
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+
+async def get_with_retries(
+    client: httpx.AsyncClient,
+    url: str,
+    max_retries: int = 3,
+    **kwargs: t.Any,
+) -> httpx.Response:
+    """
+    GET `url`, retrying transient failures with backoff.
+
+    Raises the last error if every attempt fails, or straight away for
+    errors that aren't transient (such as a 404).
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            response = await client.get(url, **kwargs)
+            response.raise_for_status()
+            return response
+        except httpx.HTTPError as e:
+            if attempt == max_retries or not is_transient(e):
+                raise
+            STATS.count("http.retries")
+            await asyncio.sleep(backoff_delay(attempt))
+    raise AssertionError("unreachable")
+
+
+async def map_ordered[T, R](
+    func: t.Callable[[T], t.Awaitable[R]],
+    items: t.Iterable[T] | t.AsyncIterable[T],
+    window: int,
+) -> t.AsyncIterator[R]:
+    """
+    Run `func` over `items` concurrently, yielding results in input order.
+
+    At most `window` items are read ahead of the one being yielded, so memory
+    stays flat however long the input is. Limiting how many of those actually
+    hit the network at once is up to `func`.
+    """
+    pending: deque[asyncio.Task[R]] = deque()
+    try:
+        async for item in _aiter(items):
+            pending.append(asyncio.ensure_future(func(item)))
+            if len(pending) >= window:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _aiter[T](items: t.Iterable[T] | t.AsyncIterable[T]) -> t.AsyncIterator[T]:
+    if isinstance(items, t.AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item